@@ -1,3 +1,3 @@
 """q_learning package init — keeps modules importable."""
 
-__all__ = ["sarsa_agent", "sarsa_trainer", "server"]
+__all__ = ["background_learner", "benchmark", "dense_qtable", "linear_sarsa", "meal_env", "metrics", "sarsa_agent", "qtable", "qtable_snapshot", "replay_buffer", "sarsa_journal", "sarsa_trainer", "server", "shared_qtable", "sharded_qtable", "state_encoder", "tiered_qtable", "traffic_capture", "wire_protocol"]
@@ -0,0 +1,200 @@
+"""Asynchronous learner: /feedback enqueues, one thread applies updates in micro-batches.
+
+Request thread chỉ đặt transition vào hàng đợi có giới hạn rồi trả về ngay; thread learner
+gom tối đa `batch_size` transition mỗi lần và gọi OnlineLearningAgent.learn_batch. Checkpoint
+(compaction / save) chạy theo chính sách thời gian hoặc số update.
+
+Replay (nếu agent có replay_buffer) gắn với traffic: mỗi transition mới được áp dụng cho
+thêm ``replay_ratio`` lượt replay, dùng dần lúc hàng đợi rỗng, tối đa ``replay_batch`` mỗi
+vòng. Server rảnh thì không replay; replay không ghi journal mà được checkpoint mang đi.
+"""
+import queue
+import threading
+import time
+
+__all__ = ["BackgroundLearner"]
+
+
+class BackgroundLearner:
+    def __init__(self, agent, max_queue=10000, batch_size=256, overflow="reject", block_timeout=0.1,
+                 checkpoint_interval=60.0, checkpoint_updates=50000, replay_batch=0,
+                 replay_ratio=1.0):
+        """
+        agent: OnlineLearningAgent
+        max_queue: sức chứa hàng đợi
+        batch_size: số transition tối đa mỗi micro-batch
+        overflow: "reject" (từ chối ngay khi đầy) hoặc "block" (chờ tối đa block_timeout giây)
+        checkpoint_interval: checkpoint sau bấy nhiêu giây có update (None = tắt)
+        checkpoint_updates: checkpoint sau bấy nhiêu update (None = tắt)
+        replay_batch: lúc hàng đợi rỗng, replay tối đa bấy nhiêu transition từ
+            agent.replay_buffer mỗi vòng (0 = tắt)
+        replay_ratio: số lượt replay được cấp cho mỗi transition mới đã áp dụng; lượt chưa
+            dùng được cộng dồn tới tối đa batch_size * replay_ratio
+        """
+        if overflow not in ("reject", "block"):
+            raise ValueError(f"unknown overflow policy: {overflow!r}")
+        self.agent = agent
+        self.batch_size = max(1, int(batch_size))
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_updates = checkpoint_updates
+        self.replay_batch = replay_batch
+        self.replay_ratio = replay_ratio
+        self._replay_credit = 0.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._since_checkpoint = 0
+        self._last_checkpoint = time.monotonic()
+        self.accepted = 0
+        self.dropped = 0
+        self.applied = 0
+        self.batches = 0
+        self.errors = 0
+        self.checkpoints = 0
+        self.replayed = 0
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sarsa-learner", daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, transition):
+        """Enqueue (state, action_id, reward, next_state, done). Returns False if dropped."""
+        try:
+            if self.overflow == "block":
+                self._queue.put(transition, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(transition)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.accepted += 1
+        return True
+
+    def submit_many(self, transitions):
+        """Enqueue từng transition; trả về số transition được nhận."""
+        return sum(1 for t in transitions if self.submit(t))
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "queue_capacity": self._queue.maxsize,
+            "overflow": self.overflow,
+            "accepted": self.accepted,
+            "dropped": self.dropped,
+            "applied": self.applied,
+            "batches": self.batches,
+            "errors": self.errors,
+            "checkpoints": self.checkpoints,
+            "replayed": self.replayed,
+            "running": self._thread is not None and self._thread.is_alive(),
+        }
+
+    def _drain(self, timeout):
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _apply(self, batch):
+        try:
+            # journal thì ghi từng batch (rẻ); không có journal thì để checkpoint lo việc save
+            self.agent.learn_batch(batch, persist=self.agent.journal is not None)
+            self.applied += len(batch)
+            self._since_checkpoint += len(batch)
+            if self.replay_batch:
+                self._replay_credit = min(self._replay_credit + len(batch) * self.replay_ratio,
+                                          self.batch_size * self.replay_ratio)
+        except Exception as e:
+            self.errors += 1
+            print(f"Background learner failed on a batch of {len(batch)}: {e}")
+        finally:
+            self.batches += 1
+            for _ in batch:
+                self._queue.task_done()
+
+    def _maybe_checkpoint(self, force=False):
+        if not self._since_checkpoint:
+            return
+        due = force
+        if self.checkpoint_updates and self._since_checkpoint >= self.checkpoint_updates:
+            due = True
+        if self.checkpoint_interval is not None and \
+                time.monotonic() - self._last_checkpoint >= self.checkpoint_interval:
+            due = True
+        if not due:
+            return
+        try:
+            self.agent.compact(wait=force)
+            self.checkpoints += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"Background learner checkpoint failed: {e}")
+        self._since_checkpoint = 0
+        self._last_checkpoint = time.monotonic()
+
+    def _replay(self):
+        n = min(int(self._replay_credit), self.replay_batch)
+        self._replay_credit -= n
+        try:
+            # không journal: replay chỉ tinh chỉnh lại transition đã có trong journal, checkpoint
+            # kế tiếp (đếm qua _since_checkpoint) ghi kết quả ra snapshot
+            n = self.agent.replay(n, persist=False)
+            self.replayed += n
+            self._since_checkpoint += n
+        except Exception as e:
+            self.errors += 1
+            print(f"Background learner replay failed: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._drain(timeout=0.1)
+            if batch:
+                self._apply(batch)
+            elif self._replay_credit >= 1 and getattr(self.agent, "replay_buffer", None) is not None:
+                # hàng đợi rỗng: dùng lượt replay mà traffic gần đây đã cấp
+                self._replay()
+            self._maybe_checkpoint()
+
+    def flush(self, timeout=None):
+        """Chờ tới khi mọi transition đã nhận được áp dụng."""
+        if self._thread is None or not self._thread.is_alive():
+            # không có thread: tự áp dụng phần còn lại
+            while True:
+                batch = self._drain(timeout=0)
+                if not batch:
+                    break
+                self._apply(batch)
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def stop(self, flush=True):
+        """Shutdown hook: (tuỳ chọn) xả hàng đợi, dừng thread và checkpoint lần cuối."""
+        if flush:
+            self.flush()
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if flush:
+            # những gì lọt vào sau lần flush đầu
+            self.flush()
+            self._maybe_checkpoint(force=True)
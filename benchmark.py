@@ -0,0 +1,347 @@
+"""Benchmark the agent and server hot paths on synthetic tables of realistic shape.
+
+Mỗi cấu hình (storage x persistence x số state) chạy trong một process riêng (spawn) để
+startup time và peak RSS không bị lẫn giữa các cấu hình. Đo:
+
+    startup_s         dựng OnlineLearningAgent từ file bảng (+ journal)
+    encode_*_us       StateEncoder: lần đầu (chưa cache) và lặp lại (đã cache)
+    predict_*_us      OnlineLearningAgent.predict (k=5, ~20 action ứng viên)
+    learn_*_us        OnlineLearningAgent.learn (gồm persistence của chế độ đó)
+    handler_*_us      server.predict / server.feedback: validate pydantic + handler
+    save_s            ghi toàn bộ bảng (atomic)
+    peak_rss_mb       RSS đỉnh của process
+
+Ví dụ:
+    python benchmark.py --sizes 4900 100000 --storages dict dense --save-baseline bench_baseline.json
+    python benchmark.py --sizes 4900 100000 --baseline bench_baseline.json   # exit 1 nếu chậm đi
+
+--wire: so sánh endpoint JSON (/predict, /feedback) với MessagePack (/msgpack/...), gọi thẳng
+ASGI app của server trong process (không có socket / uvicorn), cùng agent và cùng request:
+
+    decode_{json,msgpack}_us     parse + validate body /predict (json.loads + pydantic vs msgpack)
+    encode_{json,msgpack}_us     encode response /predict
+    asgi_{json,msgpack}_{predict,feedback}_us   cả request qua app (middleware, routing, handler)
+
+    python benchmark.py --wire --sizes 4900 --storages dict
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    from .state_encoder import StateEncoder
+    from .sarsa_agent import write_table
+except ImportError:
+    from state_encoder import StateEncoder
+    from sarsa_agent import write_table
+
+__all__ = ["synthetic_states", "synthetic_table", "request_mix", "run_config", "run_wire", "compare"]
+
+INGREDIENTS = ["Gạo", "Mì", "Tỏi", "Trứng", "Thịt bò", "Thịt heo", "Gà", "Cá", "Tôm", "Đậu phụ",
+               "Rau muống", "Cải", "Cà chua", "Hành", "Ớt", "Nấm", "Khoai tây", "Cà rốt", "Bún", "Sữa"]
+MEAL_TIMES = ["Ăn sáng", "Ăn trưa", "Ăn tối"]
+PERSISTENCE = ("json", "journal", "sqt")
+
+
+def synthetic_states(n, n_recipes=500, seed=0):
+    """n state khác nhau có dạng server.State (avail / history / context.meal_time)."""
+    rng = random.Random(seed)
+    seen = set()
+    states = []
+    while len(states) < n:
+        avail = rng.sample(INGREDIENTS, rng.randint(2, 8))
+        meal = rng.choice(MEAL_TIMES)
+        history = [rng.randrange(n_recipes) for _ in range(rng.randint(0, 3))]
+        sig = (tuple(sorted(avail)), meal, tuple(history))
+        if sig in seen:
+            continue
+        seen.add(sig)
+        states.append({"avail": avail, "history": history, "context": {"meal_time": meal}})
+    return states
+
+
+def synthetic_table(states, n_recipes=500, actions_per_state=5, seed=0, encoder=None):
+    """Bảng {state_key: {recipe: q}} với key đúng như StateEncoder sinh ra."""
+    encoder = encoder or StateEncoder()
+    rng = np.random.default_rng(seed)
+    table = {}
+    for s in states:
+        acts = rng.choice(n_recipes, size=actions_per_state, replace=False).tolist()
+        table[encoder(s)] = dict(zip(acts, rng.normal(0.0, 0.1, size=actions_per_state).tolist()))
+    return table
+
+
+def request_mix(states, n, n_recipes=500, candidates=20, k=5, seed=1):
+    """n payload /predict và n payload /feedback trên các state có sẵn (phân bố Zipf)."""
+    rng = np.random.default_rng(seed)
+    idx = np.minimum(rng.zipf(1.2, size=2 * n) - 1, len(states) - 1)
+    predicts, feedbacks = [], []
+    for i in range(n):
+        s = states[idx[i]]
+        predicts.append({"state": s, "k": k,
+                         "possible_actions": rng.choice(n_recipes, size=candidates, replace=False).tolist()})
+        feedbacks.append({"state": s, "action": int(rng.integers(n_recipes)), "reward": float(rng.random()),
+                          "next_state": states[idx[n + i]], "done": bool(rng.random() < 0.1)})
+    return predicts, feedbacks
+
+
+def _latencies(fn, items):
+    out = np.empty(len(items))
+    for i, item in enumerate(items):
+        t0 = time.perf_counter()
+        fn(item)
+        out[i] = time.perf_counter() - t0
+    return out * 1e6
+
+
+def _summary(prefix, us):
+    return {f"{prefix}_p50_us": float(np.percentile(us, 50)), f"{prefix}_p95_us": float(np.percentile(us, 95)),
+            f"{prefix}_p99_us": float(np.percentile(us, 99)),
+            f"{prefix}_ops_per_s": float(len(us) / (us.sum() / 1e6)) if us.sum() else 0.0}
+
+
+def run_config(storage, persistence, n_states, n_ops=2000, seed=0):
+    """Chạy một cấu hình trong process hiện tại; trả về dict metric."""
+    logging.disable(logging.INFO)   # đo handler, không đo I/O của log
+    cwd, workdir = os.getcwd(), tempfile.mkdtemp(prefix="sarsa-bench-")
+    os.chdir(workdir)
+    sys.stdout = open(os.devnull, "w")
+    try:
+        from sarsa_agent import OnlineLearningAgent
+        import server
+
+        states = synthetic_states(n_states, seed=seed)
+        table = synthetic_table(states, seed=seed)
+        predicts, feedbacks = request_mix(states, n_ops, seed=seed + 1)
+        path = "bench_table.sqt" if persistence == "sqt" else "bench_table.json"
+        write_table(table, path)
+        del table
+
+        res = {"storage": storage, "persistence": persistence, "n_states": n_states,
+               "table_bytes": os.path.getsize(path)}
+        journal = None if persistence == "json" else "bench_table.journal"
+        t0 = time.perf_counter()
+        agent = OnlineLearningAgent(model_path=path, journal_path=journal, storage=storage,
+                                    compact_every=10 ** 9)
+        res["startup_s"] = time.perf_counter() - t0
+
+        fresh = StateEncoder()
+        res.update(_summary("encode_cold", _latencies(fresh, states[:n_ops])))
+        res.update(_summary("encode_warm", _latencies(fresh, states[:n_ops])))
+        res.update(_summary("predict", _latencies(
+            lambda p: agent.predict(p["state"], p["possible_actions"], k=p["k"]), predicts)))
+        # full-table save per feedback (persistence=json) is slow by design: fewer samples
+        learn_ops = feedbacks if journal else feedbacks[:max(1, min(len(feedbacks), 20))]
+        res.update(_summary("learn", _latencies(
+            lambda f: agent.learn(f["state"], f["action"], f["reward"], f["next_state"], f["done"]), learn_ops)))
+
+        server.agent = agent
+        res.update(_summary("handler_predict", _latencies(
+            lambda p: server.predict(server.PredictRequest(**p)), predicts)))
+        res.update(_summary("handler_feedback", _latencies(
+            lambda f: server.feedback(server.FeedbackPayload(**f)), learn_ops)))
+
+        t0 = time.perf_counter()
+        agent.save(f"saved{os.path.splitext(path)[1]}")
+        res["save_s"] = time.perf_counter() - t0
+        agent.close()
+        res["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        return res
+    finally:
+        sys.stdout.close()
+        sys.stdout = sys.__stdout__
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _asgi_post(app, path, body, content_type):
+    """Một POST qua ASGI app (không socket); trả về (status, body response)."""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+             "query_string": b"", "server": ("bench", 80), "client": ("127.0.0.1", 0),
+             "headers": [(b"content-type", content_type.encode()),
+                         (b"content-length", str(len(body)).encode())]}
+    sent = False
+    out = {"status": None, "body": []}
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            out["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            out["body"].append(message.get("body", b""))
+
+    async def call():
+        await app(scope, receive, send)
+    return call, out
+
+
+def run_wire(storage, n_states, n_ops=2000, seed=0):
+    """JSON vs MessagePack trên cùng agent (journal) và cùng request; trả về dict metric."""
+    import asyncio
+    logging.disable(logging.INFO)
+    cwd, workdir = os.getcwd(), tempfile.mkdtemp(prefix="sarsa-bench-")
+    os.chdir(workdir)
+    sys.stdout = open(os.devnull, "w")
+    try:
+        import msgpack
+        from fastapi.encoders import jsonable_encoder
+        from sarsa_agent import OnlineLearningAgent
+        import server
+        import wire_protocol
+
+        states = synthetic_states(n_states, seed=seed)
+        write_table(synthetic_table(states, seed=seed), "bench_table.json")
+        predicts, feedbacks = request_mix(states, n_ops, seed=seed + 1)
+        agent = OnlineLearningAgent(model_path="bench_table.json", journal_path="bench_table.journal",
+                                    storage=storage, compact_every=10 ** 9)
+        server.agent = agent
+        res = {"storage": storage, "persistence": "wire", "n_states": n_states}
+
+        # codec: chỉ phần framework, không có agent
+        bodies = {"json": [json.dumps(p).encode() for p in predicts],
+                  "msgpack": [msgpack.packb(p) for p in predicts]}
+        res.update(_summary("decode_json", _latencies(
+            lambda b: server.PredictRequest(**json.loads(b)).state.dict(), bodies["json"])))
+        res.update(_summary("decode_msgpack", _latencies(wire_protocol.decode_predict, bodies["msgpack"])))
+        ranked = [agent.predict_ranked(p["state"], p["possible_actions"], p["k"]) for p in predicts]
+        res.update(_summary("encode_json", _latencies(
+            lambda r: json.dumps(jsonable_encoder(
+                {"action": r[0][0][0], "actions": [a for a, _ in r[0]],
+                 "q_values": {str(a): v for a, v in r[0]}, "explored": r[1]})).encode(), ranked)))
+        res.update(_summary("encode_msgpack", _latencies(lambda r: wire_protocol.encode_prediction(*r), ranked)))
+
+        # cả request qua ASGI app
+        loop = asyncio.new_event_loop()
+        fb_bodies = {"json": [json.dumps(f).encode() for f in feedbacks],
+                     "msgpack": [msgpack.packb(f) for f in feedbacks]}
+        routes = {"json": ("/predict", "/feedback", "application/json"),
+                  "msgpack": ("/msgpack/predict", "/msgpack/feedback", wire_protocol.CONTENT_TYPE)}
+        for fmt, (predict_path, feedback_path, content_type) in routes.items():
+            for name, path, items in (("predict", predict_path, bodies[fmt]),
+                                      ("feedback", feedback_path, fb_bodies[fmt])):
+                def post(body):
+                    call, out = _asgi_post(server.app, path, body, content_type)
+                    loop.run_until_complete(call())
+                    if out["status"] != 200:
+                        raise RuntimeError(f"{path}: HTTP {out['status']} {b''.join(out['body'])[:200]!r}")
+                post(items[0])  # warm-up: routing / dependency cache
+                res.update(_summary(f"asgi_{fmt}_{name}", _latencies(post, items)))
+        loop.close()
+        agent.close()
+        return res
+    finally:
+        sys.stdout.close()
+        sys.stdout = sys.__stdout__
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _run_isolated(config, fn=run_config):
+    # spawn: process mới tinh, RSS và thời gian import không lẫn với cấu hình khác
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+        return pool.submit(fn, *config).result()
+
+
+def compare(results, baseline, tolerance=0.2):
+    """So với baseline: metric thời gian/bộ nhớ (đuôi _us, _s, _mb) tăng quá tolerance là regression."""
+    base = {(r["storage"], r["persistence"], r["n_states"]): r for r in baseline}
+    regressions = []
+    for r in results:
+        b = base.get((r["storage"], r["persistence"], r["n_states"]))
+        if b is None:
+            continue
+        for name, value in r.items():
+            if not name.endswith(("_us", "_s", "_mb")) or name not in b or not b[name]:
+                continue
+            ratio = value / b[name]
+            if ratio > 1.0 + tolerance:
+                regressions.append((r["storage"], r["persistence"], r["n_states"], name, b[name], value, ratio))
+    return regressions
+
+
+COLUMNS = ("startup_s", "predict_p50_us", "predict_p99_us", "learn_p50_us", "learn_p99_us",
+           "handler_predict_p50_us", "handler_feedback_p50_us", "save_s", "peak_rss_mb")
+
+
+WIRE_COLUMNS = ("decode_json_p50_us", "decode_msgpack_p50_us", "encode_json_p50_us", "encode_msgpack_p50_us",
+                "asgi_json_predict_p50_us", "asgi_msgpack_predict_p50_us",
+                "asgi_json_feedback_p50_us", "asgi_msgpack_feedback_p50_us")
+
+
+def print_table(results, columns=COLUMNS):
+    head = f"{'storage':8} {'persist':8} {'states':>8} " + " ".join(f"{c:>24}" for c in columns)
+    print(head)
+    for r in results:
+        print(f"{r['storage']:8} {r['persistence']:8} {r['n_states']:>8} "
+              + " ".join(f"{r.get(c, float('nan')):>24.3f}" for c in columns))
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmark SARSA agent / server hot paths")
+    p.add_argument('--sizes', type=int, nargs='+', default=[4900, 100000], help='số state của bảng tổng hợp')
+    p.add_argument('--storages', nargs='+', default=['dict', 'dense', 'tiered'],
+                   choices=['dict', 'dense', 'tiered', 'linear', 'sharded'])
+    p.add_argument('--persistence', nargs='+', default=['journal', 'sqt'], choices=PERSISTENCE,
+                   help='json = save() toàn bảng mỗi feedback (như bản gốc), journal, sqt (+ journal)')
+    p.add_argument('--wire', action='store_true',
+                   help='so sánh endpoint JSON với MessagePack (bỏ qua --persistence)')
+    p.add_argument('--ops', type=int, default=2000, help='số request mỗi loại')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--output', default=None, help='ghi kết quả JSON')
+    p.add_argument('--baseline', default=None, help='so với file kết quả trước; exit 1 nếu có regression')
+    p.add_argument('--save-baseline', default=None, help='ghi kết quả lần này làm baseline')
+    p.add_argument('--tolerance', type=float, default=0.2, help='cho phép chậm/tốn hơn baseline bao nhiêu (0.2 = 20%%)')
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = []
+    for n in args.sizes:
+        for storage in args.storages:
+            if args.wire:
+                print(f"[bench] wire storage={storage} states={n} ...", flush=True)
+                results.append(_run_isolated((storage, n, args.ops, args.seed), run_wire))
+                continue
+            for persistence in args.persistence:
+                print(f"[bench] storage={storage} persistence={persistence} states={n} ...", flush=True)
+                results.append(_run_isolated((storage, persistence, n, args.ops, args.seed)))
+    print_table(results, WIRE_COLUMNS if args.wire else COLUMNS)
+    meta = {"python": sys.version.split()[0], "numpy": np.__version__, "ops": args.ops,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump({"meta": meta, "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for storage, persistence, n, name, old, new, ratio in regressions:
+            print(f"REGRESSION {storage}/{persistence}/{n} {name}: {old:.3f} -> {new:.3f} ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+"""Dense NumPy-backed Q storage.
+
+State key và recipe id được ánh xạ sang chỉ số nguyên liên tục. Q-values nằm trong hai
+pool NumPy dùng chung (cột int32 + value float64); mỗi state sở hữu một lát liên tục
+``[row_start, row_start + row_len)`` kiểu CSR, có chừa chỗ trống (``row_cap``) để thêm
+action mà không phải dịch cả pool. Trong mỗi lát, cột được giữ theo thứ tự tăng dần nên
+tra cứu một loạt action là một lần searchsorted, và chọn greedy là một argmax.
+
+So với dict-of-dicts (~1 dict + N float object cho mỗi state), mỗi entry ở đây chỉ tốn
+12 byte cộng ~16 byte metadata mỗi state.
+"""
+import random
+
+import numpy as np
+
+try:
+    from .sarsa_agent import SARSAAgent, _read_json_table, greedy_in_row
+    from .qtable_snapshot import MappedQTable, canonical_action, is_snapshot
+except ImportError:
+    from sarsa_agent import SARSAAgent, _read_json_table, greedy_in_row
+    from qtable_snapshot import MappedQTable, canonical_action, is_snapshot
+
+__all__ = ["DenseQTable", "DenseSARSAAgent"]
+
+
+def _grown(arr, n):
+    """Copy of `arr` with capacity >= n (doubling)."""
+    cap = max(n, 2 * len(arr), 16)
+    out = np.zeros(cap, dtype=arr.dtype)
+    out[:len(arr)] = arr
+    return out
+
+
+class DenseQTable:
+    def __init__(self, capacity=1024, dtype=np.float64):
+        self.keys = []            # row -> state key
+        self.index = {}           # state key -> row
+        self.action_ids = []      # col -> recipe id
+        self.action_index = {}    # recipe id -> col
+        self.row_start = np.zeros(64, dtype=np.int64)
+        self.row_len = np.zeros(64, dtype=np.int32)
+        self.row_cap = np.zeros(64, dtype=np.int32)
+        self.cols = np.zeros(capacity, dtype=np.int32)
+        self.vals = np.zeros(capacity, dtype=dtype)
+        self.used = 0      # phần pool đã cấp phát
+        self.garbage = 0   # slot bị bỏ lại khi một state được dời đi
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    @property
+    def n_entries(self):
+        return int(self.row_len[:len(self.keys)].sum())
+
+    def nbytes(self):
+        n = len(self.keys)
+        return int(self.cols[:self.used].nbytes + self.vals[:self.used].nbytes
+                   + self.row_start[:n].nbytes + self.row_len[:n].nbytes + self.row_cap[:n].nbytes)
+
+    # --- index ---
+    def row(self, key, create=True):
+        r = self.index.get(key)
+        if r is not None:
+            return r
+        if not create:
+            return -1
+        r = len(self.keys)
+        if r >= len(self.row_start):
+            self.row_start = _grown(self.row_start, r + 1)
+            self.row_len = _grown(self.row_len, r + 1)
+            self.row_cap = _grown(self.row_cap, r + 1)
+        self.keys.append(key)
+        self.index[key] = r
+        self.row_start[r] = self.used
+        self.row_len[r] = 0
+        self.row_cap[r] = 0
+        return r
+
+    def col(self, action, create=True):
+        c = self.action_index.get(action)
+        if c is None and create:
+            c = len(self.action_ids)
+            self.action_ids.append(action)
+            self.action_index[action] = c
+        return -1 if c is None else c
+
+    def cols_for(self, actions, create=False):
+        return np.fromiter((self.col(a, create) for a in actions), dtype=np.int32, count=len(actions))
+
+    def row_view(self, r):
+        lo = int(self.row_start[r])
+        hi = lo + int(self.row_len[r])
+        return self.cols[lo:hi], self.vals[lo:hi]
+
+    # --- allocation ---
+    def _reserve(self, r, need):
+        cap = int(self.row_cap[r])
+        if need <= cap:
+            return
+        new_cap = max(4, 2 * cap, need)
+        start = self.used
+        if start + new_cap > len(self.cols):
+            if self.garbage > self.used // 2:
+                self.compact()
+                start = self.used
+            if start + new_cap > len(self.cols):
+                self.cols = _grown(self.cols, start + new_cap)
+                self.vals = _grown(self.vals, start + new_cap)
+        old = int(self.row_start[r])
+        n = int(self.row_len[r])
+        self.cols[start:start + n] = self.cols[old:old + n]
+        self.vals[start:start + n] = self.vals[old:old + n]
+        self.garbage += cap
+        self.row_start[r] = start
+        self.row_cap[r] = new_cap
+        self.used = start + new_cap
+
+    def compact(self):
+        """Dồn pool: bỏ các slot rác, giữ nguyên slack của từng state."""
+        n = len(self.keys)
+        caps = self.row_cap[:n].astype(np.int64)
+        starts = np.zeros(n, dtype=np.int64)
+        if n:
+            np.cumsum(caps[:-1], out=starts[1:])
+        total = int(caps.sum())
+        cols = np.zeros(max(total, 16), dtype=self.cols.dtype)
+        vals = np.zeros(max(total, 16), dtype=self.vals.dtype)
+        for r in range(n):
+            lo = int(self.row_start[r])
+            ln = int(self.row_len[r])
+            s = int(starts[r])
+            cols[s:s + ln] = self.cols[lo:lo + ln]
+            vals[s:s + ln] = self.vals[lo:lo + ln]
+        self.row_start[:n] = starts
+        self.cols, self.vals = cols, vals
+        self.used = total
+        self.garbage = 0
+
+    # --- values ---
+    def get(self, key, action, default=0.0):
+        r = self.index.get(key)
+        c = self.action_index.get(action)
+        if r is None or c is None:
+            return default
+        rc, rv = self.row_view(r)
+        pos = int(np.searchsorted(rc, c))
+        if pos < len(rc) and rc[pos] == c:
+            return float(rv[pos])
+        return default
+
+    def set(self, key, action, value):
+        r = self.row(key)
+        c = self.col(action)
+        rc, rv = self.row_view(r)
+        n = len(rc)
+        pos = int(np.searchsorted(rc, c))
+        if pos < n and rc[pos] == c:
+            rv[pos] = value
+            return
+        self._reserve(r, n + 1)
+        lo = int(self.row_start[r])
+        # dịch phần đuôi sang phải một ô để giữ cột đã sort
+        self.cols[lo + pos + 1:lo + n + 1] = self.cols[lo + pos:lo + n].copy()
+        self.vals[lo + pos + 1:lo + n + 1] = self.vals[lo + pos:lo + n].copy()
+        self.cols[lo + pos] = c
+        self.vals[lo + pos] = value
+        self.row_len[r] = n + 1
+
+    def ensure(self, key, actions):
+        """Thêm entry 0.0 cho các action chưa có trong state."""
+        r = self.row(key)
+        want = np.unique(self.cols_for(actions, create=True))
+        rc, rv = self.row_view(r)
+        missing = want[~np.isin(want, rc, assume_unique=True)]
+        if not len(missing):
+            return r
+        n = len(rc)
+        merged_cols = np.concatenate([rc, missing])
+        merged_vals = np.concatenate([rv, np.zeros(len(missing), dtype=self.vals.dtype)])
+        order = np.argsort(merged_cols, kind="stable")
+        self._reserve(r, len(merged_cols))
+        lo = int(self.row_start[r])
+        self.cols[lo:lo + len(order)] = merged_cols[order]
+        self.vals[lo:lo + len(order)] = merged_vals[order]
+        self.row_len[r] = n + len(missing)
+        return r
+
+    def values(self, key, actions):
+        """Q-values của `actions` trong state `key` (0.0 nếu chưa có) — một lần searchsorted."""
+        out = np.zeros(len(actions), dtype=np.float64)
+        r = self.index.get(key)
+        if r is None or not self.row_len[r]:
+            return out
+        want = self.cols_for(actions)
+        rc, rv = self.row_view(r)
+        pos = np.minimum(np.searchsorted(rc, want), len(rc) - 1)
+        hit = (want >= 0) & (rc[pos] == want)
+        out[hit] = rv[pos[hit]]
+        return out
+
+    def row_dict(self, r):
+        rc, rv = self.row_view(r)
+        ids = self.action_ids
+        return {ids[c]: v for c, v in zip(rc.tolist(), rv.tolist())}
+
+    def items(self):
+        for r, key in enumerate(self.keys):
+            yield key, self.row_dict(r)
+
+    @classmethod
+    def from_csr(cls, keys, indptr, actions, values, dtype=np.float64):
+        """Dựng bảng từ dạng CSR (như snapshot .sqt) bằng vài phép NumPy, không slack."""
+        n_entries = len(actions)
+        t = cls(capacity=max(n_entries, 16), dtype=dtype)
+        n = len(keys)
+        t.keys = list(keys)
+        t.index = {k: i for i, k in enumerate(t.keys)}
+        ids, inverse = np.unique(np.asarray(actions), return_inverse=True)
+        t.action_ids = ids.tolist()
+        t.action_index = {a: c for c, a in enumerate(t.action_ids)}
+        indptr = np.asarray(indptr, dtype=np.int64)
+        lens = np.diff(indptr)
+        rows = np.repeat(np.arange(n), lens)
+        order = np.lexsort((inverse, rows))
+        t.cols[:n_entries] = inverse[order]
+        t.vals[:n_entries] = np.asarray(values)[order]
+        if n:
+            t.row_start = indptr[:-1].copy()
+            t.row_len = lens.astype(np.int32)
+            t.row_cap = lens.astype(np.int32)
+        t.used = n_entries
+        return t
+
+    @classmethod
+    def from_snapshot(cls, snap, dtype=np.float64):
+        keys = [snap.key_at(i) for i in range(len(snap))]
+        return cls.from_csr(keys, snap.indptr, snap.actions, snap.values, dtype=dtype)
+
+
+class DenseSARSAAgent(SARSAAgent):
+    """SARSAAgent với DenseQTable thay cho defaultdict; cùng API choose_action/update/save/load.
+
+    Action id được chuẩn hoá về int ("3" -> 3) khi load nên không còn cặp key trùng.
+    """
+
+    def _empty_table(self):
+        return DenseQTable()
+
+    def choose_action(self, state, actions=None):
+        """Epsilon-greedy; nhánh khai thác là một argmax vector hoá."""
+        key = self.state_to_key(state)
+        actions = self.actions if actions is None else list(actions)
+        if random.random() < self.epsilon:
+            return random.choice(actions)
+        if not actions:
+            r = self.q.row(key, create=False)
+            if r < 0 or not self.q.row_len[r]:
+                raise IndexError("no actions to choose from")
+            rc, rv = self.q.row_view(r)
+            ties = np.flatnonzero(rv == rv.max())
+            return self.q.action_ids[int(rc[random.choice(ties)])]
+        vals = self.q.values(key, actions)
+        ties = np.flatnonzero(vals == vals.max())
+        return actions[int(ties[0]) if len(ties) == 1 else int(random.choice(ties))]
+
+    def update(self, state, action, reward, next_state, next_action, done):
+        s_key = self.state_to_key(state)
+        s_next_key = self.state_to_key(next_state)
+        q_sa = self.q.get(s_key, action)
+        q_snext_anext = 0.0 if done else self.q.get(s_next_key, next_action)
+        td_target = reward + (0 if done else self.gamma * q_snext_anext)
+        td_error = td_target - q_sa
+        self.q.set(s_key, action, q_sa + self.alpha * td_error)
+        return td_error
+
+    # --- storage API ---
+    def q_values(self, key):
+        r = self.q.row(key, create=False)
+        return {} if r < 0 else self.q.row_dict(r)
+
+    def get_q(self, key, action):
+        return self.q.get(key, action)
+
+    def set_q(self, key, action, value):
+        self.q.set(key, action, value)
+
+    def greedy_action(self, key, actions):
+        """set (SARSA bootstrap của OnlineLearningAgent): O(số entry của state), không dựng
+        lại cả catalog; list: một argmax vector hoá trên `actions`."""
+        r = self.q.row(key, create=False)
+        if r < 0 or not self.q.row_len[r] or not actions:
+            return None
+        if isinstance(actions, (set, frozenset)):
+            rc, rv = self.q.row_view(r)
+            ids = self.q.action_ids
+            return greedy_in_row(((ids[c], v) for c, v in zip(rc.tolist(), rv.tolist())), actions)
+        if not isinstance(actions, list):
+            actions = list(actions)
+        return actions[int(np.argmax(self.q.values(key, actions)))]
+
+    def top_k(self, key, actions, k):
+        """Top-k bằng argpartition (O(n)) rồi chỉ sort k phần tử được chọn."""
+        n = len(actions)
+        if not n:
+            return []
+        vals = self.q.values(key, actions)
+        # hoán vị ngẫu nhiên trước để các action hoà điểm có cơ hội như nhau
+        perm = np.random.permutation(n)
+        pv = vals[perm]
+        if k < n:
+            idx = np.argpartition(-pv, k - 1)[:k]
+        else:
+            idx = np.arange(n)
+        idx = idx[np.argsort(-pv[idx], kind="stable")]
+        return [(actions[int(perm[i])], float(pv[i])) for i in idx]
+
+    def _items(self):
+        return self.q.items()
+
+    def load(self, path=None):
+        path = path or self.q_table_path
+        if is_snapshot(path):
+            self.q = DenseQTable.from_snapshot(MappedQTable(path))
+            return
+        keys, indptr, actions, values = [], [0], [], []
+        for k, v in _read_json_table(path).items():
+            entry = {}
+            for ak, av in v.items():
+                try:
+                    entry[canonical_action(ak)] = float(av)
+                except (TypeError, ValueError):
+                    pass
+            keys.append(k)
+            actions.extend(entry.keys())
+            values.extend(entry.values())
+            indptr.append(len(actions))
+        self.q = DenseQTable.from_csr(keys, indptr, actions, values)
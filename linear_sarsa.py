@@ -0,0 +1,290 @@
+"""Linear function-approximation SARSA over hashed features.
+
+Q(s, a) = tổng trọng số của các feature (feature của state) x (recipe id), mỗi cặp được
+hash vào một vector trọng số NumPy kích thước cố định ``n_features``. Feature của state
+lấy từ key chuẩn của StateEncoder (``avail=...|meal_time=...|history=...``):
+
+    bias, meal=<meal_time>, avail=<nguyên liệu> (mỗi nguyên liệu một feature),
+    hist=<món trong history>, last=<món gần nhất>
+
+Key không đúng dạng đó (ví dụ observation của gym, hay key_format="hash") chỉ có
+``bias`` và ``key=<key>`` — khi đó agent gần như bảng tra cứu có hash collision.
+
+Bộ nhớ không đổi theo số state, state chưa gặp vẫn có Q nhờ feature chung, và chấm điểm
+một loạt action ứng viên là một phép gather + sum trên mảng chỉ số (F x A).
+
+Mỗi update chia bước đều cho F feature đang bật, nên Q(s, a) dịch đúng ``alpha * td_error``
+như bản tabular (bỏ qua collision); nhờ vậy ``set_q`` (dùng khi replay journal) cũng là
+một phép chiếu đưa Q(s, a) về đúng giá trị đã ghi.
+"""
+import os
+import random
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+
+try:
+    from .sarsa_agent import SARSAAgent
+    from .qtable_snapshot import canonical_action, load_table
+    from .state_encoder import parse_legacy_key
+except ImportError:
+    from sarsa_agent import SARSAAgent
+    from qtable_snapshot import canonical_action, load_table
+    from state_encoder import parse_legacy_key
+
+__all__ = ["HashedLinearQ", "LinearSARSAAgent", "state_features"]
+
+FORMAT = "linear-sarsa"
+FORMAT_VERSION = 1
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MIX1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX2 = np.uint64(0x94D049BB133111EB)
+
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _mix(h):
+    """splitmix64 finalizer, vectorized over a uint64 array."""
+    h = h ^ (h >> np.uint64(30))
+    h = h * _MIX1
+    h = h ^ (h >> np.uint64(27))
+    h = h * _MIX2
+    return h ^ (h >> np.uint64(31))
+
+
+def state_features(key):
+    """Tên các feature của state `key` (tuple str)."""
+    parts = parse_legacy_key(key) if isinstance(key, str) else None
+    if parts is None:
+        return ("bias", f"key={key}")
+    avail, meal_time, history = parts
+    feats = ["bias", f"meal={meal_time}"]
+    feats.extend(f"avail={a}" for a in avail)
+    feats.extend(f"hist={h}" for h in history)
+    if history:
+        feats.append(f"last={history[-1]}")
+    return tuple(feats)
+
+
+class HashedLinearQ:
+    def __init__(self, n_features=2 ** 20, dtype=np.float64, cache_size=65536):
+        """
+        n_features: kích thước vector trọng số (số bucket hash)
+        cache_size: số state được nhớ hash feature (LRU)
+        """
+        self.n_features = int(n_features)
+        self.w = np.zeros(self.n_features, dtype=dtype)
+        self.updates = 0
+        self._codes = {}
+        self._state_hashes = lru_cache(maxsize=cache_size)(self._hash_state)
+
+    @staticmethod
+    def _hash_state(key):
+        return np.fromiter((_hash64(f) for f in state_features(key)), dtype=np.uint64)
+
+    def _action_codes(self, actions):
+        codes = self._codes
+        out = np.empty(len(actions), dtype=np.uint64)
+        for i, a in enumerate(actions):
+            c = codes.get(a)
+            if c is None:
+                ca = canonical_action(a)
+                c = ca & 0xFFFFFFFFFFFFFFFF if isinstance(ca, int) else _hash64(f"action={ca}")
+                codes[a] = c
+            out[i] = c
+        return out
+
+    def indices(self, key, actions):
+        """Chỉ số trọng số dạng (F, A): feature f của state x action a."""
+        hs = self._state_hashes(key)
+        with np.errstate(over="ignore"):
+            h = _mix(hs[:, None] ^ (self._action_codes(actions)[None, :] * _GOLDEN))
+        return (h % np.uint64(self.n_features)).astype(np.int64)
+
+    def values(self, key, actions):
+        """Q-values của `actions` trong state `key` — một phép gather + sum."""
+        if not len(actions):
+            return np.zeros(0)
+        return self.w[self.indices(key, actions)].sum(axis=0)
+
+    def get(self, key, action):
+        return float(self.values(key, (action,))[0])
+
+    def add(self, key, action, delta):
+        """Dịch Q(key, action) thêm `delta`, chia đều cho các feature đang bật."""
+        idx = self.indices(key, (action,))[:, 0]
+        np.add.at(self.w, idx, delta / len(idx))
+        self.updates += 1
+
+    def set(self, key, action, value):
+        self.add(key, action, value - self.get(key, action))
+
+    def nbytes(self):
+        return int(self.w.nbytes)
+
+    def stats(self):
+        return {
+            "n_features": self.n_features,
+            "nonzero_weights": int(np.count_nonzero(self.w)),
+            "weight_bytes": self.nbytes(),
+            "updates": self.updates,
+        }
+
+
+class LinearSARSAAgent(SARSAAgent):
+    """SARSA với Q xấp xỉ tuyến tính trên feature hash; cùng API với SARSAAgent.
+
+    File lưu là .npz (trọng số + metadata). load() một bảng tabular (JSON hoặc .sqt) thì
+    fit trọng số theo bảng đó; init_from dùng cách này để khởi tạo khi chưa có file .npz.
+    """
+
+    def __init__(self, actions, n_features=2 ** 20, init_from=None, row_actions_limit=65536, **kwargs):
+        """
+        row_actions_limit: số state (LRU) được nhớ tập action đã học, dùng cho greedy_action
+        """
+        self.n_features = n_features
+        self.row_actions_limit = max(1, int(row_actions_limit))
+        self._row_actions = OrderedDict()   # state key -> {action đã được update / set / fit}
+        super().__init__(actions, **kwargs)
+        if init_from and not os.path.exists(self.q_table_path) and os.path.exists(init_from):
+            n = self.fit_table(load_table(init_from))
+            print(f"Initialized linear SARSA weights from {init_from} ({n} entries)")
+
+    def _empty_table(self):
+        return HashedLinearQ(self.n_features)
+
+    def choose_action(self, state, actions=None):
+        key = self.state_to_key(state)
+        actions = self.actions if actions is None else list(actions)
+        if random.random() < self.epsilon:
+            return random.choice(actions)
+        vals = self.q.values(key, actions)
+        ties = np.flatnonzero(vals == vals.max())
+        return actions[int(ties[0]) if len(ties) == 1 else int(random.choice(ties))]
+
+    def update(self, state, action, reward, next_state, next_action, done):
+        s_key = self.state_to_key(state)
+        s_next_key = self.state_to_key(next_state)
+        q_sa = self.q.get(s_key, action)
+        q_snext_anext = 0.0 if done else self.q.get(s_next_key, next_action)
+        td_target = reward + (0 if done else self.gamma * q_snext_anext)
+        td_error = td_target - q_sa
+        self.q.add(s_key, action, self.alpha * td_error)
+        self._touch(s_key, action)
+        return td_error
+
+    def _touch(self, key, action):
+        acts = self._row_actions.get(key)
+        if acts is None:
+            acts = self._row_actions[key] = set()
+            if len(self._row_actions) > self.row_actions_limit:
+                self._row_actions.popitem(last=False)
+        else:
+            self._row_actions.move_to_end(key)
+        acts.add(action)
+
+    # --- storage API ---
+    def q_values(self, key):
+        return dict(zip(self.actions, self.q.values(key, self.actions).tolist()))
+
+    def get_q(self, key, action):
+        return self.q.get(key, action)
+
+    def set_q(self, key, action, value):
+        self.q.set(key, action, value)
+        self._touch(key, action)
+
+    def greedy_action(self, key, actions):
+        """set (SARSA bootstrap của OnlineLearningAgent): chỉ chấm các action state này đã học
+        cộng một action chưa học (đại diện cho phần còn lại), O(số action của state) thay vì cả
+        catalog; None nếu state chưa học action nào (ví dụ ngay sau khi load .npz).
+        list: chấm mọi action trong `actions`."""
+        if not actions:
+            return None
+        if isinstance(actions, (set, frozenset)):
+            seen = self._row_actions.get(key)
+            if not seen:
+                return None
+            cands = [a for a in seen if a in actions]
+            if len(cands) < len(actions):
+                for a in actions:
+                    if a not in seen:
+                        cands.append(a)
+                        break
+            return cands[int(np.argmax(self.q.values(key, cands)))]
+        if not isinstance(actions, list):
+            actions = list(actions)
+        return actions[int(np.argmax(self.q.values(key, actions)))]
+
+    def top_k(self, key, actions, k):
+        n = len(actions)
+        if not n:
+            return []
+        vals = self.q.values(key, actions)
+        # hoán vị ngẫu nhiên trước để các action hoà điểm có cơ hội như nhau
+        perm = np.random.permutation(n)
+        pv = vals[perm]
+        idx = np.argpartition(-pv, k - 1)[:k] if k < n else np.arange(n)
+        idx = idx[np.argsort(-pv[idx], kind="stable")]
+        return [(actions[int(perm[i])], float(pv[i])) for i in idx]
+
+    def fit_table(self, table, epochs=3, lr=0.5):
+        """Fit trọng số theo bảng tabular {key: {action: value}}; trả về số entry."""
+        entries = []
+        for key, row in table.items():
+            for a, v in row.items():
+                try:
+                    entries.append((key, canonical_action(a), float(v)))
+                except (TypeError, ValueError):
+                    # giá trị hỏng (ví dụ dict lồng nhau) bị bỏ qua như load() của bảng tabular
+                    pass
+        for key, action, _ in entries:
+            self._touch(key, action)
+        for _ in range(epochs):
+            random.shuffle(entries)
+            for key, action, value in entries:
+                self.q.add(key, action, lr * (value - self.q.get(key, action)))
+        return len(entries)
+
+    # --- persistence ---
+    def snapshot(self):
+        return {"weights": self.q.w.copy(), "n_features": self.q.n_features}
+
+    def dump(self, table, path):
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, format=np.array(FORMAT), version=np.array(FORMAT_VERSION),
+                     n_features=np.array(table["n_features"]), weights=table["weights"])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def save(self, path=None):
+        path = path or self.q_table_path
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.dump(self.snapshot(), path)
+        print(f"Linear SARSA weights saved to {path}")
+
+    def load(self, path=None):
+        path = path or self.q_table_path
+        with open(path, "rb") as f:
+            is_npz = f.read(2) == b"PK"
+        self._row_actions = OrderedDict()
+        if not is_npz:
+            # bảng tabular: bắt đầu từ trọng số 0 rồi fit theo bảng
+            self.q = self._empty_table()
+            self.fit_table(load_table(path))
+            return
+        with np.load(path) as data:
+            if str(data["format"]) != FORMAT:
+                raise ValueError(f"not a linear SARSA model: {path}")
+            weights = data["weights"]
+        self.n_features = len(weights)
+        self.q = HashedLinearQ(self.n_features, dtype=weights.dtype)
+        self.q.w[:] = weights
@@ -0,0 +1,452 @@
+"""Simulated meal-recommendation users for offline training and regression tests.
+
+    MealSimulator          danh mục món (nguyên liệu cần có), người dùng (vector khẩu vị) và
+                           mô hình reward; tạo ngẫu nhiên hoặc ``from_feedback`` từ log /feedback
+    BatchMealEnv           N người dùng chạy song song, mọi thứ là mảng NumPy (autoreset)
+    MealRecommendationEnv  một người dùng, API gym (reset -> (obs, info), step -> 5-tuple);
+                           action là cột món (Discrete), info["state"] có dạng ``server.State``
+                           nên StateEncoder cho đúng key production
+    train_table            SARSA vector hoá trên BatchMealEnv -> bảng {state_key: {recipe: q}}
+
+Mỗi episode là ``episode_length`` bữa liên tiếp (meal_time xoay vòng) của một người dùng với
+một tủ nguyên liệu (avail) cố định. Xác suất người dùng nhận món:
+
+    p = sigmoid(popularity[r] + meal_affinity[meal, r] + taste[u] . style[r]
+                - repeat_penalty * (r nằm trong history))
+
+reward_model="bernoulli" trả 1/0 theo p, "expected" trả thẳng p; món thiếu nguyên liệu
+nhận ``infeasible_reward``.
+
+Dựng bảng trước khi deploy:
+    python meal_env.py --feedback feedback.jsonl --envs 4096 --steps 2000 --out sarsa_table.sim.json
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+try:
+    from .sarsa_agent import write_table
+    from .sarsa_trainer import batch_td_update, check_finite
+    from .state_encoder import StateEncoder
+    from .traffic_capture import CAPTURE_EXT, read_capture
+except ImportError:
+    from sarsa_agent import write_table
+    from sarsa_trainer import batch_td_update, check_finite
+    from state_encoder import StateEncoder
+    from traffic_capture import CAPTURE_EXT, read_capture
+
+try:
+    import gym
+    from gym import spaces
+except ImportError:
+    gym = None
+
+__all__ = ["MealSimulator", "BatchMealEnv", "MealRecommendationEnv", "load_feedback", "train_table"]
+
+MEAL_TIMES = ("Ăn sáng", "Ăn trưa", "Ăn tối")
+MAX_INGREDIENTS = 64   # avail được giữ dạng bitmask uint64
+_M1 = np.uint64(0xBF58476D1CE4E5B9)
+_M2 = np.uint64(0x94D049BB133111EB)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(h):
+    h = h ^ (h >> np.uint64(30))
+    h = h * _M1
+    h = h ^ (h >> np.uint64(27))
+    h = h * _M2
+    return h ^ (h >> np.uint64(31))
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def load_feedback(path):
+    """Đọc log feedback: thư mục/file capture của traffic_capture, hoặc JSONL mà mỗi dòng là
+    payload /feedback (hay {"payload": {...}})."""
+    if os.path.isdir(path) or path.endswith(CAPTURE_EXT):
+        for rec in read_capture(path, {"feedback", "feedback_batch"}):
+            payload = rec["payload"]
+            yield from (payload["transitions"] if rec["kind"] == "feedback_batch" else [payload])
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            rec = rec.get("payload", rec) if isinstance(rec, dict) else None
+            if isinstance(rec, dict) and "state" in rec and "action" in rec:
+                yield rec
+
+
+class MealSimulator:
+    def __init__(self, recipe_ids, ingredients, recipe_ingredients, meal_times=MEAL_TIMES,
+                 ingredient_probs=None, popularity=None, meal_affinity=None, n_users=1000,
+                 taste_dim=8, taste_scale=1.0, repeat_penalty=1.5, reward_model="bernoulli",
+                 infeasible_reward=-1.0, seed=None):
+        """
+        recipe_ids: id của các món (action)
+        ingredients: tên nguyên liệu (tối đa 64)
+        recipe_ingredients: {recipe_id: [nguyên liệu cần có]}
+        ingredient_probs: xác suất mỗi nguyên liệu có trong avail (mặc định 0.5)
+        popularity: logit nền của từng món; meal_affinity: logit (n_meal_times, n_recipes)
+        reward_model: "bernoulli" (1/0 theo xác suất nhận) hoặc "expected" (xác suất nhận)
+        """
+        if reward_model not in ("bernoulli", "expected"):
+            raise ValueError(f"unknown reward_model: {reward_model!r}")
+        if len(ingredients) > MAX_INGREDIENTS:
+            raise ValueError(f"at most {MAX_INGREDIENTS} ingredients are supported")
+        rng = np.random.default_rng(seed)
+        self.recipe_ids = list(recipe_ids)
+        self.ingredients = list(ingredients)
+        self.meal_times = list(meal_times)
+        self.reward_model = reward_model
+        self.infeasible_reward = float(infeasible_reward)
+        self.repeat_penalty = float(repeat_penalty)
+        n_recipes = len(self.recipe_ids)
+        bit = {name: np.uint64(1) << np.uint64(i) for i, name in enumerate(self.ingredients)}
+        self.recipe_masks = np.zeros(n_recipes, dtype=np.uint64)
+        for j, r in enumerate(self.recipe_ids):
+            for name in recipe_ingredients.get(r, ()):
+                if name in bit:
+                    self.recipe_masks[j] |= bit[name]
+        self.ingredient_probs = np.full(len(self.ingredients), 0.5) if ingredient_probs is None \
+            else np.asarray(ingredient_probs, dtype=np.float64)
+        self.popularity = np.zeros(n_recipes) if popularity is None else np.asarray(popularity, dtype=np.float64)
+        self.meal_affinity = np.zeros((len(self.meal_times), n_recipes)) if meal_affinity is None \
+            else np.asarray(meal_affinity, dtype=np.float64)
+        scale = taste_scale / np.sqrt(taste_dim)
+        self.user_taste = rng.normal(0.0, scale, size=(n_users, taste_dim))
+        self.recipe_style = rng.normal(0.0, 1.0, size=(n_recipes, taste_dim))
+
+    @property
+    def n_recipes(self):
+        return len(self.recipe_ids)
+
+    @classmethod
+    def random(cls, n_recipes=50, n_ingredients=20, max_recipe_ingredients=3, seed=None, **kwargs):
+        """Danh mục ngẫu nhiên: recipe id 0..n_recipes-1."""
+        rng = np.random.default_rng(seed)
+        ingredients = [f"ing{i}" for i in range(n_ingredients)]
+        recipe_ingredients = {
+            r: list(rng.choice(ingredients, size=rng.integers(1, max_recipe_ingredients + 1), replace=False))
+            for r in range(n_recipes)
+        }
+        kwargs.setdefault("popularity", rng.normal(0.0, 1.0, size=n_recipes))
+        kwargs.setdefault("meal_affinity", rng.normal(0.0, 0.5, size=(len(MEAL_TIMES), n_recipes)))
+        return cls(range(n_recipes), ingredients, recipe_ingredients, seed=seed, **kwargs)
+
+    @classmethod
+    def from_feedback(cls, records, smoothing=5.0, **kwargs):
+        """Ước lượng danh mục và mô hình reward từ log feedback (payload /feedback).
+
+        - nguyên liệu: 64 nguyên liệu xuất hiện nhiều nhất trong avail, xác suất = tần suất
+        - món: mọi action trong log; nguyên liệu cần có = giao các avail mà món được nhận
+        - popularity / meal_affinity: logit của tỉ lệ nhận (reward > 0), làm trơn về trung bình
+        """
+        records = list(records)
+        if not records:
+            raise ValueError("no feedback records")
+        ing_count = {}
+        meal_seen = []
+        for rec in records:
+            for name in set(rec["state"].get("avail") or ()):
+                ing_count[name] = ing_count.get(name, 0) + 1
+            mt = (rec["state"].get("context") or {}).get("meal_time")
+            if mt is not None and mt not in meal_seen:
+                meal_seen.append(mt)
+        ingredients = sorted(ing_count, key=lambda n: -ing_count[n])[:MAX_INGREDIENTS]
+        meal_times = [m for m in MEAL_TIMES if m in meal_seen] + [m for m in meal_seen if m not in MEAL_TIMES]
+        meal_times = meal_times or list(MEAL_TIMES)
+        meal_pos = {m: i for i, m in enumerate(meal_times)}
+
+        recipe_ids = sorted({rec["action"] for rec in records}, key=str)
+        col = {r: j for j, r in enumerate(recipe_ids)}
+        accepts = np.zeros((len(meal_times), len(recipe_ids)))
+        trials = np.zeros_like(accepts)
+        required = {}
+        for rec in records:
+            j = col[rec["action"]]
+            m = meal_pos.get((rec["state"].get("context") or {}).get("meal_time"), 0)
+            trials[m, j] += 1
+            if rec.get("reward", 0) > 0:
+                accepts[m, j] += 1
+                avail = set(rec["state"].get("avail") or ())
+                required[rec["action"]] = required.get(rec["action"], avail) & avail
+        base = (accepts.sum() + 1.0) / (trials.sum() + 2.0)
+        rate = (accepts.sum(axis=0) + smoothing * base) / (trials.sum(axis=0) + smoothing)
+        meal_rate = (accepts + smoothing * rate) / (trials + smoothing)
+        logit = lambda p: np.log(p) - np.log1p(-np.clip(p, 1e-6, 1 - 1e-6))
+        probs = np.array([ing_count[n] / len(records) for n in ingredients])
+        return cls(recipe_ids, ingredients, {r: sorted(v) for r, v in required.items()},
+                   meal_times=meal_times, ingredient_probs=probs, popularity=logit(rate),
+                   meal_affinity=logit(meal_rate) - logit(rate), **kwargs)
+
+    # --- vectorized model ---
+    def sample_avail(self, rng, n):
+        present = rng.random((n, len(self.ingredients))) < self.ingredient_probs
+        weights = np.uint64(1) << np.arange(len(self.ingredients), dtype=np.uint64)
+        return (present.astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+
+    def feasible(self, avail, actions=None):
+        """Món nào nấu được với avail: (N,) nếu có actions (chỉ số món), ngược lại (N, R)."""
+        if actions is None:
+            masks = self.recipe_masks[None, :]
+            return (masks & avail[:, None]) == masks
+        masks = self.recipe_masks[actions]
+        return (masks & avail) == masks
+
+    def accept_prob(self, users, meals, history, actions):
+        logits = (self.popularity[actions] + self.meal_affinity[meals, actions]
+                  + np.einsum("nd,nd->n", self.user_taste[users], self.recipe_style[actions])
+                  - self.repeat_penalty * (history == actions[:, None]).any(axis=1))
+        return _sigmoid(logits)
+
+    def reward(self, rng, users, meals, history, avail, actions):
+        p = self.accept_prob(users, meals, history, actions)
+        r = (rng.random(len(actions)) < p).astype(np.float64) if self.reward_model == "bernoulli" else p
+        return np.where(self.feasible(avail, actions), r, self.infeasible_reward)
+
+
+class BatchMealEnv:
+    """N người dùng song song; action là chỉ số món (0..n_recipes-1).
+
+    obs = {"avail": uint64 bitmask (N,), "meal_time": int (N,), "history": int (N, W), -1 = trống}
+    step(actions) -> (obs, rewards, dones); slot nào xong episode được reset ngay.
+    """
+
+    def __init__(self, simulator, n_envs=1024, episode_length=9, history_window=3, seed=None):
+        self.sim = simulator
+        self.n_envs = int(n_envs)
+        self.episode_length = int(episode_length)
+        self.history_window = int(history_window)
+        self.rng = np.random.default_rng(seed)
+        n = self.n_envs
+        self.users = np.zeros(n, dtype=np.int64)
+        self.avail = np.zeros(n, dtype=np.uint64)
+        self.meal = np.zeros(n, dtype=np.int64)
+        self.t = np.zeros(n, dtype=np.int64)
+        self.history = np.full((n, self.history_window), -1, dtype=np.int64)
+
+    def _reset_slots(self, idx):
+        k = len(idx)
+        if not k:
+            return
+        self.users[idx] = self.rng.integers(len(self.sim.user_taste), size=k)
+        self.avail[idx] = self.sim.sample_avail(self.rng, k)
+        self.meal[idx] = self.rng.integers(len(self.sim.meal_times), size=k)
+        self.t[idx] = 0
+        self.history[idx] = -1
+
+    def obs(self):
+        return {"avail": self.avail.copy(), "meal_time": self.meal.copy(), "history": self.history.copy()}
+
+    def reset(self):
+        self._reset_slots(np.arange(self.n_envs))
+        return self.obs()
+
+    def step(self, actions):
+        actions = np.asarray(actions, dtype=np.int64)
+        rewards = self.sim.reward(self.rng, self.users, self.meal, self.history, self.avail, actions)
+        if self.history_window:
+            self.history[:, :-1] = self.history[:, 1:]
+            self.history[:, -1] = actions
+        self.meal = (self.meal + 1) % len(self.sim.meal_times)
+        self.t += 1
+        dones = self.t >= self.episode_length
+        self._reset_slots(np.flatnonzero(dones))
+        return self.obs(), rewards, dones
+
+    def state_codes(self, obs):
+        """Mã 64-bit của (avail, meal_time, history) — dùng làm khoá bảng khi huấn luyện."""
+        with np.errstate(over="ignore"):
+            h = _mix(obs["avail"] ^ _GOLDEN)
+            h = _mix(h ^ obs["meal_time"].astype(np.uint64) * _GOLDEN)
+            for col in obs["history"].T:
+                h = _mix(h ^ (col + 1).astype(np.uint64) * _GOLDEN)
+        return h
+
+    def to_state(self, obs, i):
+        """Slot i của obs dưới dạng dict như server.State."""
+        mask = int(obs["avail"][i])
+        sim = self.sim
+        return {
+            "avail": [name for b, name in enumerate(sim.ingredients) if mask >> b & 1],
+            "history": [sim.recipe_ids[int(h)] for h in obs["history"][i] if h >= 0],
+            "context": {"meal_time": sim.meal_times[int(obs["meal_time"][i])]},
+        }
+
+
+class MealRecommendationEnv(gym.Env if gym is not None else object):
+    """Một người dùng mô phỏng với API gym; action là cột j của `actions` (Discrete).
+
+    obs là mảng theo observation_space: avail (MultiBinary theo nguyên liệu), meal_time và
+    history (cột món, -1 = trống). info["state"] là cùng obs dưới dạng ``server.State`` cho
+    StateEncoder; info["possible_actions"] là các recipe id nấu được, giống backend gửi lên;
+    info["action_mask"] là mặt nạ tương ứng trên action_space (``action_space.sample(mask)``).
+    """
+
+    metadata = {"render_modes": []}
+
+    def __init__(self, simulator=None, episode_length=9, history_window=3, seed=None):
+        self.sim = simulator or MealSimulator.random(seed=seed)
+        self._env = BatchMealEnv(self.sim, n_envs=1, episode_length=episode_length,
+                                 history_window=history_window, seed=seed)
+        self.actions = list(self.sim.recipe_ids)
+        self._bits = np.uint64(1) << np.arange(len(self.sim.ingredients), dtype=np.uint64)
+        if gym is not None:
+            self.action_space = spaces.Discrete(len(self.actions))
+            self.observation_space = spaces.Dict({
+                "avail": spaces.MultiBinary(len(self.sim.ingredients)),
+                "meal_time": spaces.Discrete(len(self.sim.meal_times)),
+                "history": spaces.Box(-1, len(self.actions) - 1, shape=(self._env.history_window,),
+                                      dtype=np.int64),
+            })
+        self._obs = None
+
+    def _observe(self):
+        obs = self._obs
+        return {
+            "avail": (obs["avail"][0] & self._bits != 0).astype(np.int8),
+            "meal_time": int(obs["meal_time"][0]),
+            "history": obs["history"][0].copy(),
+        }
+
+    def _info(self):
+        feasible = self.sim.feasible(self._obs["avail"])[0]
+        return {"state": self._env.to_state(self._obs, 0),
+                "possible_actions": [self.actions[j] for j in np.flatnonzero(feasible)],
+                "action_mask": feasible.astype(np.int8)}
+
+    def reset(self, seed=None, options=None):
+        if seed is not None:
+            self._env.rng = np.random.default_rng(seed)
+        self._obs = self._env.reset()
+        return self._observe(), self._info()
+
+    def step(self, action):
+        """action: cột trong `actions`; recipe id thì đổi qua ``env.actions.index(recipe)``."""
+        j = int(action)
+        if not 0 <= j < len(self.actions):
+            raise ValueError(f"action {action!r} ngoài Discrete({len(self.actions)})")
+        self._obs, rewards, dones = self._env.step([j])
+        done = bool(dones[0])
+        return self._observe(), float(rewards[0]), done, False, self._info()
+
+
+def train_table(simulator, n_envs=4096, steps=1000, alpha=0.1, gamma=0.9, epsilon=0.1,
+                episode_length=9, encoder=None, seed=None, log_every=100):
+    """SARSA vector hoá trên BatchMealEnv; trả về {state_key: {recipe_id: q}}.
+
+    Greedy và khám phá chỉ chọn trong các món nấu được (như possible_actions của server).
+    Key do `encoder` (mặc định StateEncoder()) tạo nên bảng dùng thẳng cho server được.
+    Nhiều env cùng rơi vào một (state, món) trong một bước nhận trung bình TD error; Q có
+    NaN/inf thì ValueError thay vì trả bảng.
+    """
+    encoder = encoder or StateEncoder()
+    env = BatchMealEnv(simulator, n_envs=n_envs, episode_length=episode_length,
+                       history_window=encoder.history_window or 0, seed=seed)
+    rng = np.random.default_rng(seed)
+    n_recipes = simulator.n_recipes
+    index = {}           # state code -> row
+    seen = []            # obs của các state mới, theo thứ tự row — để dựng key ở cuối
+    q = np.zeros((1024, n_recipes))
+    visited = np.zeros((1024, n_recipes), dtype=bool)
+
+    def rows_for(obs):
+        nonlocal q, visited
+        codes = env.state_codes(obs).tolist()
+        rows = np.empty(len(codes), dtype=np.int64)
+        new = []
+        for i, c in enumerate(codes):
+            r = index.get(c)
+            if r is None:
+                r = index[c] = len(index)
+                new.append(i)
+            rows[i] = r
+        if new:
+            seen.append({name: arr[new] for name, arr in obs.items()})
+        if len(index) > len(q):
+            cap = max(len(index), 2 * len(q))
+            q = np.concatenate([q, np.zeros((cap - len(q), n_recipes))])
+            visited = np.concatenate([visited, np.zeros((cap - len(visited), n_recipes), dtype=bool)])
+        return rows
+
+    def choose(rows, obs):
+        feasible = simulator.feasible(obs["avail"])
+        noise = rng.random((len(rows), n_recipes))
+        explore = rng.random(len(rows)) < epsilon
+        score = np.where(explore[:, None], noise, q[rows] + 1e-9 * noise)
+        score[~feasible] = -np.inf
+        return np.argmax(score, axis=1)
+
+    obs = env.reset()
+    rows = rows_for(obs)
+    actions = choose(rows, obs)
+    total_reward = 0.0
+    start = time.perf_counter()
+    for step in range(1, steps + 1):
+        next_obs, rewards, dones = env.step(actions)
+        next_rows = rows_for(next_obs)
+        next_actions = choose(next_rows, next_obs)
+        target = rewards + gamma * q[next_rows, next_actions] * ~dones
+        batch_td_update(q, rows, actions, alpha * (target - q[rows, actions]))
+        visited[rows, actions] = True
+        total_reward += rewards.sum()
+        rows, actions, obs = next_rows, next_actions, next_obs
+        if log_every and step % log_every == 0:
+            elapsed = time.perf_counter() - start
+            print(f"[Sim] step {step}/{steps} | states {len(index)} | "
+                  f"avg reward {total_reward / (step * n_envs):.4f} | {step * n_envs / elapsed:,.0f} steps/s")
+
+    check_finite(q[:len(index)])
+    table = {}
+    r = 0
+    for chunk in seen:
+        for i in range(len(chunk["avail"])):
+            cols = np.flatnonzero(visited[r])
+            if len(cols):
+                key = encoder(env.to_state(chunk, i))
+                table.setdefault(key, {}).update(
+                    {simulator.recipe_ids[int(j)]: float(q[r, j]) for j in cols})
+            r += 1
+    return table
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Build a SARSA table offline from simulated users")
+    p.add_argument('--feedback', default=None, help='log feedback (JSONL hoặc thư mục capture) để ước lượng simulator')
+    p.add_argument('--recipes', type=int, default=50, help='số món khi không có --feedback')
+    p.add_argument('--ingredients', type=int, default=20, help='số nguyên liệu khi không có --feedback')
+    p.add_argument('--users', type=int, default=1000)
+    p.add_argument('--reward-model', default='bernoulli', choices=['bernoulli', 'expected'])
+    p.add_argument('--envs', type=int, default=4096)
+    p.add_argument('--steps', type=int, default=1000)
+    p.add_argument('--episode-length', type=int, default=9)
+    p.add_argument('--alpha', type=float, default=0.1)
+    p.add_argument('--gamma', type=float, default=0.9)
+    p.add_argument('--epsilon', type=float, default=0.1)
+    p.add_argument('--seed', type=int, default=None)
+    p.add_argument('--out', default='sarsa_table.sim.json', help='đuôi .sqt -> snapshot nhị phân')
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    options = dict(n_users=args.users, reward_model=args.reward_model, seed=args.seed)
+    if args.feedback:
+        sim = MealSimulator.from_feedback(load_feedback(args.feedback), **options)
+    else:
+        sim = MealSimulator.random(n_recipes=args.recipes, n_ingredients=args.ingredients, **options)
+    table = train_table(sim, n_envs=args.envs, steps=args.steps, alpha=args.alpha, gamma=args.gamma,
+                        epsilon=args.epsilon, episode_length=args.episode_length, seed=args.seed)
+    write_table(table, args.out)
+    print(f"Wrote {len(table)} states to {args.out}")
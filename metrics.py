@@ -0,0 +1,122 @@
+"""Minimal in-process metrics with Prometheus text exposition (no extra dependency).
+
+    ServiceMetrics.observe_request(endpoint, status, seconds)   đếm + histogram theo endpoint
+    ServiceMetrics.observe_stage(stage, seconds)               validation, encode, lookup,
+                                                                update, persist, save...
+    ServiceMetrics.gauge(name, help, fn)                        giá trị đọc lúc scrape
+
+Mỗi observe chỉ là một bisect trên bucket và vài phép cộng dưới một lock; mọi định dạng
+text chỉ xảy ra khi /metrics được gọi.
+"""
+import bisect
+import os
+import resource
+import threading
+
+__all__ = ["Histogram", "ServiceMetrics", "resident_memory_bytes"]
+
+# seconds: 50us .. 10s
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+
+
+def resident_memory_bytes():
+    """RSS hiện tại (Linux: /proc/self/statm); nơi khác dùng RSS đỉnh."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels=()):
+        lines = []
+        cumulative = 0
+        for bound, c in zip(self.buckets, self.counts):
+            cumulative += c
+            lines.append(f"{name}_bucket{_labels(labels + (('le', repr(bound)),))} {cumulative}")
+        lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {self.count}")
+        lines.append(f"{name}_sum{_labels(labels)} {self.sum}")
+        lines.append(f"{name}_count{_labels(labels)} {self.count}")
+        return lines
+
+
+class ServiceMetrics:
+    def __init__(self, namespace="sarsa", buckets=DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._requests = {}         # (endpoint, status) -> count
+        self._latency = {}          # endpoint -> Histogram
+        self._stages = {}           # stage -> Histogram
+        self._gauges = []           # (name, help, fn)
+
+    def observe_request(self, endpoint, status, seconds):
+        with self._lock:
+            key = (endpoint, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            h = self._latency.get(endpoint)
+            if h is None:
+                h = self._latency[endpoint] = Histogram(self.buckets)
+            h.observe(seconds)
+
+    def observe_stage(self, stage, seconds):
+        with self._lock:
+            h = self._stages.get(stage)
+            if h is None:
+                h = self._stages[stage] = Histogram(self.buckets)
+            h.observe(seconds)
+
+    def gauge(self, name, help, fn):
+        """fn() trả về một số, hoặc dict {label_value: số} (label tên "kind")."""
+        self._gauges.append((name, help, fn))
+
+    def render(self):
+        ns = self.namespace
+        with self._lock:
+            requests = sorted(self._requests.items())
+            latency = sorted((k, list(h.render(f"{ns}_request_duration_seconds", (("endpoint", k),))))
+                             for k, h in self._latency.items())
+            stages = sorted((k, list(h.render(f"{ns}_stage_duration_seconds", (("stage", k),))))
+                            for k, h in self._stages.items())
+        lines = [f"# HELP {ns}_requests_total Requests by endpoint and status code.",
+                 f"# TYPE {ns}_requests_total counter"]
+        lines += [f"{ns}_requests_total{_labels((('endpoint', e), ('status', s)))} {c}" for (e, s), c in requests]
+        lines += [f"# HELP {ns}_request_duration_seconds Request latency by endpoint.",
+                  f"# TYPE {ns}_request_duration_seconds histogram"]
+        for _, rendered in latency:
+            lines += rendered
+        lines += [f"# HELP {ns}_stage_duration_seconds Time spent per processing stage.",
+                  f"# TYPE {ns}_stage_duration_seconds histogram"]
+        for _, rendered in stages:
+            lines += rendered
+        for name, help, fn in self._gauges:
+            try:
+                value = fn()
+            except Exception:
+                continue
+            lines += [f"# HELP {ns}_{name} {help}", f"# TYPE {ns}_{name} gauge"]
+            if isinstance(value, dict):
+                lines += [f"{ns}_{name}{_labels((('kind', k),))} {v}" for k, v in value.items()
+                          if isinstance(v, (int, float)) and not isinstance(v, bool)]
+            elif value is not None:
+                lines.append(f"{ns}_{name} {value}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,489 @@
+"""Streaming Q-table inspection: stats, top-k, histogram, coverage and diff in bounded memory.
+
+Bảng được đọc tuần tự từng state — JSON bằng parser tăng dần theo chunk, .sqt qua mmap, thư
+mục shard (sharded_qtable.py) lần lượt từng file — nên bộ nhớ chỉ phụ thuộc vào một hàng và
+kích thước các bộ đếm, không phụ thuộc kích thước bảng:
+
+    stats   số state / entry, min / max / mean / std, top-k và bottom-k (heap k phần tử),
+            histogram giá trị, số action mỗi state, coverage theo meal_time và nguyên liệu
+    diff    so hai snapshot: state / action thêm, bớt, đổi nhiều nhất. Hai bảng được chia
+            theo hash key ra các file tạm (partition), mỗi lần chỉ một partition nằm trong RAM
+
+    python qtable.py stats sarsa_table.json --top 20
+    python qtable.py diff sarsa_table.json candidate.json --top 20
+    python qtable.py diff sarsa_table.json candidate.json --json > diff.json   # cho CI
+"""
+import argparse
+import heapq
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+from collections import Counter
+
+import numpy as np
+
+try:
+    from .qtable_snapshot import MappedQTable, canonical_action, is_snapshot
+    from .state_encoder import parse_legacy_key
+except ImportError:
+    from qtable_snapshot import MappedQTable, canonical_action, is_snapshot
+    from state_encoder import parse_legacy_key
+
+__all__ = ["iter_table", "iter_json_table", "table_stats", "diff_tables"]
+
+_WS = " \t\n\r"
+_KEY_RE = re.compile(r"avail=\((.*)\)\|meal_time=(.*)\|history=", re.S)
+_QUOTED = re.compile(r"'((?:[^'\\]|\\.)*)'")
+
+
+# --- đọc tuần tự ---
+def iter_json_table(path, chunk_size=1 << 20):
+    """Yield (state_key, row) của một bảng JSON {key: {action: value}} mà không nạp cả file."""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        pos = 0
+        eof = False
+
+        def more():
+            nonlocal buf, pos, eof
+            chunk = f.read(max(chunk_size, len(buf)))
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def skip_ws():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in _WS:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                more()
+
+        def value():
+            nonlocal pos
+            while True:
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    if eof:
+                        raise
+                    more()
+                    continue
+                # số ở cuối buffer có thể còn chữ số trong chunk sau
+                if end == len(buf) and not eof:
+                    more()
+                    continue
+                pos = end
+                return obj
+
+        def expect(chars):
+            nonlocal pos
+            skip_ws()
+            if pos >= len(buf) or buf[pos] not in chars:
+                found = buf[pos:pos + 20] if pos < len(buf) else "EOF"
+                raise ValueError(f"{path}: expected {chars!r}, found {found!r}")
+            pos += 1
+            return buf[pos - 1]
+
+        more()
+        expect("{")
+        skip_ws()
+        if pos < len(buf) and buf[pos] == "}":
+            return
+        while True:
+            skip_ws()
+            key = value()
+            expect(":")
+            skip_ws()
+            row = value()
+            yield key, row
+            if expect(",}") == "}":
+                return
+
+
+def iter_table(path):
+    """Yield (state_key, row) từ bảng JSON, snapshot .sqt hoặc thư mục shard."""
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            full = os.path.join(path, name)
+            if name != "manifest.json" and name.endswith((".json", ".sqt")):
+                yield from iter_table(full)
+        return
+    if is_snapshot(path):
+        t = MappedQTable(path)
+        for i in range(len(t)):
+            acts, vals = t.row(i)
+            yield t.key_at(i), dict(zip(acts.tolist(), vals.tolist()))
+        return
+    yield from iter_json_table(path)
+
+
+def clean_row(row):
+    """({action: float}, số giá trị hỏng) — action chuẩn hoá như SARSAAgent.load()."""
+    if not isinstance(row, dict):
+        return {}, 1
+    out = {}
+    bad = 0
+    for a, v in row.items():
+        try:
+            out[canonical_action(a)] = float(v)
+        except (TypeError, ValueError):
+            bad += 1
+    return out, bad
+
+
+def key_context(key):
+    """(meal_time, [nguyên liệu]) của key legacy; (None, None) nếu key không đúng dạng."""
+    m = _KEY_RE.match(key)
+    if m is None:
+        return None, None
+    avail, meal_time = m.group(1), m.group(2)
+    if '"' in avail or "\\" in avail:
+        # repr dùng nháy kép / escape: để parser đầy đủ lo
+        parts = parse_legacy_key(key)
+        return (parts[1], list(parts[0])) if parts else (None, None)
+    return meal_time, _QUOTED.findall(avail)
+
+
+# --- stats ---
+class _TopK:
+    """k phần tử lớn nhất theo score, bằng min-heap k phần tử."""
+
+    def __init__(self, k):
+        self.k = k
+        self.heap = []
+        self.seq = 0
+
+    def push(self, score, item):
+        self.seq += 1
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, (score, self.seq, item))
+        elif score > self.heap[0][0]:
+            heapq.heapreplace(self.heap, (score, self.seq, item))
+
+    def result(self):
+        return [item for _, _, item in sorted(self.heap, key=lambda t: (-t[0], t[1]))]
+
+
+def _histogram(counter, bins):
+    """Gộp các giá trị đã làm tròn (3 chữ số có nghĩa) thành `bins` bin đều trên [min, max]."""
+    if not counter:
+        return []
+    lo, hi = min(counter), max(counter)
+    if lo == hi:
+        return [(lo, hi, sum(counter.values()))]
+    width = (hi - lo) / bins
+    counts = [0] * bins
+    for v, c in counter.items():
+        counts[min(bins - 1, int((v - lo) / width))] += c
+    return [(lo + i * width, lo + (i + 1) * width, c) for i, c in enumerate(counts)]
+
+
+def _round3(values):
+    """Làm tròn 3 chữ số có nghĩa (bộ đếm histogram có kích thước chặn)."""
+    out = values.copy()
+    nz = values != 0
+    scale = 10.0 ** (np.floor(np.log10(np.abs(values[nz]))) - 2)
+    out[nz] = np.round(values[nz] / scale) * scale
+    return out
+
+
+class _ValueStats:
+    """min / max / mean / std, top-k, bottom-k và histogram, cập nhật theo lô NumPy."""
+
+    def __init__(self, top, batch=65536):
+        self.batch = batch
+        self.best, self.worst = _TopK(top), _TopK(top)
+        self.k = top
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.zeros = 0
+        self.rounded = Counter()
+        self._vals, self._acts, self._owner, self._keys = [], [], [], []
+
+    def add_row(self, key, row):
+        self._keys.append(key)
+        i = len(self._keys) - 1
+        self._vals.extend(row.values())
+        self._acts.extend(row.keys())
+        self._owner.extend([i] * len(row))
+        if len(self._vals) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        if not self._vals:
+            self._keys = []
+            return
+        v = np.asarray(self._vals, dtype=np.float64)
+        n = len(v)
+        # gộp mean / M2 của lô với phần đã có (Chan et al.)
+        mean_b = float(v.mean())
+        m2_b = float(((v - mean_b) ** 2).sum())
+        total = self.n + n
+        delta = mean_b - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2_b + delta * delta * self.n * n / total
+        self.n = total
+        self.min = min(self.min, float(v.min()))
+        self.max = max(self.max, float(v.max()))
+        self.zeros += int(n - np.count_nonzero(v))
+        r, c = np.unique(_round3(v), return_counts=True)
+        self.rounded.update(dict(zip(r.tolist(), c.tolist())))
+        k = min(self.k, n)
+        if k:
+            for heap, sign in ((self.best, 1.0), (self.worst, -1.0)):
+                for j in np.argpartition(-sign * v, k - 1)[:k].tolist():
+                    heap.push(sign * v[j], (float(v[j]), self._acts[j], self._keys[self._owner[j]]))
+        self._vals, self._acts, self._owner, self._keys = [], [], [], []
+
+
+def table_stats(path, top=10, bins=20, coverage=True):
+    """Một lượt đọc qua bảng; trả về dict kết quả (xem print_stats)."""
+    start = time.perf_counter()
+    n_states = malformed = 0
+    values = _ValueStats(top)
+    row_sizes = Counter()
+    actions = set()
+    meals = {}
+    ingredients = Counter()
+    avail_sizes = Counter()
+    for key, raw in iter_table(path):
+        row, bad = clean_row(raw)
+        n_states += 1
+        malformed += bad
+        row_sizes[len(row)] += 1
+        actions.update(row)
+        values.add_row(key, row)
+        if coverage:
+            meal_time, avail = key_context(key)
+            meal = meals.setdefault(str(meal_time) if avail is not None else "(other keys)", [0, 0, 0, 0.0])
+            meal[0] += 1
+            meal[1] += len(row)
+            meal[2] += sum(1 for v in row.values() if v != 0.0)
+            meal[3] += sum(row.values())
+            if avail is not None:
+                ingredients.update(avail)
+                avail_sizes[len(avail)] += 1
+    values.flush()
+    n = values.n
+    return {
+        "path": path,
+        "states": n_states,
+        "entries": n,
+        "malformed": malformed,
+        "zero_entries": values.zeros,
+        "distinct_actions": len(actions),
+        "min": values.min if n else None,
+        "max": values.max if n else None,
+        "mean": values.mean if n else None,
+        "std": math.sqrt(values.m2 / n) if n else None,
+        "top": values.best.result(),
+        "bottom": values.worst.result(),
+        "histogram": _histogram(values.rounded, bins),
+        "actions_per_state": sorted(row_sizes.items()),
+        "meal_time": {m: {"states": s, "entries": e, "nonzero": nz, "mean": t / e if e else 0.0}
+                      for m, (s, e, nz, t) in sorted(meals.items())},
+        "ingredients": ingredients.most_common(),
+        "avail_sizes": sorted(avail_sizes.items()),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+# --- diff ---
+def _partition(path, directory, tag, n):
+    files = [open(os.path.join(directory, f"{tag}{i}.jsonl"), "w", encoding="utf-8") for i in range(n)]
+    try:
+        for key, raw in iter_table(path):
+            row, _ = clean_row(raw)
+            files[zlib.crc32(key.encode("utf-8")) % n].write(json.dumps([key, list(row.items())]) + "\n")
+    finally:
+        for f in files:
+            f.close()
+
+
+def _read_partition(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            key, items = json.loads(line)
+            yield key, {canonical_action(a): v for a, v in items}
+
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, p)) for p in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def diff_tables(old, new, top=20, tol=0.0, partition_bytes=256 * 1024 * 1024, tmpdir=None):
+    """So hai bảng. Giá trị vắng mặt ở một bên được coi là 0.0 (như agent đọc), kể cả khi
+    cả state chỉ có ở một bên: các entry đó cũng vào changed_entries, top_entries, top_states.
+
+    partition_bytes: kích thước (file nguồn) mỗi partition; quyết định RAM tối đa.
+    """
+    start = time.perf_counter()
+    n = max(1, math.ceil(max(_size(old), _size(new)) / partition_bytes))
+    work = tempfile.mkdtemp(prefix="qtable-diff-", dir=tmpdir)
+    only_old = only_new = states_changed = common = 0
+    added = removed = changed = 0
+    sum_abs = 0.0
+    max_abs = 0.0
+    top_entries, top_states = _TopK(top), _TopK(top)
+    by_meal = Counter()
+
+    def diff_row(key, old_row, new_row):
+        nonlocal added, removed, changed, sum_abs, max_abs, states_changed
+        state_abs = 0.0
+        for a in old_row.keys() | new_row.keys():
+            if a not in old_row:
+                added += 1
+            elif a not in new_row:
+                removed += 1
+            ov, nv = old_row.get(a, 0.0), new_row.get(a, 0.0)
+            d = abs(nv - ov)
+            if d <= tol:
+                continue
+            changed += 1
+            sum_abs += d
+            max_abs = max(max_abs, d)
+            state_abs += d
+            top_entries.push(d, (key, a, ov, nv))
+        if state_abs:
+            states_changed += 1
+            top_states.push(state_abs, (key, state_abs))
+            by_meal[str(key_context(key)[0])] += 1
+
+    try:
+        _partition(old, work, "old", n)
+        _partition(new, work, "new", n)
+        for i in range(n):
+            old_rows = dict(_read_partition(os.path.join(work, f"old{i}.jsonl")))
+            for key, new_row in _read_partition(os.path.join(work, f"new{i}.jsonl")):
+                old_row = old_rows.pop(key, None)
+                if old_row is None:
+                    # state mới: so với 0.0
+                    only_new += 1
+                    old_row = {}
+                else:
+                    common += 1
+                diff_row(key, old_row, new_row)
+            # state bị bỏ: so với 0.0
+            only_old += len(old_rows)
+            for key, old_row in old_rows.items():
+                diff_row(key, old_row, {})
+            del old_rows
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return {
+        "old": old,
+        "new": new,
+        "partitions": n,
+        "common_states": common,
+        "only_old_states": only_old,
+        "only_new_states": only_new,
+        "changed_states": states_changed,
+        "added_entries": added,
+        "removed_entries": removed,
+        "changed_entries": changed,
+        "mean_abs_change": sum_abs / changed if changed else 0.0,
+        "max_abs_change": max_abs,
+        "top_entries": top_entries.result(),
+        "top_states": top_states.result(),
+        "changed_states_by_meal_time": dict(by_meal.most_common()),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+# --- output ---
+def print_stats(s, preview=100):
+    print(f"Q-table: {s['path']}  ({s['seconds']}s)")
+    print(f"States: {s['states']}  entries: {s['entries']}  distinct actions: {s['distinct_actions']}"
+          f"  zero: {s['zero_entries']}  malformed: {s['malformed']}")
+    if s["entries"]:
+        print(f"Q: min={s['min']:.6f} max={s['max']:.6f} mean={s['mean']:.6f} std={s['std']:.6f}")
+    for title, rows in (("Top", s["top"]), ("Bottom", s["bottom"])):
+        print(f"\n{title} {len(rows)} Q-values:")
+        for v, a, key in rows:
+            print(f"  Q={v:.6f}  action={a}  state_preview=\"{key[:preview]}\"")
+    if s["histogram"]:
+        print("\nValue histogram:")
+        peak = max(c for _, _, c in s["histogram"]) or 1
+        for lo, hi, c in s["histogram"]:
+            print(f"  [{lo:+.4f}, {hi:+.4f})  {c:>10}  {'#' * int(40 * c / peak)}")
+    print("\nActions per state:", ", ".join(f"{n}:{c}" for n, c in s["actions_per_state"][:20]))
+    if s["meal_time"]:
+        print("\nCoverage by meal_time:")
+        for meal, m in s["meal_time"].items():
+            print(f"  {meal:<16} states={m['states']:<8} entries={m['entries']:<9} "
+                  f"nonzero={m['nonzero']:<9} mean={m['mean']:.4f}")
+    if s["ingredients"]:
+        print("\nStates per ingredient:", ", ".join(f"{i}:{c}" for i, c in s["ingredients"][:30]))
+        print("Ingredients per state:", ", ".join(f"{n}:{c}" for n, c in s["avail_sizes"]))
+
+
+def print_diff(d, preview=100):
+    print(f"Diff: {d['old']} -> {d['new']}  ({d['seconds']}s, {d['partitions']} partitions)")
+    print(f"States: common={d['common_states']} only_old={d['only_old_states']} "
+          f"only_new={d['only_new_states']} changed={d['changed_states']}")
+    print(f"Entries: added={d['added_entries']} removed={d['removed_entries']} changed={d['changed_entries']} "
+          f"mean|Δ|={d['mean_abs_change']:.6f} max|Δ|={d['max_abs_change']:.6f}")
+    if d["changed_states_by_meal_time"]:
+        print("Changed states by meal_time:",
+              ", ".join(f"{m}:{c}" for m, c in d["changed_states_by_meal_time"].items()))
+    print(f"\nTop {len(d['top_entries'])} changed entries:")
+    for key, a, ov, nv in d["top_entries"]:
+        print(f"  {ov:+.6f} -> {nv:+.6f}  action={a}  state_preview=\"{key[:preview]}\"")
+    print(f"\nTop {len(d['top_states'])} changed states (sum |Δ|):")
+    for key, total in d["top_states"]:
+        print(f"  {total:.6f}  state_preview=\"{key[:preview]}\"")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Inspect and diff SARSA Q-tables without loading them into memory")
+    sub = p.add_subparsers(dest='command', required=True)
+    st = sub.add_parser('stats', help='thống kê một bảng (JSON, .sqt hoặc thư mục shard)')
+    st.add_argument('table')
+    st.add_argument('--top', type=int, default=10)
+    st.add_argument('--bins', type=int, default=20)
+    st.add_argument('--no-coverage', action='store_true', help='bỏ coverage theo meal_time / nguyên liệu')
+    st.add_argument('--json', action='store_true', help='in kết quả dạng JSON')
+    df = sub.add_parser('diff', help='so hai bảng (ví dụ trước khi promote bảng mới)')
+    df.add_argument('old')
+    df.add_argument('new')
+    df.add_argument('--top', type=int, default=20)
+    df.add_argument('--tol', type=float, default=0.0, help='bỏ qua thay đổi |Δ| <= tol')
+    df.add_argument('--partition-mb', type=int, default=256, help='RAM ~ kích thước một partition')
+    df.add_argument('--tmpdir', default=None)
+    df.add_argument('--json', action='store_true')
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.command == 'stats':
+        result = table_stats(args.table, top=args.top, bins=args.bins, coverage=not args.no_coverage)
+        show = print_stats
+    else:
+        result = diff_tables(args.old, args.new, top=args.top, tol=args.tol,
+                             partition_bytes=args.partition_mb * 1024 * 1024, tmpdir=args.tmpdir)
+        show = print_diff
+    if args.json:
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2, default=str)
+        print()
+    else:
+        show(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""Versioned binary snapshot format for the SARSA Q-table (.sqt).
+
+Layout (little-endian, mọi section căn theo 8 byte):
+
+    header      magic b"SQTB", version u16, value itemsize u8, pad u8,
+                n_states u64, n_entries u64, 6 x u64 section offsets
+    hashes      u64[n_states]      64-bit hash của state key, đã sort
+    key_offsets u64[n_states + 1]  vị trí từng key trong string table
+    keys        bytes              state keys (utf-8), nối liền nhau
+    indptr      i64[n_states + 1]  CSR: hàng i là entries[indptr[i]:indptr[i+1]]
+    actions     i64[n_entries]     action id (recipe id) dạng int chuẩn, tăng dần trong mỗi hàng
+    values      f4/f8[n_entries]   Q-values
+
+File được mở bằng mmap và đọc bằng np.frombuffer nên không có bước parse: tra một state
+là searchsorted trên hashes rồi so key bytes.
+
+CLI chuyển đổi (định dạng suy ra từ đuôi file):
+    python qtable_snapshot.py sarsa_table.json sarsa_table.sqt [--float32]
+    python qtable_snapshot.py sarsa_table.sqt sarsa_table.json
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+__all__ = ["SNAPSHOT_EXT", "MappedQTable", "is_snapshot", "write_snapshot", "canonical_action"]
+
+SNAPSHOT_EXT = ".sqt"
+MAGIC = b"SQTB"
+VERSION = 1
+_HEADER = struct.Struct("<4sHBxQQ6Q")
+
+
+def canonical_action(a):
+    """Action id chuẩn: int nếu có thể ("3" -> 3), ngược lại giữ nguyên."""
+    if isinstance(a, int) and not isinstance(a, bool):
+        return a
+    try:
+        return int(a)
+    except (TypeError, ValueError):
+        return a
+
+
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def is_snapshot(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def write_snapshot(table, path, dtype="float64"):
+    """Ghi table ({state_key: {action: value}}, hoặc iterable các cặp (key, row)) ra file
+    .sqt (atomic: tmp + rename). Row được sắp theo hash nên vẫn phải gom đủ bảng trước khi ghi.
+
+    Action không quy về int được hoặc value không phải số sẽ bị bỏ qua.
+    Trả về (n_states, n_entries).
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in (np.dtype("float32"), np.dtype("float64")):
+        raise ValueError(f"unsupported value dtype: {dtype}")
+    rows = []
+    for key, row in (table.items() if hasattr(table, "items") else table):
+        entry = {}
+        for a, v in row.items():
+            a = canonical_action(a)
+            if not isinstance(a, int):
+                continue
+            try:
+                entry[a] = float(v)
+            except (TypeError, ValueError):
+                continue
+        kb = key.encode("utf-8")
+        # actions sorted within a row: readers can searchsorted a batch of candidates
+        rows.append((key_hash(key), kb, dict(sorted(entry.items()))))
+    rows.sort(key=lambda r: r[0])
+
+    n_states = len(rows)
+    n_entries = sum(len(r[2]) for r in rows)
+    hashes = np.fromiter((r[0] for r in rows), dtype="<u8", count=n_states)
+    key_offsets = np.zeros(n_states + 1, dtype="<u8")
+    indptr = np.zeros(n_states + 1, dtype="<i8")
+    actions = np.empty(n_entries, dtype="<i8")
+    values = np.empty(n_entries, dtype=dtype.newbyteorder("<"))
+    pos = 0
+    kpos = 0
+    for i, (_, kb, entry) in enumerate(rows):
+        kpos += len(kb)
+        key_offsets[i + 1] = kpos
+        n = len(entry)
+        if n:
+            actions[pos:pos + n] = list(entry.keys())
+            values[pos:pos + n] = list(entry.values())
+        pos += n
+        indptr[i + 1] = pos
+    keys_blob = b"".join(r[1] for r in rows)
+
+    sections = [hashes.tobytes(), key_offsets.tobytes(), keys_blob,
+                indptr.tobytes(), actions.tobytes(), values.tobytes()]
+    offsets = []
+    off = _align(_HEADER.size)
+    for sec in sections:
+        offsets.append(off)
+        off = _align(off + len(sec))
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, dtype.itemsize, n_states, n_entries, *offsets))
+        for sec, o in zip(sections, offsets):
+            f.write(b"\0" * (o - f.tell()))
+            f.write(sec)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return n_states, n_entries
+
+
+class MappedQTable:
+    """Read-only, zero-copy view of a .sqt snapshot."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        if self._mm is None or size < _HEADER.size:
+            raise ValueError(f"not a Q-table snapshot: {path}")
+        magic, version, itemsize, n_states, n_entries, *offs = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"not a Q-table snapshot: {path}")
+        if version != VERSION:
+            raise ValueError(f"unsupported snapshot version {version} in {path}")
+        self.version = version
+        self.n_states = n_states
+        self.n_entries = n_entries
+        buf = self._mm
+        self.hashes = np.frombuffer(buf, dtype="<u8", count=n_states, offset=offs[0])
+        self.key_offsets = np.frombuffer(buf, dtype="<u8", count=n_states + 1, offset=offs[1])
+        self._keys_off = offs[2]
+        self.indptr = np.frombuffer(buf, dtype="<i8", count=n_states + 1, offset=offs[3])
+        self.actions = np.frombuffer(buf, dtype="<i8", count=n_entries, offset=offs[4])
+        self.values = np.frombuffer(buf, dtype="<f4" if itemsize == 4 else "<f8",
+                                    count=n_entries, offset=offs[5])
+
+    def __len__(self):
+        return self.n_states
+
+    def _key_bytes(self, i):
+        start = self._keys_off + int(self.key_offsets[i])
+        end = self._keys_off + int(self.key_offsets[i + 1])
+        return self._mm[start:end]
+
+    def key_at(self, i):
+        return self._key_bytes(i).decode("utf-8")
+
+    def index(self, key):
+        """Vị trí của state trong snapshot, hoặc -1 nếu không có."""
+        if not isinstance(key, str) or not self.n_states:
+            return -1
+        h = np.uint64(key_hash(key))
+        i = int(np.searchsorted(self.hashes, h))
+        kb = key.encode("utf-8")
+        while i < self.n_states and self.hashes[i] == h:
+            if self._key_bytes(i) == kb:
+                return i
+            i += 1
+        return -1
+
+    def __contains__(self, key):
+        return self.index(key) >= 0
+
+    def row(self, i):
+        """(actions, values) array views for state i — không copy."""
+        lo, hi = int(self.indptr[i]), int(self.indptr[i + 1])
+        return self.actions[lo:hi], self.values[lo:hi]
+
+    def lookup(self, i, actions):
+        """Q-values of `actions` in row i (0.0 where missing), vectorized."""
+        acts, vals = self.row(i)
+        want = np.asarray(actions, dtype=np.int64)
+        out = np.zeros(len(want), dtype=np.float64)
+        if not len(acts):
+            return out
+        pos = np.minimum(np.searchsorted(acts, want), len(acts) - 1)
+        hit = acts[pos] == want
+        out[hit] = vals[pos[hit]]
+        return out
+
+    def get(self, key, default=None):
+        """Materialize một state thành {action: value}."""
+        i = self.index(key)
+        if i < 0:
+            return default
+        acts, vals = self.row(i)
+        return dict(zip(acts.tolist(), vals.tolist()))
+
+    def keys(self):
+        for i in range(self.n_states):
+            yield self.key_at(i)
+
+    def items(self):
+        for i in range(self.n_states):
+            acts, vals = self.row(i)
+            yield self.key_at(i), dict(zip(acts.tolist(), vals.tolist()))
+
+    def close(self):
+        # numpy views giữ buffer; chỉ đóng được khi không còn view nào
+        try:
+            self._mm.close()
+        except BufferError:
+            pass
+
+
+def load_table(path):
+    """Đọc toàn bộ bảng (JSON hoặc .sqt) thành dict — dùng cho converter/export."""
+    if is_snapshot(path):
+        return dict(MappedQTable(path).items())
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def convert(src, dst, dtype="float64"):
+    table = load_table(src)
+    if dst.endswith(SNAPSHOT_EXT):
+        n_states, n_entries = write_snapshot(table, dst, dtype=dtype)
+        print(f"Wrote {n_states} states / {n_entries} entries to {dst}")
+    else:
+        tmp = f"{dst}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(table, f, indent=2)
+        os.replace(tmp, dst)
+        print(f"Exported {len(table)} states to {dst}")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Convert SARSA tables between JSON and binary .sqt snapshots")
+    p.add_argument('src', help='sarsa_table.json hoặc file .sqt')
+    p.add_argument('dst', help='đích; đuôi .sqt -> binary, còn lại -> JSON')
+    p.add_argument('--float32', dest='dtype', action='store_const', const='float32', default='float64',
+                   help='lưu value dạng float32 (nhỏ hơn một nửa)')
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    convert(args.src, args.dst, dtype=args.dtype)
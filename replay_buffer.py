@@ -0,0 +1,136 @@
+"""Fixed-capacity experience replay for online SARSA updates.
+
+Transition (state_key, action, reward, next_state_key, done) nằm trong các mảng NumPy dạng
+vòng (ring): khi đầy, transition cũ nhất bị ghi đè nên bộ nhớ bị chặn bởi ``capacity``.
+State key là chuỗi đã có sẵn trong Q-table (StateEncoder intern) nên không tốn thêm nhiều.
+
+Lấy mẫu đều, hoặc ưu tiên theo |TD error| (prioritized replay): P(i) ~ (|td_i| + eps)^alpha;
+transition mới nhận priority lớn nhất từng thấy (``max_priority``, giữ dạng running max nên
+add() là O(1)) để chắc chắn được replay ít nhất một lần. Không prioritized thì priority
+không được duy trì.
+"""
+import os
+
+import numpy as np
+
+try:
+    from .qtable_snapshot import canonical_action
+except ImportError:
+    from qtable_snapshot import canonical_action
+
+__all__ = ["ReplayBuffer"]
+
+
+class ReplayBuffer:
+    def __init__(self, capacity=100000, prioritized=False, alpha=0.6, eps=1e-3, seed=None):
+        """
+        capacity: số transition tối đa
+        prioritized: lấy mẫu theo |TD error| thay vì đều
+        alpha: mức độ ưu tiên (0 = đều)
+        eps: cộng vào |TD error| để transition nào cũng có cơ hội
+        """
+        self.capacity = max(1, int(capacity))
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.eps = eps
+        self.rng = np.random.default_rng(seed)
+        self.states = np.empty(self.capacity, dtype=object)
+        self.actions = np.empty(self.capacity, dtype=object)
+        self.rewards = np.zeros(self.capacity, dtype=np.float64)
+        self.next_states = np.empty(self.capacity, dtype=object)
+        self.dones = np.zeros(self.capacity, dtype=bool)
+        self.priorities = np.zeros(self.capacity, dtype=np.float64)
+        self.max_priority = 1.0
+        self.pos = 0
+        self.size = 0
+        self.added = 0
+        self.sampled = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state_key, action, reward, next_state_key, done, td_error=None):
+        i = self.pos
+        self.states[i] = state_key
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state_key
+        self.dones[i] = done
+        if self.prioritized:
+            if td_error is not None:
+                self.max_priority = max(self.max_priority, abs(td_error) + self.eps)
+            self.priorities[i] = self.max_priority
+        self.pos = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.added += 1
+
+    def sample(self, batch_size):
+        """Trả về (indices, [(state_key, action, reward, next_state_key, done), ...])."""
+        n = self.size
+        if not n:
+            return np.zeros(0, dtype=np.int64), []
+        batch_size = min(int(batch_size), n)
+        if self.prioritized:
+            p = self.priorities[:n] ** self.alpha
+            idx = self.rng.choice(n, size=batch_size, replace=False, p=p / p.sum())
+        else:
+            idx = self.rng.choice(n, size=batch_size, replace=False)
+        self.sampled += batch_size
+        items = list(zip(self.states[idx], self.actions[idx], self.rewards[idx].tolist(),
+                         self.next_states[idx], self.dones[idx].tolist()))
+        return idx, items
+
+    def update_priorities(self, indices, td_errors):
+        if not self.prioritized or not len(indices):
+            return
+        priorities = np.abs(np.asarray(td_errors, dtype=np.float64)) + self.eps
+        self.priorities[indices] = priorities
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+
+    def stats(self):
+        return {"size": self.size, "capacity": self.capacity, "prioritized": self.prioritized,
+                "added": self.added, "sampled": self.sampled}
+
+    # --- persistence ---
+    def save(self, path):
+        """Ghi các transition còn trong buffer (cũ -> mới) ra .npz, atomic."""
+        n = self.size
+        order = (np.arange(n) + (self.pos if n == self.capacity else 0)) % self.capacity
+        actions = [canonical_action(a) for a in self.actions[order]]
+        int_actions = all(isinstance(a, int) for a in actions)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, states=np.array(self.states[order].tolist(), dtype=str),
+                     next_states=np.array(self.next_states[order].tolist(), dtype=str),
+                     actions=np.array(actions, dtype=np.int64 if int_actions else str),
+                     rewards=self.rewards[order], dones=self.dones[order],
+                     priorities=self.priorities[order])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def load(self, path):
+        """Nạp transition từ file của save() (giữ tối đa capacity transition mới nhất)."""
+        with np.load(path) as data:
+            n = len(data["rewards"])
+            keep = slice(max(0, n - self.capacity), n)
+            states = data["states"][keep].tolist()
+            next_states = data["next_states"][keep].tolist()
+            actions = [canonical_action(a) for a in data["actions"][keep].tolist()]
+            rewards = data["rewards"][keep]
+            dones = data["dones"][keep]
+            priorities = data["priorities"][keep]
+        m = len(rewards)
+        self.states[:m] = states
+        self.next_states[:m] = next_states
+        self.actions[:m] = actions
+        self.rewards[:m] = rewards
+        self.dones[:m] = dones
+        self.priorities[:m] = priorities
+        if self.prioritized and m:
+            # file từ buffer không prioritized: priority bằng 0, coi như transition mới
+            self.max_priority = max(self.max_priority, float(priorities.max()))
+            self.priorities[:m][self.priorities[:m] <= 0] = self.max_priority
+        self.size = m
+        self.pos = m % self.capacity
+        return m
@@ -1,49 +1,87 @@
-import json
+import heapq
 import os
+import sys
 import time
-from statistics import mean, median
+from collections import Counter
+from statistics import median
+
+import numpy as np
+
+from qtable_snapshot import MappedQTable, is_snapshot
+from qtable import clean_row, iter_json_table
 
 PATH = 'sarsa_table.json'
 
-def main():
-    if not os.path.exists(PATH):
-        print('No Q-table found at', PATH)
+
+def report_snapshot(path):
+    """Report cho file .sqt: đọc thẳng các mảng mmap, không dựng dict."""
+    t = MappedQTable(path)
+    counts = np.diff(t.indptr)
+    print('Q-table path:', path)
+    print('File size (bytes):', os.path.getsize(path))
+    print('Last modified:', time.ctime(os.path.getmtime(path)))
+    print('Snapshot version:', t.version, '| value dtype:', t.values.dtype)
+    print('Number of states:', len(t))
+    if len(t):
+        print('Actions per state: avg={:.2f}, med={}'.format(counts.mean(), np.median(counts)))
+    print('\nTop 10 Q-values:')
+    k = min(10, t.n_entries)
+    if k:
+        top = np.argpartition(t.values, -k)[-k:]
+        top = top[np.argsort(t.values[top])[::-1]]
+        for e in top:
+            s = int(np.searchsorted(t.indptr, e, side='right')) - 1
+            print(f'  Q={float(t.values[e]):.6f}  action={int(t.actions[e])}  state_preview="{t.key_at(s)[:120]}"')
+    print('\nSample 5 states:')
+    for i in range(min(5, len(t))):
+        acts, vals = t.row(i)
+        print(' STATE:', t.key_at(i)[:120])
+        print('  actions:', dict(zip(acts.tolist(), vals.tolist())))
+
+
+def main(path=PATH):
+    if not os.path.exists(path):
+        print('No Q-table found at', path)
+        return
+    if is_snapshot(path):
+        report_snapshot(path)
         return
-    size = os.path.getsize(PATH)
-    mtime = os.path.getmtime(PATH)
-    with open(PATH, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    states = len(data)
-    actions_counts = [len(v) for v in data.values()]
-    avg_actions = mean(actions_counts) if actions_counts else 0
-    med_actions = median(actions_counts) if actions_counts else 0
-
-    # collect top Q-values
-    xs = []
-    for s, v in data.items():
-        for a, val in v.items():
-            try:
-                xs.append((float(val), s, a))
-            except Exception:
-                pass
-    xs.sort(reverse=True, key=lambda t: t[0])
-
-    print('Q-table path:', PATH)
+    size = os.path.getsize(path)
+    mtime = os.path.getmtime(path)
+
+    # đọc tuần tự từng state (qtable.py): không nạp cả file, top 10 bằng heap 10 phần tử
+    states = 0
+    actions_counts = Counter()
+    samples = []
+
+    def values():
+        nonlocal states
+        for s, v in iter_json_table(path):
+            states += 1
+            actions_counts[len(v)] += 1
+            if len(samples) < 5:
+                samples.append((s, v))
+            row, _ = clean_row(v)
+            for a, val in row.items():
+                yield val, s, a
+
+    top = heapq.nlargest(10, values(), key=lambda t: t[0])
+    avg_actions = sum(n * c for n, c in actions_counts.items()) / states if states else 0
+    med_actions = median(actions_counts.elements()) if states else 0
+
+    print('Q-table path:', path)
     print('File size (bytes):', size)
     print('Last modified:', time.ctime(mtime))
     print('Number of states:', states)
     print('Actions per state: avg={:.2f}, med={}'.format(avg_actions, med_actions))
     print('\nTop 10 Q-values:')
-    for val, s, a in xs[:10]:
+    for val, s, a in top:
         print(f'  Q={val:.6f}  action={a}  state_preview="{s[:120]}"')
 
     print('\nSample 5 states:')
-    i = 0
-    for s, v in list(data.items())[:5]:
+    for s, v in samples:
         print(' STATE:', s[:120])
-        print('  actions:', {k: float(vv) for k, vv in v.items()})
-        i += 1
+        print('  actions:', clean_row(v)[0])
 
 if __name__ == '__main__':
-    main()
+    main(sys.argv[1] if len(sys.argv) > 1 else PATH)
@@ -1,32 +1,216 @@
+import heapq
 import json
 import random
 import os
+import threading
+import time
 from collections import defaultdict
 
+try:
+    from .sarsa_journal import TransitionJournal
+    from .qtable_snapshot import SNAPSHOT_EXT, MappedQTable, canonical_action, is_snapshot, write_snapshot
+    from .state_encoder import StateEncoder
+    from .replay_buffer import ReplayBuffer
+except ImportError:
+    from sarsa_journal import TransitionJournal
+    from qtable_snapshot import SNAPSHOT_EXT, MappedQTable, canonical_action, is_snapshot, write_snapshot
+    from state_encoder import StateEncoder
+    from replay_buffer import ReplayBuffer
+
 # expose public API from this module
-__all__ = ["SARSAAgent", "OnlineLearningAgent"]
+__all__ = ["SARSAAgent", "OnlineLearningAgent", "make_agent", "state_to_key"]
+
+class _SnapshotQ(defaultdict):
+    """Q-table phủ lên một snapshot .sqt đã mmap.
+
+    State chỉ được materialize thành dict khi được truy cập lần đầu, nên agent phục vụ
+    predict ngay sau khi mở file thay vì phải dựng lại toàn bộ bảng.
+    """
+
+    def __init__(self, base, default_factory):
+        super().__init__(default_factory)
+        self.base = base
+        self.new_keys = 0   # state có trong overlay nhưng không có trong snapshot
+
+    def __len__(self):
+        # state của snapshot (kể cả chưa materialize) + state mới chỉ có trong overlay
+        return len(self.base) + self.new_keys
+
+    def __setitem__(self, key, row):
+        if not dict.__contains__(self, key) and key not in self.base:
+            self.new_keys += 1
+        dict.__setitem__(self, key, row)
+
+    def __missing__(self, key):
+        entry = self.default_factory()
+        row = self.base.get(key)
+        if row:
+            entry.update(row)
+        self[key] = entry
+        return entry
+
+    def get(self, key, default=None):
+        # đọc không tạo entry mặc định, nhưng vẫn thấy các state nằm trong snapshot
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        if key in self.base:
+            return self[key]
+        return default
+
+    def all_items(self):
+        yield from self.items()
+        for i in range(len(self.base)):
+            key = self.base.key_at(i)
+            if not dict.__contains__(self, key):
+                acts, vals = self.base.row(i)
+                yield key, dict(zip(acts.tolist(), vals.tolist()))
+
+
+def _pairs(table):
+    """Các cặp (key, row) của một dict, hoặc chính table nếu đã là iterable các cặp."""
+    return table.items() if hasattr(table, "items") else table
+
+
+def greedy_in_row(entries, actions):
+    """Action có Q lớn nhất trong set `actions`, khi chỉ các cặp (action, Q) của `entries`
+    (hàng của một state) có giá trị và mọi action khác đọc là 0.0.
+
+    O(số entry): chỉ duyệt `actions` khi cần một action chưa có entry (max < 0 hoặc không
+    entry nào thuộc `actions`), và dừng ở action đầu tiên như vậy. None nếu `actions` rỗng.
+    """
+    best_a, best = None, 0.0
+    present = set()
+    for a, v in entries:
+        if a in actions:
+            present.add(a)
+            if best_a is None or v > best:
+                best_a, best = a, v
+    if len(present) < len(actions) and (best_a is None or best < 0.0):
+        for a in actions:
+            if a not in present:
+                return a
+    return best_a
+
+
+def write_table(table, path):
+    """Ghi table ra path theo đuôi file (.sqt -> binary, còn lại JSON), atomic.
+
+    table là dict hoặc iterable các cặp (key, row); JSON được ghi từng state một nên bảng
+    không cần nằm trọn trong RAM (ví dụ snapshot của storage tiered).
+    """
+    if path.endswith(SNAPSHOT_EXT):
+        write_snapshot(table, path)
+        return
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        # cùng định dạng với json.dump(table, f, indent=2)
+        sep = "{\n  "
+        for key, row in _pairs(table):
+            f.write(sep + json.dumps(key) + ": " + json.dumps(row, indent=2).replace("\n", "\n  "))
+            sep = ",\n  "
+        f.write("{}" if sep == "{\n  " else "\n}")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def state_to_key(state):
+    """
+    Chuyển state thành key (string) để lưu Q-table.
+    Nếu state đã là str, trả lại trực tiếp.
+    Nếu state là tuple/list, chuyển thành str.
+    Điều chỉnh nếu state trong repo của bạn có dạng khác.
+    """
+    if isinstance(state, str):
+        return state
+    try:
+        return json.dumps(state, sort_keys=True)
+    except:
+        return str(state)
+
+
+def explore_slots(ranked, possible_actions, epsilon, q_of):
+    """Thay từng slot của `ranked` ([(action, q)]) bằng action ngẫu nhiên với xác suất epsilon.
+
+    q_of(action) trả Q của action thay vào. Trả về danh sách action được chọn do khám phá.
+    """
+    if epsilon <= 0 or len(possible_actions) <= len(ranked):
+        return []
+    taken = {a for a, _ in ranked}
+    explored = []
+    for i in range(len(ranked)):
+        if random.random() >= epsilon:
+            continue
+        # rejection sampling: possible_actions has more than k items, so this ends quickly
+        for _ in range(16):
+            a = random.choice(possible_actions)
+            if a not in taken:
+                taken.add(a)
+                ranked[i] = (a, float(q_of(a)))
+                explored.append(a)
+                break
+    return explored
+
+
+def _read_json_table(path):
+    # file hỏng (ví dụ bị cắt ngang) không được coi là bảng rỗng: báo lỗi cho caller
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except ValueError as e:
+        raise ValueError(f"corrupt SARSA table '{path}': {e}") from e
+    # other IO errors -> propagate so caller can handle if desired
+
+
+def _quarantine(path):
+    """Đổi tên file bảng hỏng thành <path>.corrupt-<time> để lần save sau không ghi đè mất."""
+    dst = f"{path}.corrupt-{time.strftime('%Y%m%d-%H%M%S')}"
+    try:
+        os.replace(path, dst)
+    except OSError:
+        return None
+    return dst
+
 
 class SARSAAgent:
-    def __init__(self, actions, alpha=0.1, gamma=0.99, epsilon=0.1, q_table_path="sarsa_table.json"):
+    # số state tối đa trong chỉ mục argmax (None = không giới hạn; TieredSARSAAgent đặt theo RAM)
+    index_limit = None
+
+    def __init__(self, actions, alpha=0.1, gamma=0.99, epsilon=0.1, q_table_path="sarsa_table.json",
+                 state_encoder=None, autoload=True):
         """
         actions: list-like các action hợp lệ (ví dụ [0,1,2,3])
         alpha: learning rate
         gamma: discount factor
         epsilon: epsilon cho epsilon-greedy
         q_table_path: file lưu Q-table JSON
+        state_encoder: callable state -> key (ví dụ StateEncoder); mặc định state_to_key
+        autoload: False thì không tự load q_table_path (caller tự gọi load(), ví dụ khi hot-reload)
         """
         self.actions = list(actions)
+        self.state_to_key = state_encoder or state_to_key
         self.alpha = alpha
         self.gamma = gamma
         self.epsilon = epsilon
         self.q_table_path = q_table_path
         # SARSA table (bảng giá trị) là dict: { state_str: {action: value, ...}, ... }
-        self.q = defaultdict(lambda: {a: 0.0 for a in self.actions})
+        self.q = self._empty_table()
+        # chỉ mục greedy: state_key -> (max Q, set action đạt max), dựng lười khi state được
+        # đọc lần đầu và được update()/set_q() giữ đúng
+        self._best = {}
+        if not autoload:
+            return
         # nếu file tồn tại -> load
         if os.path.exists(self.q_table_path):
             try:
                 self.load(self.q_table_path)
                 print(f"Loaded SARSA table from {self.q_table_path}")
+            except ValueError as e:
+                # file hỏng: cất sang bên cạnh thay vì để save() kế tiếp ghi đè bằng bảng rỗng
+                self.q = self._empty_table()
+                moved = _quarantine(self.q_table_path)
+                print(f"WARNING: Không thể load SARSA table: {e}. Starting with an EMPTY table; "
+                      f"corrupt file moved to {moved}")
             except Exception as e:
                 print("Không thể load SARSA table:", e)
         else:
@@ -41,38 +225,29 @@ class SARSAAgent:
                 except Exception as e:
                     print("Không thể migrate legacy Q-table:", e)
 
-    def state_to_key(self, state):
-        """
-        Chuyển state thành key (string) để lưu Q-table.
-        Nếu state đã là str, trả lại trực tiếp.
-        Nếu state là tuple/list, chuyển thành str.
-        Điều chỉnh nếu state trong repo của bạn có dạng khác.
-        """
-        if isinstance(state, str):
-            return state
-        try:
-            return json.dumps(state, sort_keys=True)
-        except:
-            return str(state)
+    def _empty_table(self):
+        return defaultdict(lambda: {a: 0.0 for a in self.actions})
+
+    def _peek(self, key):
+        """{action: value} của state để đọc — không tạo entry cho state chưa từng được cập nhật."""
+        return self.q.get(key) or {}
 
-    def choose_action(self, state):
-        """Epsilon-greedy: chọn action theo Q hiện tại"""
+    def choose_action(self, state, actions=None):
+        """Epsilon-greedy: chọn action theo Q hiện tại.
+
+        actions: tập action được phép (mặc định self.actions)
+        """
         key = self.state_to_key(state)
+        actions = self.actions if actions is None else list(actions)
         # khám phá
         if random.random() < self.epsilon:
-            return random.choice(self.actions)
+            return random.choice(actions)
         # khai thác: chọn action có Q lớn nhất (break ties ngẫu nhiên)
-        q_vals = self.q[key]
-        # ensure we choose among self.actions so returned action has the expected type
-        values = [q_vals.get(a, q_vals.get(str(a), 0.0)) for a in self.actions]
-        max_q = max(values) if values else 0.0
-        max_actions = [a for a, v in zip(self.actions, values) if v == max_q]
-        if not max_actions:
-            # fallback: use keys from q_vals
-            max_q2 = max(q_vals.values()) if q_vals else 0.0
-            max_actions2 = [a for a, v in q_vals.items() if v == max_q2]
-            return random.choice(max_actions2)
-        return random.choice(max_actions)
+        greedy = self._greedy(key, actions)
+        if greedy is None:
+            # state chưa có entry: mọi action đều 0.0
+            return random.choice(actions)
+        return random.choice(greedy[0])
 
     def update(self, state, action, reward, next_state, next_action, done):
         """
@@ -82,19 +257,108 @@ class SARSAAgent:
         """
         s_key = self.state_to_key(state)
         s_next_key = self.state_to_key(next_state)
-        # ensure entries exist so .get won't fail and types are consistent
-        _ = self.q[s_key]
-        _ = self.q[s_next_key]
+        # chỉ state được cập nhật mới cần entry; s' chỉ được đọc
         q_sa = self.q[s_key].get(action, 0.0)
         q_snext_anext = 0.0
         if not done:
-            q_snext_anext = self.q[s_next_key].get(next_action, 0.0)
+            q_snext_anext = self._peek(s_next_key).get(next_action, 0.0)
         td_target = reward + (0 if done else self.gamma * q_snext_anext)
         td_error = td_target - q_sa
         new_q = q_sa + self.alpha * td_error
         self.q[s_key][action] = new_q
+        self._index_write(s_key, action, new_q)
         return td_error
 
+    # --- chỉ mục max/argmax theo state ---
+    def _argmax(self, key, q_vals):
+        """(max Q, set action đạt max) trên các entry của state; tính từ hàng nếu chưa có."""
+        entry = self._best.get(key)
+        if entry is None:
+            best = max(q_vals.values())
+            entry = (best, {a for a, v in q_vals.items() if v == best})
+            if self.index_limit and len(self._best) >= self.index_limit:
+                # bỏ entry cũ nhất (thứ tự chèn); sẽ được tính lại khi cần
+                del self._best[next(iter(self._best))]
+            self._best[key] = entry
+        return entry
+
+    def _index_write(self, key, action, value):
+        entry = self._best.get(key)
+        if entry is None:
+            return
+        best, ties = entry
+        if value > best:
+            self._best[key] = (value, {action})
+        elif value == best:
+            ties.add(action)
+        elif action in ties:
+            if len(ties) == 1:
+                # max giảm: tính lại (O(số action của state)) ở lần đọc sau
+                del self._best[key]
+            else:
+                ties.discard(action)
+
+    def _greedy(self, key, actions, all_ties=True):
+        """([các action hoà điểm cao nhất trong `actions`], Q); None nếu state chưa có entry.
+
+        Tra chỉ mục: chỉ xét các action đang đạt max của state thay vì quét `actions`. Phải
+        quét khi không action tốt nhất nào nằm trong `actions`, hoặc max < 0 (action chưa có
+        entry đọc là 0.0 và sẽ thắng). max == 0 cũng quét để các action chưa có entry được
+        tính vào tập hoà, trừ khi all_ties=False (chỉ cần giá trị, ví dụ SARSA bootstrap).
+        Với all_ties=False và `actions` là set, max < 0 cũng không quét: hàng ít entry hơn
+        `actions` thì trả về một action chưa có entry với Q 0.0 (xem greedy_in_row).
+        """
+        q_vals = self._peek(key)
+        if not q_vals:
+            return None
+        best, ties = self._argmax(key, q_vals)
+        if best > 0.0 or (best == 0.0 and not all_ties):
+            if len(ties) > 8 and not isinstance(actions, (set, frozenset)):
+                actions = set(actions)
+            hit = [a for a in ties if a in actions]
+            if hit:
+                return hit, best
+        if not all_ties and isinstance(actions, (set, frozenset)):
+            a = greedy_in_row(q_vals.items(), actions)
+            return None if a is None else ([a], q_vals.get(a, 0.0))
+        values = [q_vals.get(a, 0.0) for a in actions]
+        if not values:
+            return None
+        max_q = max(values)
+        return [a for a, v in zip(actions, values) if v == max_q], max_q
+
+    # --- storage API dùng bởi OnlineLearningAgent (DenseSARSAAgent cài đặt lại) ---
+    def q_values(self, key):
+        """{action: value} của state `key`."""
+        return self._peek(key)
+
+    def get_q(self, key, action):
+        return self._peek(key).get(action, 0.0)
+
+    def set_q(self, key, action, value):
+        self.q[key][action] = value
+        self._index_write(key, action, value)
+
+    def greedy_action(self, key, actions):
+        """Action có Q lớn nhất trong `actions` (list hoặc set); None nếu state rỗng."""
+        greedy = self._greedy(key, actions, all_ties=False)
+        return None if greedy is None else greedy[0][0]
+
+    def top_k(self, key, actions, k):
+        """k action có Q cao nhất trong `actions`, giảm dần: [(action, value), ...].
+
+        k == 1 tra chỉ mục argmax; còn lại dùng heap (O(n log k)) thay vì sort toàn bộ.
+        Hoà thì phá ngẫu nhiên.
+        """
+        if k == 1 and actions:
+            greedy = self._greedy(key, actions)
+            if greedy is None:
+                return [(random.choice(actions), 0.0)]
+            return [(random.choice(greedy[0]), float(greedy[1]))]
+        q_vals = self._peek(key)
+        best = heapq.nlargest(k, ((q_vals.get(a, 0.0), random.random(), a) for a in actions))
+        return [(a, float(v)) for v, _, a in best]
+
     def save(self, path=None):
         path = path or self.q_table_path
         # Ensure parent directory exists (if any)
@@ -105,37 +369,42 @@ class SARSAAgent:
             except Exception:
                 # ignore directory creation errors, will surface on file open if real problem
                 pass
-        # chuyển defaultdict -> dict để dump JSON
-        q_dump = {k: v for k, v in self.q.items()}
         # JSON không chấp nhận keys không là str; ở đây keys đã là str nhờ state_to_key
-        with open(path, "w") as f:
-            json.dump(q_dump, f, indent=2)
+        # ghi ra file tạm rồi rename: process chết giữa chừng không để lại file bị cắt ngang
+        write_table(self._items(), path)
         print(f"SARSA table saved to {path}")
 
+    def _items(self):
+        if hasattr(self.q, "all_items"):
+            return self.q.all_items()
+        return self.q.items()
+
+    def snapshot(self):
+        """Bản sao (2 tầng) của Q-table, đủ để ghi ra đĩa ở thread khác mà không giữ lock."""
+        return {k: dict(v) for k, v in self._items()}
+
+    def dump(self, table, path):
+        """Ghi một snapshot() ra path (atomic)."""
+        write_table(table, path)
+
     def load(self, path=None):
         path = path or self.q_table_path
-        # robustly handle malformed JSON / IO errors
-        try:
-            with open(path, "r") as f:
-                q_loaded = json.load(f)
-        except (ValueError, json.JSONDecodeError) as e:
-            # corrupted file -> start with empty table and warn
-            print(f"Warning: failed to parse SARSA table '{path}': {e}. Starting with empty table.")
-            q_loaded = {}
-        except Exception as e:
-            # other IO errors -> re-raise so caller can handle if desired
-            raise
+        self._best = {}
+        if is_snapshot(path):
+            # binary snapshot: mmap, không parse; state được materialize khi truy cập
+            self.q = _SnapshotQ(MappedQTable(path), lambda: {a: 0.0 for a in self.actions})
+            return
+        q_loaded = _read_json_table(path)
 
         # convert back to defaultdict
-        self.q = defaultdict(lambda: {a: 0.0 for a in self.actions})
+        self.q = self._empty_table()
         for k, v in q_loaded.items():
             # ensure actions set exist (nếu thiếu action trong file, gán 0)
-            entry = {a: float(v.get(str(a), v.get(a, 0.0))) for a in self.actions}
-            # also keep any numeric-string keys from older format
+            entry = {a: 0.0 for a in self.actions}
+            # JSON keys are strings: fold "3" and 3 into one canonical int action
             for ak, av in v.items():
                 try:
-                    # try preserve non-listed action keys if any
-                    entry[ak] = float(av)
+                    entry[canonical_action(ak)] = float(av)
                 except:
                     pass
             self.q[k] = entry
@@ -150,44 +419,162 @@ class SARSAAgent:
         self.gamma = gamma
 
 
+def make_agent(storage="dict", **kwargs):
+    """Tạo SARSA agent theo kiểu storage ("dict", "dense", "tiered", "linear" hoặc "sharded").
+
+    kwargs riêng của từng storage (ví dụ max_resident_states cho "tiered") được truyền thẳng.
+    """
+    if storage == "dict":
+        return SARSAAgent(**kwargs)
+    if storage == "dense":
+        try:
+            from .dense_qtable import DenseSARSAAgent
+        except ImportError:
+            from dense_qtable import DenseSARSAAgent
+        return DenseSARSAAgent(**kwargs)
+    if storage == "tiered":
+        try:
+            from .tiered_qtable import TieredSARSAAgent
+        except ImportError:
+            from tiered_qtable import TieredSARSAAgent
+        return TieredSARSAAgent(**kwargs)
+    if storage == "linear":
+        try:
+            from .linear_sarsa import LinearSARSAAgent
+        except ImportError:
+            from linear_sarsa import LinearSARSAAgent
+        return LinearSARSAAgent(**kwargs)
+    if storage == "sharded":
+        try:
+            from .sharded_qtable import ShardedSARSAAgent
+        except ImportError:
+            from sharded_qtable import ShardedSARSAAgent
+        return ShardedSARSAAgent(**kwargs)
+    raise ValueError(f"unknown storage: {storage!r}")
+
+
 class OnlineLearningAgent:
     """
     Adapter to expose a simple online API (predict, learn) that the server expects.
     Wraps the SARSAAgent but accepts possible_actions at predict time and
     performs an on-policy SARSA update when `learn` is called.
     """
-    def __init__(self, model_path="sarsa_table.json", alpha=0.1, gamma=0.99, epsilon=0.1):
-        # initialize SARSAAgent with an empty action list; actions are managed per-state
-        self.sarsa = SARSAAgent(actions=[], alpha=alpha, gamma=gamma, epsilon=epsilon, q_table_path=model_path)
+    def __init__(self, model_path="sarsa_table.json", alpha=0.1, gamma=0.99, epsilon=0.1,
+                 journal_path=None, compact_every=5000, journal_sync_every=64, storage="dict",
+                 state_encoder=None, storage_options=None, replay_capacity=0, replay_prioritized=False):
+        """
+        journal_path: nếu đặt, mỗi update được ghi nối vào journal (O(1) I/O) thay vì
+            save() toàn bộ bảng; journal được replay lên snapshot khi khởi động.
+        compact_every: số bản ghi journal trước khi compaction ra snapshot mới (chạy nền)
+        journal_sync_every: fsync journal theo nhóm bao nhiêu bản ghi
+        storage: "dict" (SARSAAgent), "dense" (DenseSARSAAgent, mảng NumPy) hoặc
+            "tiered" (TieredSARSAAgent, giới hạn RAM + tầng lạnh sqlite) hoặc
+            "linear" (LinearSARSAAgent, xấp xỉ tuyến tính trên feature hash; model_path là .npz)
+            hoặc "sharded" (ShardedSARSAAgent, mỗi meal_time / hash một file + lock, load lười)
+        storage_options: kwargs riêng của storage, ví dụ {"max_resident_states": 100000}
+        state_encoder: mặc định StateEncoder() — key dạng avail=...|meal_time=...|history=...
+            giống bảng đã huấn luyện
+        replay_capacity: > 0 thì giữ các transition gần nhất trong ReplayBuffer để replay()
+            (lưu cạnh Q-table ở ``<model_path>.replay.npz``)
+        replay_prioritized: lấy mẫu replay theo |TD error|
+        """
+        # initialize the agent with an empty action list; actions are managed per-state
+        self.storage = storage
+        self.storage_options = dict(storage_options or {})
+        self.sarsa = make_agent(storage, actions=[], alpha=alpha, gamma=gamma, epsilon=epsilon,
+                                q_table_path=model_path, state_encoder=state_encoder or StateEncoder(),
+                                **(storage_options or {}))
+        # every recipe id seen so far; kept here rather than in sarsa.actions so new states
+        # don't get a zero entry per known recipe
+        self.known_actions = []
+        self._known_actions = set()
+        # guards self.sarsa.q against the compaction thread (and concurrent requests)
+        self._lock = threading.RLock()
+        self.compact_every = compact_every
+        self._compactor = None
+        # số replay chưa ghi journal từ snapshot gần nhất: compact() phải ghi snapshot dù
+        # journal rỗng
+        self._unsaved_replays = 0
+        # observe(stage, seconds): hook đo thời gian từng giai đoạn (encode, lookup, update,
+        # persist, save), ví dụ ServiceMetrics.observe_stage; None = không đo
+        self.observe = None
+        # hot-reload (reload()): trạng thái lần nạp gần nhất, và {(state, action): Q trước update}
+        # của các ô được cập nhật trong lúc bảng mới đang nạp ở nền (phần chênh được cộng lên
+        # bảng mới trước khi swap)
+        self.reload_status = {"state": "idle"}
+        self._reloads = 0
+        self._reload_dirty = None
+        self._reloader = None
+        self.journal = None
+        if journal_path:
+            self.journal = TransitionJournal(journal_path, sync_every=journal_sync_every)
+            replayed = self.journal.replay(self.sarsa.set_q)
+            if replayed:
+                print(f"Replayed {replayed} journal records from {journal_path}")
+        self.replay_buffer = None
+        self.replay_path = f"{model_path}.replay.npz"
+        if replay_capacity:
+            self.replay_buffer = ReplayBuffer(replay_capacity, prioritized=replay_prioritized)
+            if os.path.exists(self.replay_path):
+                try:
+                    n = self.replay_buffer.load(self.replay_path)
+                    print(f"Loaded {n} replay transitions from {self.replay_path}")
+                except Exception as e:
+                    print("Không thể load replay buffer:", e)
 
-    def _ensure_actions_for_state(self, state, actions):
-        key = self.sarsa.state_to_key(state)
+    def _register_actions(self, actions):
+        # the global actions list is what learn() bootstraps over; unseen actions read as 0.0
         for a in actions:
-            # keep action keys as the same type used by callers (usually int)
-            if a not in self.sarsa.q[key]:
-                self.sarsa.q[key][a] = 0.0
-            # also ensure the global actions list contains this action so choose_action uses it
-            if a not in self.sarsa.actions:
-                self.sarsa.actions.append(a)
-
-    def predict(self, state: dict, possible_actions: list):
-        """Return a suggestion for an action given the current state and list of possible actions.
-        Returns a dict with selected action and current q-values for the provided actions.
-        """
-        # ensure q entries exist for the provided actions
-        self._ensure_actions_for_state(state, possible_actions)
-        # temporarily set the agent's action list so choose_action explores among possible_actions
-        prev_actions = list(self.sarsa.actions)
-        try:
-            self.sarsa.actions = list(possible_actions)
-            action = self.sarsa.choose_action(state)
-        finally:
-            self.sarsa.actions = prev_actions
+            if a not in self._known_actions:
+                self._known_actions.add(a)
+                self.known_actions.append(a)
 
-        key = self.sarsa.state_to_key(state)
+    def predict(self, state: dict, possible_actions: list, k: int = 1):
+        """Return the top-k recipes for the current state among possible_actions.
+
+        Each of the k slots is independently replaced, with probability epsilon, by a
+        random not-yet-ranked action (exploration). Returns a dict with:
+            action:   the first recommendation (kept for older clients)
+            actions:  ranked list of k actions
+            q_values: {str(action): q} for the returned actions only
+            explored: actions placed by exploration rather than by Q
+        """
+        ranked, explored = self.predict_ranked(state, possible_actions, k)
+        actions = [a for a, _ in ranked]
         # prepare q-values in a JSON-serializable way (cast keys to str)
-        qvals = {str(k): float(v) for k, v in self.sarsa.q[key].items()}
-        return {"action": action, "q_values": qvals}
+        qvals = {str(a): v for a, v in ranked}
+        return {"action": actions[0] if actions else None, "actions": actions,
+                "q_values": qvals, "explored": explored}
+
+    def predict_ranked(self, state, possible_actions, k=1):
+        """Như predict() nhưng trả thẳng ([(action, q)], explored) — cho các encoder không
+        cần dict JSON (ví dụ endpoint msgpack)."""
+        with self._lock:
+            t0 = time.perf_counter()
+            key = self.sarsa.state_to_key(state)
+            t1 = time.perf_counter()
+            self._register_actions(possible_actions)
+            k = max(1, min(int(k), len(possible_actions)))
+            # partial selection (heap / argpartition) instead of sorting every candidate
+            ranked = self.sarsa.top_k(key, possible_actions, k)
+            explored = explore_slots(ranked, possible_actions, self.sarsa.epsilon,
+                                     lambda a: self.sarsa.get_q(key, a))
+            t2 = time.perf_counter()
+        observe = self.observe
+        if observe is not None:
+            observe("encode", t1 - t0)
+            observe("lookup", t2 - t1)
+        return ranked, explored
+
+    def predict_batch(self, requests, ranked=False):
+        """Predict for many (state, possible_actions, k) tuples under one lock; results in order.
+        ranked=True returns predict_ranked() tuples instead of response dicts."""
+        fn = self.predict_ranked if ranked else self.predict
+        results = []
+        with self._lock:
+            for state, possible_actions, k in requests:
+                results.append(fn(state, possible_actions, k))
+        return results
 
     def learn(self, state: dict, action_id, reward: float, next_state: dict, done: bool):
         """
@@ -197,59 +584,317 @@ class OnlineLearningAgent:
         according to the current Q (on-policy approximation). If no next actions exist,
         we use the current action as next_action (bootstrapping to itself).
         """
-        # Make sure current state/action entries exist
-        s_key = self.sarsa.state_to_key(state)
-        ns_key = self.sarsa.state_to_key(next_state)
-        # ensure dictionaries exist
-        _ = self.sarsa.q[s_key]
-        _ = self.sarsa.q[ns_key]
+        with self._lock:
+            t0 = time.perf_counter()
+            # encode each state once; the agent accepts keys in place of states
+            s_key = self.sarsa.state_to_key(state)
+            ns_key = self.sarsa.state_to_key(next_state)
+            t1 = time.perf_counter()
+            td_error = self._update_keys(s_key, action_id, reward, ns_key, done)
+            t2 = time.perf_counter()
+            self._persist([(s_key, action_id)])
+        observe = self.observe
+        if observe is not None:
+            observe("encode", t1 - t0)
+            observe("update", t2 - t1)
+        return {"status": "ok", "td_error": td_error}
+
+    def learn_batch(self, transitions, persist=True):
+        """Apply many (state, action_id, reward, next_state, done) transitions in one pass.
+
+        Updates run in arrival order (a later transition may bootstrap from an earlier one);
+        persistence happens once for the whole batch, with one journal record per touched
+        (state, action) carrying its final value. persist=False leaves persistence to the
+        caller (e.g. BackgroundLearner checkpoints).
+        Returns the per-transition results in order.
+        """
+        results = []
+        touched = {}
+        encode = update = 0.0
+        with self._lock:
+            for state, action_id, reward, next_state, done in transitions:
+                t0 = time.perf_counter()
+                s_key = self.sarsa.state_to_key(state)
+                ns_key = self.sarsa.state_to_key(next_state)
+                t1 = time.perf_counter()
+                td_error = self._update_keys(s_key, action_id, reward, ns_key, done)
+                update += time.perf_counter() - t1
+                encode += t1 - t0
+                touched[(s_key, action_id)] = None
+                results.append({"status": "ok", "td_error": td_error})
+            if persist:
+                self._persist(list(touched))
+        observe = self.observe
+        if observe is not None and results:
+            observe("encode", encode)
+            observe("update", update)
+        return results
 
+    def _update_keys(self, s_key, action_id, reward, ns_key, done, record=True):
+        # feedback alone (e.g. a learner process that never sees /predict) also grows the action set
+        if action_id not in self._known_actions:
+            self._register_actions((action_id,))
         # determine next_action: pick argmax over q-values in next_state if available
-        q_next = self.sarsa.q[ns_key]
-        next_action = action_id
-        if q_next:
-            # Prefer choosing next_action from the agent's known action list to keep types consistent
-            try:
-                best = None
-                best_val = None
-                for a in self.sarsa.actions:
-                    val = q_next.get(a, q_next.get(str(a), 0.0))
-                    if best is None or float(val) > best_val:
-                        best = a
-                        best_val = float(val)
-                if best is not None:
-                    next_action = best
-            except Exception:
-                # fallback to previous behavior
-                try:
-                    next_action = max(q_next.items(), key=lambda kv: float(kv[1]))[0]
-                except Exception:
-                    next_action = action_id
-
+        # (set: storage dict/tiered tra chỉ mục argmax thay vì quét mọi recipe đã biết)
+        next_action = self.sarsa.greedy_action(ns_key, self._known_actions)
+        if next_action is None:
+            next_action = action_id
+        dirty = self._reload_dirty
+        if dirty is not None and (s_key, action_id) not in dirty:
+            # hot reload đang chạy: nhớ giá trị trước update để áp lại phần chênh lên bảng mới
+            dirty[(s_key, action_id)] = self.sarsa.get_q(s_key, action_id)
         # perform SARSA update
+        td_error = self.sarsa.update(s_key, action_id, reward, ns_key, next_action, done)
+        if record and self.replay_buffer is not None:
+            self.replay_buffer.add(s_key, action_id, reward, ns_key, done, td_error)
+        return td_error
+
+    def replay(self, batch_size=32, persist=True):
+        """Học lại một mini-batch lấy từ replay buffer; trả về số transition đã replay.
+
+        Transition vẫn được cập nhật theo thứ tự lấy mẫu như learn_batch; priority được làm
+        mới bằng TD error vừa tính. persist=True thì ghi journal (nếu có) cho các ô vừa đổi;
+        persist=False (hoặc không có journal) thì để checkpoint kế tiếp (compact) ghi snapshot,
+        kể cả khi journal không có bản ghi mới.
+        """
+        if self.replay_buffer is None or not len(self.replay_buffer):
+            return 0
+        with self._lock:
+            idx, items = self.replay_buffer.sample(batch_size)
+            td_errors = []
+            touched = {}
+            for s_key, action_id, reward, ns_key, done in items:
+                td_errors.append(self._update_keys(s_key, action_id, reward, ns_key, done, record=False))
+                touched[(s_key, action_id)] = None
+            self.replay_buffer.update_priorities(idx, td_errors)
+            if persist and self.journal is not None:
+                self._persist(list(touched))
+            else:
+                self._unsaved_replays += len(items)
+        return len(items)
+
+    def save_replay(self, path=None):
+        if self.replay_buffer is None:
+            return
+        with self._lock:
+            self.replay_buffer.save(path or self.replay_path)
+
+    def _persist(self, touched):
+        """touched: [(state_key, action)] vừa được cập nhật."""
+        # persist: journal chỉ ghi nối bản ghi mới; không có journal thì save toàn bộ bảng
+        t0 = time.perf_counter()
         try:
-            td_error = self.sarsa.update(state, action_id, reward, next_state, next_action, done)
-        except Exception as e:
-            # make a best-effort: if update fails because action keys are strings/numbers, coerce keys
-            # convert existing q entries to use same action key types
-            # fallback: ensure numeric key exists
-            if action_id not in self.sarsa.q[s_key]:
-                self.sarsa.q[s_key][action_id] = 0.0
-            if next_action not in self.sarsa.q[ns_key]:
-                self.sarsa.q[ns_key][next_action] = 0.0
-            td_error = self.sarsa.update(state, action_id, reward, next_state, next_action, done)
-
-        # persist the SARSA table after learning (simple, safe default)
-        try:
-            self.sarsa.save()
+            if self.journal is not None:
+                self.journal.append_many((k, a, self.sarsa.get_q(k, a)) for k, a in touched)
+                if self.journal.records >= self.compact_every:
+                    self.compact()
+            elif self._reload_dirty is None:
+                # đang hot reload thì không save bảng cũ đè lên file bảng mới sắp được ghi
+                self.sarsa.save()
         except Exception:
             # ignore save errors for now; server will log exceptions
             pass
+        if self.observe is not None:
+            self.observe("persist", time.perf_counter() - t0)
 
-        return {"status": "ok", "td_error": td_error}
+    def storage_stats(self):
+        """Số state trong bảng và (nếu có) thống kê tầng nhớ: hit rate, resident size..."""
+        with self._lock:
+            stats = {"storage": self.storage, "known_actions": len(self.known_actions)}
+            if self.replay_buffer is not None:
+                stats["replay"] = self.replay_buffer.stats()
+            table = self.sarsa.q
+            if hasattr(table, "stats"):
+                stats.update(table.stats())
+            else:
+                stats["states"] = len(table)
+        return stats
+
+    def compact(self, wait=False):
+        """Rotate the journal and write a new snapshot in a background thread.
+
+        Chỉ phần rotate + copy bảng trong bộ nhớ giữ lock; ghi file chạy nền. Khi snapshot
+        đã nằm an toàn trên đĩa thì các đoạn journal cũ mới bị xoá. Journal rỗng thì chỉ ghi
+        snapshot khi có replay chưa được journal.
+        """
+        if self.journal is None:
+            if self._reload_dirty is None:
+                # đang hot reload thì không save bảng cũ đè lên file bảng mới (xem _swap)
+                self.save()
+                self._unsaved_replays = 0
+            return
+        with self._lock:
+            if self._reload_dirty is not None:
+                # hot reload đang chạy: bảng mới được ghi ra đĩa lúc swap, compaction chờ tới sau đó
+                return
+            thread = self._compactor
+            running = thread is not None and thread.is_alive()
+            if not running:
+                segment = self.journal.rotate()
+                if segment is None and not self._unsaved_replays:
+                    return
+                self._unsaved_replays = 0
+                # storage sharded: chỉ copy (và ghi lại) các shard bị đổi
+                dirty = getattr(self.sarsa, "dirty_snapshot", None)
+                table = dirty() if dirty is not None else self.sarsa.snapshot()
+                thread = threading.Thread(target=self._write_compacted, args=(table, segment),
+                                          name="sarsa-compact", daemon=True)
+                self._compactor = thread
+                thread.start()
+        if wait:
+            thread.join()
+            if running:
+                # lần compaction vừa chờ copy bảng từ trước: chụp lại những gì đến sau đó
+                self.compact(wait=True)
+
+    def _write_compacted(self, table, segment):
+        t0 = time.perf_counter()
+        sarsa = self.sarsa
+        try:
+            sarsa.dump(table, sarsa.q_table_path)
+        except Exception as e:
+            # segment stays on disk and is replayed on next start
+            print(f"Journal compaction failed: {e}")
+            return
+        if self.observe is not None:
+            self.observe("save", time.perf_counter() - t0)
+        if segment is not None:
+            self.journal.discard(segment)
+
+    # --- hot reload ---
+    def reload(self, path, policy="replace", wait=False):
+        """Nạp bảng từ `path` ở nền rồi thay bảng đang phục vụ bằng một phép gán tham chiếu.
+
+        policy:
+            "replace"  bảng mới thay hoàn toàn bảng cũ
+            "merge"    giá trị trong file mới thắng; state/action chỉ có trong bảng đang chạy
+                       (học online) được giữ lại
+        Với cả hai policy, phần chênh mà các update online tạo ra trên bảng cũ trong lúc đang
+        nạp được cộng lại lên giá trị của bảng mới. Request vẫn được phục vụ bởi bảng cũ cho
+        tới lúc swap; chỉ bước swap giữ lock. Bảng mới (đã cộng phần chênh) được ghi ra
+        model_path ngay trước swap; checkpoint của bảng cũ bị hoãn trong lúc nạp, journal cũ
+        bị bỏ sau swap.
+        Trả về thread nạp; raise RuntimeError nếu đang có một lần reload khác chạy.
+        """
+        if policy not in ("replace", "merge"):
+            raise ValueError(f"unknown reload policy: {policy!r}")
+        if policy == "merge" and self.storage == "linear":
+            raise ValueError("merge policy needs a tabular storage (dict, dense, tiered)")
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        with self._lock:
+            if self._reloader is not None and self._reloader.is_alive():
+                raise RuntimeError("a reload is already in progress")
+            self._reload_dirty = {}
+            self.reload_status = {"state": "loading", "path": path, "policy": policy, "started": time.time()}
+            thread = threading.Thread(target=self._run_reload, args=(path, policy),
+                                      name="sarsa-reload", daemon=True)
+            self._reloader = thread
+            thread.start()
+        if wait:
+            thread.join()
+        return thread
+
+    def _new_sarsa(self):
+        """Agent rỗng cùng cấu hình với agent đang chạy (không tự load file)."""
+        options = dict(self.storage_options)
+        options.pop("init_from", None)
+        self._reloads += 1
+        if self.storage == "tiered":
+            # tầng lạnh riêng: TieredQTable xoá và tạo lại file sqlite của nó
+            options["spill_path"] = f"{self.sarsa.q_table_path}.reload{self._reloads}.spill.sqlite"
+        return make_agent(self.storage, actions=[], alpha=self.sarsa.alpha, gamma=self.sarsa.gamma,
+                          epsilon=self.sarsa.epsilon, q_table_path=self.sarsa.q_table_path,
+                          state_encoder=self.sarsa.state_to_key, autoload=False, **options)
+
+    def _run_reload(self, path, policy):
+        t0 = time.perf_counter()
+        try:
+            new = self._new_sarsa()
+            new.load(path)
+            if policy == "merge":
+                with self._lock:
+                    live = self.sarsa.snapshot()
+                for key, row in _pairs(live):
+                    have = new.q_values(key)
+                    for a, v in row.items():
+                        if a not in have:
+                            new.set_q(key, a, v)
+                del live
+            self._swap(new)
+        except Exception as e:
+            with self._lock:
+                self._reload_dirty = None
+                self.reload_status = {**self.reload_status, "state": "failed", "error": str(e)}
+            print(f"Reload from {path} failed: {e}")
+            return
+        self.reload_status = {**self.reload_status, "state": "done",
+                              "seconds": round(time.perf_counter() - t0, 3)}
+        print(f"Reloaded SARSA table from {path} (policy={policy})")
+
+    def _drain_reload_deltas(self):
+        """[(key, action, delta)] của các ô bảng cũ học được từ lần gọi trước; giữ self._lock."""
+        dirty, self._reload_dirty = self._reload_dirty, {}
+        return [(k, a, self.sarsa.get_q(k, a) - before) for (k, a), before in dirty.items()]
+
+    @staticmethod
+    def _apply_deltas(new, deltas):
+        for key, action, delta in deltas:
+            if delta:
+                new.set_q(key, action, new.get_q(key, action) + delta)
+
+    def _swap(self, new):
+        # compaction/save của bảng cũ bị hoãn từ lúc reload bắt đầu (compact, _persist) tới khi
+        # swap xong. Chờ lần compaction đang chạy, áp phần chênh học online lên bảng mới rồi ghi
+        # nó ra model_path — ngoài lock, vì bảng mới chưa được request nào dùng
+        pending = self._compactor
+        if pending is not None:
+            pending.join()
+        with self._lock:
+            deltas = self._drain_reload_deltas()
+        self._apply_deltas(new, deltas)
+        new.dump(new.snapshot(), new.q_table_path)
+        segment = None
+        with self._lock:
+            # update đến trong lúc ghi file: thường rất ít
+            late = self._drain_reload_deltas()
+            self._apply_deltas(new, late)
+            self._reload_dirty = None
+            old, self.sarsa = self.sarsa, new
+            if self.journal is not None:
+                # journal tới thời điểm swap thuộc về bảng cũ; các ô học online trong lúc nạp
+                # được ghi lại vào đoạn mới để sống sót qua restart
+                segment = self.journal.rotate()
+                cells = dict.fromkeys((k, a) for k, a, _ in deltas + late)
+                if cells:
+                    self.journal.append_many((k, a, new.get_q(k, a)) for k, a in cells)
+            elif late:
+                # không có journal: file vừa ghi thiếu các ô này, save lại như mọi /feedback
+                new.save()
+        if segment is not None:
+            self.journal.discard(segment)
+        if hasattr(old.q, "close"):
+            # tầng lạnh sqlite của bảng cũ
+            old.q.close(remove=True)
+
+    def close(self):
+        """Flush pending journal records (và replay buffer); call on shutdown."""
+        thread = self._compactor
+        if thread is not None:
+            thread.join()
+        if self.journal is not None:
+            self.journal.close()
+        try:
+            self.save_replay()
+        except Exception as e:
+            print(f"Không thể lưu replay buffer: {e}")
 
     def save(self, path=None):
-        self.sarsa.save(path)
+        t0 = time.perf_counter()
+        with self._lock:
+            self.sarsa.save(path)
+        if self.observe is not None:
+            self.observe("save", time.perf_counter() - t0)
 
     def set_epsilon(self, eps: float):
         self.sarsa.set_epsilon(eps)
@@ -0,0 +1,164 @@
+"""Append-only journal of applied SARSA updates.
+
+Mỗi dòng là một bản ghi JSON ``[seq, state_key, action, new_q]``. Bản ghi lưu giá trị
+Q *tuyệt đối* sau khi cập nhật (không phải delta), nên replay là idempotent: phát lại
+một đoạn journal đã nằm sẵn trong snapshot không làm sai bảng.
+
+Layout trên đĩa:
+    <path>          đoạn journal đang ghi
+    <path>.<seq>    đoạn đã được rotate, chờ compaction xong thì xoá
+"""
+import glob
+import json
+import os
+import threading
+
+__all__ = ["TransitionJournal"]
+
+
+class TransitionJournal:
+    def __init__(self, path, sync_every=64, sync_interval=0.05):
+        """
+        path: file journal (ví dụ "sarsa_table.journal")
+        sync_every: fsync sau mỗi nhóm bao nhiêu bản ghi
+        sync_interval: số giây tối đa một bản ghi nằm chờ fsync
+        """
+        self.path = path
+        self.sync_every = max(1, int(sync_every))
+        self.sync_interval = sync_interval
+        self.seq = 0
+        self.records = 0  # số bản ghi trong đoạn hiện tại
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._f = self._open_segment()
+        # background group-commit: bản ghi cuối cùng không phải chờ append kế tiếp mới được fsync
+        self._syncer = threading.Thread(target=self._sync_loop, name="journal-sync", daemon=True)
+        self._syncer.start()
+
+    def _open_segment(self):
+        f = open(self.path, "a+b")
+        # a torn tail (crash giữa chừng) must not be glued to the next record
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+                f.flush()
+        return f
+
+    def segments(self):
+        """Rotated segments, oldest first."""
+        out = []
+        for p in glob.glob(glob.escape(self.path) + ".*"):
+            suffix = p[len(self.path) + 1:]
+            if suffix.isdigit():
+                out.append((int(suffix), p))
+        return [p for _, p in sorted(out)]
+
+    def replay(self, apply):
+        """Call ``apply(state_key, action, value)`` for every record, oldest first.
+
+        Returns the number of records applied. Unparsable lines (torn writes) are skipped.
+        """
+        n = 0
+        for p in self.segments() + [self.path]:
+            if not os.path.exists(p):
+                continue
+            with open(p, "rb") as f:
+                for line in f:
+                    try:
+                        seq, key, action, value = json.loads(line)
+                    except (ValueError, TypeError):
+                        continue
+                    apply(key, action, float(value))
+                    if seq > self.seq:
+                        self.seq = seq
+                    n += 1
+                    if p == self.path:
+                        self.records += 1
+        return n
+
+    def append(self, key, action, value):
+        """Append one applied update and return its sequence number. O(1) I/O."""
+        with self._lock:
+            self.seq += 1
+            line = json.dumps([self.seq, key, action, value], ensure_ascii=False)
+            self._f.write(line.encode("utf-8") + b"\n")
+            # đẩy xuống kernel ngay: process crash không mất bản ghi; fsync thì gom nhóm
+            self._f.flush()
+            self.records += 1
+            self._pending += 1
+            if self._pending >= self.sync_every:
+                self._sync_locked()
+            return self.seq
+
+    def append_many(self, records):
+        """Append (key, action, value) records with one write/flush; returns the last seq."""
+        with self._lock:
+            lines = []
+            for key, action, value in records:
+                self.seq += 1
+                lines.append(json.dumps([self.seq, key, action, value], ensure_ascii=False))
+            if not lines:
+                return self.seq
+            self._f.write(("\n".join(lines) + "\n").encode("utf-8"))
+            self._f.flush()
+            self.records += len(lines)
+            self._pending += len(lines)
+            if self._pending >= self.sync_every:
+                self._sync_locked()
+            return self.seq
+
+    def sync(self):
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_locked(self):
+        if self._pending:
+            os.fsync(self._f.fileno())
+            self._pending = 0
+
+    def _sync_loop(self):
+        while not self._closed.wait(self.sync_interval):
+            try:
+                self.sync()
+            except (OSError, ValueError):
+                pass
+
+    def rotate(self):
+        """Close the active segment and start a new one.
+
+        Returns the rotated segment path (or None if it was empty). Every record in the
+        returned segment is already applied to the in-memory table, so a snapshot taken
+        right after rotate() covers it.
+        """
+        with self._lock:
+            if self.records == 0:
+                return None
+            self._sync_locked()
+            self._f.close()
+            rotated = f"{self.path}.{self.seq}"
+            os.replace(self.path, rotated)
+            self._f = self._open_segment()
+            self.records = 0
+            return rotated
+
+    def discard(self, upto):
+        """Delete rotated segments up to and including ``upto`` (already in a snapshot)."""
+        limit = int(upto.rsplit(".", 1)[1])
+        for p in self.segments():
+            if int(p.rsplit(".", 1)[1]) <= limit:
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            if not self._f.closed:
+                self._sync_locked()
+                self._f.close()
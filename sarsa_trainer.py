@@ -1,7 +1,11 @@
 # q_learning_trainer.py
 import time
 import numpy as np
-from sarsa_agent import SARSAAgent
+
+try:
+    from .sarsa_agent import SARSAAgent
+except ImportError:
+    from sarsa_agent import SARSAAgent
 
 
 def _unpack_step(env, action):
@@ -79,6 +83,163 @@ def train_sarsa(env, agent: SARSAAgent, episodes=1000, max_steps=200,
     agent.save()
     return rewards_per_ep
 
+class SyncVectorEnv:
+    """Chạy N env (gym hoặc gymnasium) đồng bộ trong một process.
+
+    step(actions) trả về (obs, rewards, dones); env nào kết thúc thì được reset ngay và
+    obs trả về là obs đầu của episode mới (như gym.vector với autoreset).
+    """
+
+    def __init__(self, envs):
+        self.envs = list(envs)
+        if not self.envs:
+            raise ValueError("SyncVectorEnv needs at least one env")
+        self.num_envs = len(self.envs)
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+
+    @classmethod
+    def from_factory(cls, make_env, n_envs):
+        return cls(make_env() for _ in range(n_envs))
+
+    def reset(self):
+        return np.asarray([_reset_env(env) for env in self.envs])
+
+    def reset_at(self, i):
+        return _reset_env(self.envs[i])
+
+    def step(self, actions):
+        obs, rewards, dones = [], np.zeros(self.num_envs), np.zeros(self.num_envs, dtype=bool)
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            next_state, reward, done, info = _unpack_step(env, action)
+            if done:
+                next_state = _reset_env(env)
+            obs.append(next_state)
+            rewards[i] = reward
+            dones[i] = done
+        return np.asarray(obs), rewards, dones
+
+
+def _table_from_agent(agent, n_states):
+    """Q dạng mảng (n_states, n_actions) lấy từ agent; state i có key state_to_key(i)."""
+    q = np.zeros((n_states, len(agent.actions)))
+    for s in range(n_states):
+        key = agent.state_to_key(s)
+        for j, a in enumerate(agent.actions):
+            q[s, j] = agent.get_q(key, a)
+    return q
+
+
+def _table_to_agent(q, agent):
+    for s in range(q.shape[0]):
+        key = agent.state_to_key(s)
+        for j, a in enumerate(agent.actions):
+            agent.set_q(key, a, float(q[s, j]))
+
+
+def batch_td_update(q, rows, cols, delta):
+    """q[rows, cols] += delta, lấy trung bình delta của các cặp (row, col) trùng nhau.
+
+    Cộng dồn thẳng (np.add.at) làm bước học thành count * alpha khi nhiều env rơi vào cùng
+    một ô, đủ để Q phân kỳ; trung bình giữ bước học đúng bằng alpha.
+    """
+    flat = rows * q.shape[1] + cols
+    cells, inverse, counts = np.unique(flat, return_inverse=True, return_counts=True)
+    q.reshape(-1)[cells] += np.bincount(inverse, weights=delta, minlength=len(cells)) / counts
+
+
+def check_finite(q):
+    """ValueError nếu q có NaN/inf — không để bảng hỏng bị ghi đè lên bảng tốt."""
+    bad = int(np.count_nonzero(~np.isfinite(q)))
+    if bad:
+        raise ValueError(f"Q-table has {bad} non-finite values; refusing to save")
+
+
+def _save_table(q, agent):
+    check_finite(q)
+    _table_to_agent(q, agent)
+    agent.save()
+
+
+def train_sarsa_vectorized(envs, agent: SARSAAgent, episodes=1000, max_steps=200,
+                           decay_epsilon=True, min_epsilon=0.01, epsilon_decay=0.995,
+                           save_every=100, seed=None):
+    """SARSA trên N env chạy song song (lockstep), Q là mảng NumPy (n_states, n_actions).
+
+    envs: SyncVectorEnv hoặc list env; observation space phải rời rạc (có `.n`), state i
+    ứng với key agent.state_to_key(i) như trong train_sarsa. Mỗi bước chọn action và cập
+    nhật cho cả batch bằng indexing NumPy; các cặp (s, a) trùng trong một bước nhận trung
+    bình TD error tính từ cùng một bảng (batch_td_update). Bảng được ghi lại vào agent khi
+    save; bảng có NaN/inf thì ValueError thay vì ghi.
+    Trả về reward của từng episode theo thứ tự kết thúc.
+    """
+    if not isinstance(envs, SyncVectorEnv):
+        envs = SyncVectorEnv(envs)
+    n_states = getattr(envs.observation_space, "n", None)
+    if n_states is None:
+        raise ValueError("train_sarsa_vectorized needs a discrete observation space")
+    n_envs = envs.num_envs
+    n_actions = len(agent.actions)
+    action_ids = np.asarray(agent.actions)
+    rng = np.random.default_rng(seed)
+    q = _table_from_agent(agent, n_states)
+    env_idx = np.arange(n_envs)
+
+    def choose(states):
+        qs = q[states]
+        # phá hoà ngẫu nhiên: argmax trên nhiễu, chỉ ở các ô bằng max
+        ties = qs == qs.max(axis=1, keepdims=True)
+        greedy = np.argmax(rng.random(qs.shape) * ties, axis=1)
+        explore = rng.random(n_envs) < agent.epsilon
+        return np.where(explore, rng.integers(n_actions, size=n_envs), greedy)
+
+    states = envs.reset().astype(np.int64)
+    actions = choose(states)
+    ep_reward = np.zeros(n_envs)
+    ep_steps = np.zeros(n_envs, dtype=np.int64)
+    rewards_per_ep = []
+    steps = 0
+    start = time.perf_counter()
+
+    while len(rewards_per_ep) < episodes:
+        next_states, rewards, dones = envs.step(action_ids[actions])
+        next_states = next_states.astype(np.int64)
+        next_actions = choose(next_states)
+        target = rewards + agent.gamma * q[next_states, next_actions] * ~dones
+        batch_td_update(q, states, actions, agent.alpha * (target - q[states, actions]))
+
+        steps += n_envs
+        ep_reward += rewards
+        ep_steps += 1
+        truncated = ~dones & (ep_steps >= max_steps)
+        for i in np.flatnonzero(truncated):
+            next_states[i] = int(envs.reset_at(i))
+        if truncated.any():
+            next_actions[truncated] = choose(next_states)[truncated]
+
+        for i in env_idx[dones | truncated]:
+            rewards_per_ep.append(float(ep_reward[i]))
+            ep_reward[i] = 0.0
+            ep_steps[i] = 0
+            ep = len(rewards_per_ep)
+            if decay_epsilon:
+                agent.epsilon = max(min_epsilon, agent.epsilon * epsilon_decay)
+            if save_every and ep % save_every == 0:
+                _save_table(q, agent)
+            if ep % max(1, episodes // 10) == 0:
+                avg_recent = np.mean(rewards_per_ep[-max(1, episodes // 20):])
+                rate = steps / (time.perf_counter() - start)
+                print(f"[Train] Ep {ep}/{episodes} | avg_recent {avg_recent:.3f} | "
+                      f"eps {agent.epsilon:.4f} | {rate:,.0f} steps/s")
+
+        states, actions = next_states, next_actions
+
+    elapsed = time.perf_counter() - start
+    print(f"[Train] {steps} steps over {n_envs} envs in {elapsed:.2f}s ({steps / elapsed:,.0f} steps/s)")
+    _save_table(q, agent)
+    return rewards_per_ep[:episodes]
+
+
 if __name__ == "__main__":
     # ví dụ thử nhanh với OpenAI Gym (nếu bạn cài gym)
     try:
@@ -1,17 +1,43 @@
 # server.py
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, Response
 from pydantic import BaseModel, Field
 from typing import List, Dict, Any, Optional
 try:
     from q_learning.sarsa_agent import OnlineLearningAgent
+    from q_learning.background_learner import BackgroundLearner
+    from q_learning.shared_qtable import SharedReaderAgent
+    from q_learning.traffic_capture import TrafficRecorder
+    from q_learning.metrics import ServiceMetrics, resident_memory_bytes
+    from q_learning import wire_protocol
 except ModuleNotFoundError:
     # Running inside container where files are mounted directly into /app
     from sarsa_agent import OnlineLearningAgent
+    from background_learner import BackgroundLearner
+    from shared_qtable import SharedReaderAgent
+    from traffic_capture import TrafficRecorder
+    from metrics import ServiceMetrics, resident_memory_bytes
+    import wire_protocol
+import hmac
 import logging
+import os
+import random
+import time
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+# SARSA_LOG_SAMPLE=0.01 -> log payload của ~1% request ở INFO; mặc định chỉ log khi bật DEBUG.
+# Payload chỉ được format (lazy, %-style) khi bản ghi log thực sự được in.
+LOG_SAMPLE = float(os.environ.get("SARSA_LOG_SAMPLE", "0"))
+
+def _log_payload(msg, *args):
+    if LOG_SAMPLE and random.random() < LOG_SAMPLE:
+        logger.info(msg, *args)
+    elif logger.isEnabledFor(logging.DEBUG):
+        logger.debug(msg, *args)
+
 # --- Định nghĩa Models (giống backend gửi) ---
 class State(BaseModel):
     avail: List[str]
@@ -30,30 +56,163 @@ class FeedbackPayload(BaseModel):
     next_state: State
     done: bool
 
+class PredictBatchRequest(BaseModel):
+    requests: List[PredictRequest]
+
+class FeedbackBatchPayload(BaseModel):
+    transitions: List[FeedbackPayload]
+
+class ReloadRequest(BaseModel):
+    path: str                   # file bảng trên server (JSON, .sqt, hoặc .npz với storage linear)
+    policy: str = "replace"     # "replace" | "merge"
+
 # --- Khởi tạo ---
 app = FastAPI(title="Online Learning AI Service", version="2.1.0")
 # Đổi tên file bảng SARSA nếu muốn, ví dụ sarsa_table.json
-agent = OnlineLearningAgent(model_path="sarsa_table.json") 
+# /feedback chỉ ghi nối vào journal; snapshot được compaction ở nền
+# SARSA_MODE=reader -> nhiều uvicorn worker đọc Q-table chung (shared_qtable.py), mọi ghi
+# được chuyển cho một learner process duy nhất; mặc định mỗi process tự giữ bảng của mình
+if os.environ.get("SARSA_MODE", "standalone") == "reader":
+    agent = SharedReaderAgent(directory=os.environ.get("SARSA_SHM_DIR", "/dev/shm/sarsa"),
+                              address=os.environ.get("SARSA_LEARNER_SOCKET"))
+else:
+    # SARSA_STORAGE=dense -> Q-table dạng mảng NumPy (DenseSARSAAgent), mặc định dict
+    # SARSA_STORAGE=tiered -> giữ tối đa SARSA_MAX_RESIDENT_STATES state trong RAM, còn lại ở sqlite
+    # SARSA_STORAGE=linear -> LinearSARSAAgent (trọng số trong SARSA_LINEAR_MODEL, .npz); lần đầu
+    # được fit từ sarsa_table.json
+    storage = os.environ.get("SARSA_STORAGE", "dict")
+    storage_options = None
+    model_path = "sarsa_table.json"
+    journal_path = "sarsa_table.journal"
+    if storage == "tiered":
+        storage_options = {"max_resident_states": int(os.environ.get("SARSA_MAX_RESIDENT_STATES", "100000"))}
+    elif storage == "sharded":
+        # SARSA_STORAGE=sharded -> mỗi meal_time (hoặc SARSA_SHARD_BY=hash, SARSA_SHARDS shard)
+        # một file trong sarsa_table.json.shards/, load lười, checkpoint chỉ ghi shard bị đổi
+        storage_options = {"shard_by": os.environ.get("SARSA_SHARD_BY", "meal_time"),
+                           "n_shards": int(os.environ.get("SARSA_SHARDS", "16"))}
+    elif storage == "linear":
+        model_path = os.environ.get("SARSA_LINEAR_MODEL", "sarsa_linear.npz")
+        journal_path = f"{model_path}.journal"
+        storage_options = {"n_features": int(os.environ.get("SARSA_LINEAR_FEATURES", str(2 ** 20))),
+                           "init_from": "sarsa_table.json"}
+    # SARSA_REPLAY_CAPACITY=N -> giữ N transition gần nhất để learner nền replay lúc rảnh,
+    # SARSA_REPLAY_RATIO lượt replay cho mỗi transition mới (tối đa SARSA_REPLAY_BATCH mỗi vòng)
+    agent = OnlineLearningAgent(model_path=model_path, journal_path=journal_path,
+                                storage=storage, storage_options=storage_options,
+                                replay_capacity=int(os.environ.get("SARSA_REPLAY_CAPACITY", "0")),
+                                replay_prioritized=os.environ.get("SARSA_REPLAY_PRIORITIZED", "0") == "1")
+
+# SARSA_ASYNC_FEEDBACK=1 -> /feedback chỉ xếp hàng, một thread learner áp dụng theo micro-batch
+learner = None
+if os.environ.get("SARSA_ASYNC_FEEDBACK", "0") == "1" and isinstance(agent, OnlineLearningAgent):
+    learner = BackgroundLearner(
+        agent,
+        max_queue=int(os.environ.get("SARSA_LEARNER_QUEUE", "10000")),
+        batch_size=int(os.environ.get("SARSA_LEARNER_BATCH", "256")),
+        overflow=os.environ.get("SARSA_LEARNER_OVERFLOW", "reject"),
+        replay_batch=int(os.environ.get("SARSA_REPLAY_BATCH", "32")),
+        replay_ratio=float(os.environ.get("SARSA_REPLAY_RATIO", "1.0")),
+    ).start()
+
+# SARSA_CAPTURE_DIR=... -> ghi lại traffic /predict, /feedback (xem traffic_capture.py để replay)
+recorder = None
+if os.environ.get("SARSA_CAPTURE_DIR"):
+    recorder = TrafficRecorder(
+        os.environ["SARSA_CAPTURE_DIR"],
+        max_bytes=int(os.environ.get("SARSA_CAPTURE_MAX_MB", "64")) * 1024 * 1024,
+        max_files=int(os.environ.get("SARSA_CAPTURE_FILES", "20")),
+    )
+
+# --- Metrics (GET /metrics, định dạng text của Prometheus) ---
+metrics = ServiceMetrics()
+if isinstance(agent, OnlineLearningAgent):
+    agent.observe = metrics.observe_stage
+    metrics.gauge("qtable", "Q-table size (states, known actions, tiered cache counters).",
+                  agent.storage_stats)
+metrics.gauge("resident_memory_bytes", "Resident set size of the server process.", resident_memory_bytes)
+if learner is not None:
+    metrics.gauge("learner", "Background learner queue depth and counters.", learner.stats)
+
+class RecordMetrics:
+    """ASGI middleware đếm request + latency theo route; status lấy từ http.response.start.
+
+    Viết thẳng trên ASGI (không dùng BaseHTTPMiddleware) để không thêm task / stream bọc
+    response trên đường latency của /predict, /feedback.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        # request.state.start (đọc bởi _observe_validation) nằm trong scope["state"]
+        scope.setdefault("state", {})["start"] = start
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = scope.get("route")
+            metrics.observe_request(route.path if route is not None else "other", status,
+                                    time.perf_counter() - start)
+
+app.add_middleware(RecordMetrics)
+
+def _observe_validation(http_request):
+    # từ lúc nhận request tới khi vào handler: đọc body, parse JSON, validate pydantic
+    start = getattr(http_request.state, "start", None) if http_request is not None else None
+    if start is not None:
+        metrics.observe_stage("validation", time.perf_counter() - start)
+
+@app.on_event("shutdown")
+def flush_agent():
+    if learner is not None:
+        learner.stop(flush=True)
+    agent.close()
+    if recorder is not None:
+        recorder.close()
 
 # --- API Endpoints ---
 @app.post("/predict")
-def predict(request: PredictRequest):
+def predict(request: PredictRequest, http_request: Request = None):
     # Endpoint này không thay đổi logic
-    logger.info(f"Nhận request /predict: {request.dict()}")
+    _observe_validation(http_request)
+    _log_payload("Nhận request /predict: %s", request)
+    if recorder is not None:
+        recorder.record("predict", request)
     try:
-        suggestion = agent.predict(request.state.dict(), request.possible_actions)
-        logger.info(f"Trả về gợi ý: {suggestion}")
+        suggestion = agent.predict(request.state.dict(), request.possible_actions, k=request.k)
+        _log_payload("Trả về gợi ý: %s", suggestion)
         return suggestion
     except Exception as e:
         logger.error(f"Lỗi trong quá trình predict: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 @app.post("/feedback")
-def feedback(request: FeedbackPayload):
+def feedback(request: FeedbackPayload, http_request: Request = None):
     """
     Nhận feedback và kích hoạt quá trình học online.
     """
-    logger.info(f"Nhận được Feedback để học: {request.dict()}")
+    _observe_validation(http_request)
+    _log_payload("Nhận được Feedback để học: %s", request)
+    if recorder is not None:
+        recorder.record("feedback", request)
+    if learner is not None:
+        transition = (request.state.dict(), request.action, request.reward,
+                      request.next_state.dict(), request.done)
+        if not learner.submit(transition):
+            raise HTTPException(status_code=503, detail="Learner queue is full")
+        return {"status": "queued", "message": "Feedback queued for learning"}
     try:
         agent.learn(
             state=request.state.dict(),
@@ -67,4 +226,198 @@ def feedback(request: FeedbackPayload):
         logger.error(f"Lỗi trong quá trình learn: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+@app.post("/predict/batch")
+def predict_batch(request: PredictBatchRequest, http_request: Request = None):
+    """Nhiều request predict trong một lần gọi; kết quả trả về theo đúng thứ tự."""
+    _observe_validation(http_request)
+    _log_payload("Nhận batch /predict: %d requests", len(request.requests))
+    if recorder is not None:
+        recorder.record("predict_batch", request)
+    try:
+        results = agent.predict_batch(
+            [(r.state.dict(), r.possible_actions, r.k) for r in request.requests]
+        )
+        return {"results": results}
+    except Exception as e:
+        logger.error(f"Lỗi trong quá trình predict batch: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.post("/feedback/batch")
+def feedback_batch(request: FeedbackBatchPayload, http_request: Request = None):
+    """Học từ nhiều transition một lúc; chỉ ghi xuống đĩa một lần cho cả batch."""
+    _observe_validation(http_request)
+    _log_payload("Nhận batch Feedback: %d transitions", len(request.transitions))
+    if recorder is not None:
+        recorder.record("feedback_batch", request)
+    transitions = [(t.state.dict(), t.action, t.reward, t.next_state.dict(), t.done) for t in request.transitions]
+    if learner is not None:
+        accepted = learner.submit_many(transitions)
+        if accepted < len(transitions):
+            raise HTTPException(status_code=503,
+                                detail=f"Learner queue is full ({accepted}/{len(transitions)} queued)")
+        return {"status": "queued", "queued": accepted}
+    try:
+        results = agent.learn_batch(transitions)
+        return {"status": "ok", "results": results}
+    except Exception as e:
+        logger.error(f"Lỗi trong quá trình learn batch: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# --- MessagePack endpoints (wire_protocol.py) ---
+# Cùng ngữ nghĩa với các endpoint JSON ở trên; body/response là application/msgpack, validate
+# bằng kiểm tra kiểu trực tiếp (không dựng model pydantic), q_values giữ key int.
+FEEDBACK_OK = wire_protocol.preencoded({"status": "ok", "message": "Agent has learned from feedback"})
+FEEDBACK_QUEUED = wire_protocol.preencoded({"status": "queued", "message": "Feedback queued for learning"})
+
+def _msgpack(content):
+    return Response(content=content, media_type=wire_protocol.CONTENT_TYPE)
+
+async def _decode_wire(http_request, decode):
+    if not wire_protocol.AVAILABLE:
+        raise HTTPException(status_code=415, detail="MessagePack support is not installed (pip install msgpack)")
+    body = await http_request.body()
+    try:
+        decoded = decode(body)
+    except wire_protocol.WireError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    _observe_validation(http_request)
+    return decoded
+
+def _wire_learn(transition):
+    agent.learn(*transition)
+    return FEEDBACK_OK
+
+@app.post("/msgpack/predict")
+async def predict_msgpack(http_request: Request):
+    state, possible_actions, k = await _decode_wire(http_request, wire_protocol.decode_predict)
+    _log_payload("Nhận request /msgpack/predict: state=%s k=%s possible_actions=%s", state, k, possible_actions)
+    if recorder is not None:
+        recorder.record("predict", {"state": state, "k": k, "possible_actions": possible_actions})
+    try:
+        ranked, explored = await run_in_threadpool(agent.predict_ranked, state, possible_actions, k)
+        _log_payload("Trả về gợi ý: %s explored=%s", ranked, explored)
+        return _msgpack(wire_protocol.encode_prediction(ranked, explored))
+    except Exception as e:
+        logger.error(f"Lỗi trong quá trình predict: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.post("/msgpack/feedback")
+async def feedback_msgpack(http_request: Request):
+    transition = await _decode_wire(http_request, wire_protocol.decode_feedback)
+    _log_payload("Nhận được Feedback để học (msgpack): %s", transition)
+    if recorder is not None:
+        recorder.record("feedback", dict(zip(("state", "action", "reward", "next_state", "done"), transition)))
+    if learner is not None:
+        if not learner.submit(transition):
+            raise HTTPException(status_code=503, detail="Learner queue is full")
+        return _msgpack(FEEDBACK_QUEUED)
+    try:
+        return _msgpack(await run_in_threadpool(_wire_learn, transition))
+    except Exception as e:
+        logger.error(f"Lỗi trong quá trình learn: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.post("/msgpack/predict/batch")
+async def predict_batch_msgpack(http_request: Request):
+    requests = await _decode_wire(http_request, wire_protocol.decode_predict_batch)
+    _log_payload("Nhận batch /msgpack/predict: %d requests", len(requests))
+    if recorder is not None:
+        recorder.record("predict_batch", {"requests": [
+            {"state": s, "k": k, "possible_actions": a} for s, a, k in requests]})
+    try:
+        results = await run_in_threadpool(agent.predict_batch, requests, ranked=True)
+        return _msgpack(wire_protocol.encode_predictions(results))
+    except Exception as e:
+        logger.error(f"Lỗi trong quá trình predict batch: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.post("/msgpack/feedback/batch")
+async def feedback_batch_msgpack(http_request: Request):
+    transitions = await _decode_wire(http_request, wire_protocol.decode_feedback_batch)
+    _log_payload("Nhận batch Feedback (msgpack): %d transitions", len(transitions))
+    if recorder is not None:
+        recorder.record("feedback_batch", {"transitions": [
+            dict(zip(("state", "action", "reward", "next_state", "done"), t)) for t in transitions]})
+    if learner is not None:
+        accepted = learner.submit_many(transitions)
+        if accepted < len(transitions):
+            raise HTTPException(status_code=503,
+                                detail=f"Learner queue is full ({accepted}/{len(transitions)} queued)")
+        return _msgpack(wire_protocol.encode({"status": "queued", "queued": accepted}))
+    try:
+        results = await run_in_threadpool(agent.learn_batch, transitions)
+        return _msgpack(wire_protocol.encode({"status": "ok", "results": results}))
+    except Exception as e:
+        logger.error(f"Lỗi trong quá trình learn batch: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.get("/learner/stats")
+def learner_stats():
+    """Độ sâu hàng đợi, số transition bị drop, số đã áp dụng... của learner nền."""
+    if learner is None:
+        return {"mode": "sync"}
+    return {"mode": "async", **learner.stats()}
+
+@app.get("/capture/stats")
+def capture_stats():
+    """Số request đã ghi / đã bỏ của traffic capture."""
+    if recorder is None:
+        return {"enabled": False}
+    return {"enabled": True, **recorder.stats()}
+
+# --- Admin: hot-reload bảng huấn luyện offline (train.py) không cần restart ---
+# /admin/* chỉ bật khi đặt SARSA_ADMIN_TOKEN; request phải gửi header X-Admin-Token trùng khớp.
+# Chỉ nạp được file nằm trong SARSA_RELOAD_DIR (mặc định ./reload).
+ADMIN_TOKEN = os.environ.get("SARSA_ADMIN_TOKEN")
+RELOAD_DIR = os.path.realpath(os.environ.get("SARSA_RELOAD_DIR", "reload"))
+
+def _reload_path(path):
+    """Đường dẫn thật của `path` (tương đối thì tính từ RELOAD_DIR); 403 nếu nằm ngoài RELOAD_DIR."""
+    resolved = os.path.realpath(os.path.join(RELOAD_DIR, path))
+    if os.path.commonpath([resolved, RELOAD_DIR]) != RELOAD_DIR:
+        raise HTTPException(status_code=403, detail=f"Reload path must be inside {RELOAD_DIR}")
+    return resolved
+
+def _check_admin(token):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if token is None or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if not isinstance(agent, OnlineLearningAgent):
+        raise HTTPException(status_code=409, detail="Reload is done by the learner process in reader mode")
+
+@app.post("/admin/reload", status_code=202)
+def admin_reload(request: ReloadRequest, x_admin_token: Optional[str] = Header(None)):
+    """Nạp bảng mới ở nền; request vẫn được phục vụ bằng bảng cũ cho tới khi swap xong."""
+    _check_admin(x_admin_token)
+    path = _reload_path(request.path)
+    try:
+        agent.reload(path, policy=request.policy)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"No such file: {request.path}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logger.info("Reload started: path=%s policy=%s", path, request.policy)
+    return agent.reload_status
+
+@app.get("/admin/reload")
+def admin_reload_status(x_admin_token: Optional[str] = Header(None)):
+    """Trạng thái lần reload gần nhất: idle / loading / done / failed."""
+    _check_admin(x_admin_token)
+    return agent.reload_status
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Request count, latency histogram theo endpoint/stage, kích thước Q-table, RSS."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/qtable/stats")
+def qtable_stats():
+    """Số state, và với storage tiered: resident size, hit rate, evictions."""
+    if not isinstance(agent, OnlineLearningAgent):
+        return {"storage": "shared-reader"}
+    return agent.storage_stats()
+
 # ... endpoint "/" health_check giữ nguyên ...
\ No newline at end of file
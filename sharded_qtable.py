@@ -0,0 +1,380 @@
+"""Sharded Q-table: states partitioned by meal context (or key hash), one file + lock per shard.
+
+    sarsa_table.json.shards/
+        manifest.json          shard_by / shard_ext của layout, số state của từng shard
+        Ăn_sáng.json
+        Ăn_trưa.json
+        ...
+
+- Shard chỉ được load khi một state của nó được truy cập lần đầu (lazy).
+- save() và compaction của OnlineLearningAgent chỉ ghi lại các shard bị đổi (dirty).
+- Mỗi shard có lock riêng nên dùng trực tiếp ShardedSARSAAgent từ nhiều thread được (load
+  lười, update, copy khi checkpoint). Qua OnlineLearningAgent thì learn / predict vẫn nối tiếp
+  nhau dưới lock của agent; lợi ích ở đó là load lười và checkpoint chỉ ghi shard bị đổi.
+- Lần đầu chạy mà chưa có thư mục shard, bảng nguyên khối ở q_table_path được chia ra (file
+  gốc giữ nguyên); đổi shard_by / n_shards / shard_ext thì các shard cũ được chia lại theo
+  layout mới.
+
+Dùng qua make_agent("sharded", shard_by="meal_time") hoặc SARSA_STORAGE=sharded ở server.
+"""
+import glob
+import json
+import os
+import re
+import threading
+import zlib
+
+try:
+    from .sarsa_agent import make_agent, state_to_key, write_table
+    from .qtable_snapshot import SNAPSHOT_EXT, canonical_action, load_table
+    from .state_encoder import parse_legacy_key
+except ImportError:
+    from sarsa_agent import make_agent, state_to_key, write_table
+    from qtable_snapshot import SNAPSHOT_EXT, canonical_action, load_table
+    from state_encoder import parse_legacy_key
+
+__all__ = ["ShardedSARSAAgent", "meal_time_shard", "hash_shard"]
+
+MANIFEST = "manifest.json"
+SHARD_EXTS = (".json", SNAPSHOT_EXT)
+_UNSAFE = re.compile(r"[^\w\-]+")
+
+
+def meal_time_shard(key):
+    """Tên shard theo meal_time của key legacy (avail=...|meal_time=...|history=...)."""
+    i = key.find("|meal_time=")
+    j = key.rfind("|history=")
+    if i < 0 or j < i:
+        # key hash / FrozenLake...: không có meal_time
+        parts = parse_legacy_key(key)
+        if parts is None:
+            return "other"
+        meal_time = parts[1]
+    else:
+        meal_time = key[i + len("|meal_time="):j]
+    if meal_time in (None, "None", ""):
+        return "none"
+    return _UNSAFE.sub("_", meal_time).strip("_") or "none"
+
+
+def hash_shard(n_shards):
+    """Shard function chia đều theo crc32 của key (ổn định giữa các process)."""
+    def shard(key):
+        return f"h{zlib.crc32(key.encode('utf-8')) % n_shards:03d}"
+    shard.__name__ = f"hash{n_shards}"
+    return shard
+
+
+class _DirtyShards(dict):
+    """{shard: {key: row}} của các shard bị đổi, từ dirty_snapshot() — dump() ghi từng shard."""
+
+
+class ShardedSARSAAgent:
+    def __init__(self, actions, alpha=0.1, gamma=0.99, epsilon=0.1, q_table_path="sarsa_table.json",
+                 state_encoder=None, autoload=True, shard_by="meal_time", n_shards=16,
+                 shard_storage="dict", shard_ext=".json", shard_dir=None):
+        """
+        shard_by: "meal_time", "hash" (n_shards shard theo crc32 của key) hoặc callable key -> tên shard
+        shard_storage: storage của từng shard ("dict" hoặc "dense")
+        shard_ext: ".json" hoặc ".sqt" (binary, mmap khi load)
+        shard_dir: mặc định ``<q_table_path>.shards``; q_table_path chỉ còn là bảng nguyên khối
+            để migrate lần đầu
+        """
+        self.actions = list(actions)
+        self.state_to_key = state_encoder or state_to_key
+        self.alpha = alpha
+        self.gamma = gamma
+        self.epsilon = epsilon
+        self.q_table_path = q_table_path
+        self.shard_dir = shard_dir or f"{q_table_path}.shards"
+        self.shard_by = shard_by
+        self.n_shards = n_shards
+        if callable(shard_by):
+            self._shard_of = shard_by
+        elif shard_by == "meal_time":
+            self._shard_of = meal_time_shard
+        elif shard_by == "hash":
+            self._shard_of = hash_shard(n_shards)
+        else:
+            raise ValueError(f"unknown shard_by: {shard_by!r}")
+        self.shard_storage = shard_storage
+        self.shard_ext = shard_ext
+        self._shards = {}       # tên -> agent của shard đã load
+        self._locks = {}        # tên -> RLock
+        self._files = {}        # tên -> file shard trên đĩa (chưa chắc đã load)
+        self._counts = {}       # tên -> số state của file shard (ghi trong manifest)
+        self._dirty = set()
+        self._meta = threading.Lock()   # bảo vệ _locks / _dirty / _files / _counts
+        self.loads = 0
+        if autoload:
+            self.load()
+
+    # --- shards ---
+    @property
+    def q(self):
+        # OnlineLearningAgent.storage_stats() đọc sarsa.q.stats()
+        return self
+
+    def shard_name(self, key):
+        return self._shard_of(key)
+
+    def _path(self, name):
+        return os.path.join(self.shard_dir, name + self.shard_ext)
+
+    def _lock_of(self, name):
+        lock = self._locks.get(name)
+        if lock is None:
+            with self._meta:
+                lock = self._locks.setdefault(name, threading.RLock())
+        return lock
+
+    def _new_shard(self, name):
+        return make_agent(self.shard_storage, actions=self.actions, alpha=self.alpha, gamma=self.gamma,
+                          epsilon=self.epsilon, q_table_path=self._path(name),
+                          state_encoder=self.state_to_key, autoload=False)
+
+    def _get(self, name):
+        shard = self._shards.get(name)
+        if shard is not None:
+            return shard
+        with self._lock_of(name):
+            shard = self._shards.get(name)
+            if shard is None:
+                shard = self._new_shard(name)
+                path = self._files.get(name)
+                if path is not None:
+                    shard.load(path)
+                    self.loads += 1
+                self._shards[name] = shard
+        return shard
+
+    def _shard(self, key):
+        return self._get(self._shard_of(key))
+
+    def _mark(self, name):
+        with self._meta:
+            self._dirty.add(name)
+
+    def stats(self):
+        """Số state của mọi shard: shard đã load đếm trong RAM, shard chưa load lấy số đếm
+        trong manifest (không load file). states_complete=False nếu có shard chưa rõ số đếm."""
+        shards = dict(self._shards)
+        with self._meta:
+            on_disk = {name: self._counts.get(name) for name in self._files if name not in shards}
+        unknown = sum(1 for n in on_disk.values() if n is None)
+        return {"states": sum(len(s.q) for s in shards.values()) + sum(n or 0 for n in on_disk.values()),
+                "states_complete": not unknown,
+                "shards": len(shards) + len(on_disk),
+                "shards_loaded": len(shards), "shards_dirty": len(self._dirty),
+                "shard_loads": self.loads}
+
+    # --- SARSA API (giống SARSAAgent) ---
+    def choose_action(self, state, actions=None):
+        key = self.state_to_key(state)
+        shard = self._shard(key)
+        shard.epsilon = self.epsilon    # trainer giảm epsilon trực tiếp trên agent
+        return shard.choose_action(key, actions)
+
+    def update(self, state, action, reward, next_state, next_action, done):
+        s_key = self.state_to_key(state)
+        s_next_key = self.state_to_key(next_state)
+        # s' có thể nằm ở shard khác: chỉ đọc
+        q_snext_anext = 0.0 if done else self.get_q(s_next_key, next_action)
+        name = self._shard_of(s_key)
+        shard = self._get(name)
+        with self._lock_of(name):
+            q_sa = shard.get_q(s_key, action)
+            td_target = reward + (0 if done else self.gamma * q_snext_anext)
+            td_error = td_target - q_sa
+            shard.set_q(s_key, action, q_sa + self.alpha * td_error)
+        self._mark(name)
+        return td_error
+
+    def q_values(self, key):
+        return self._shard(key).q_values(key)
+
+    def get_q(self, key, action):
+        return self._shard(key).get_q(key, action)
+
+    def set_q(self, key, action, value):
+        name = self._shard_of(key)
+        shard = self._get(name)
+        with self._lock_of(name):
+            shard.set_q(key, action, value)
+        self._mark(name)
+
+    def greedy_action(self, key, actions):
+        return self._shard(key).greedy_action(key, actions)
+
+    def top_k(self, key, actions, k):
+        return self._shard(key).top_k(key, actions, k)
+
+    # --- persistence ---
+    def _items(self):
+        for name in sorted(set(self._files) | set(self._shards)):
+            shard = self._get(name)
+            with self._lock_of(name):
+                rows = shard.snapshot()
+            yield from rows.items()
+
+    def snapshot(self):
+        """Toàn bộ bảng {key: row} (load mọi shard) — dùng cho export / hot-reload."""
+        return dict(self._items())
+
+    def dirty_snapshot(self):
+        """Bản sao chỉ của các shard bị đổi từ lần checkpoint trước; mỗi shard copy dưới lock riêng."""
+        with self._meta:
+            names, self._dirty = self._dirty, set()
+        tables = _DirtyShards()
+        for name in sorted(names):
+            with self._lock_of(name):
+                tables[name] = self._shards[name].snapshot()
+        return tables
+
+    def _write_manifest(self):
+        with self._meta:
+            counts = {name: self._counts[name] for name in sorted(self._files) if name in self._counts}
+        manifest = {"format": "sarsa-shards", "shard_by": self._layout(), "shard_ext": self.shard_ext,
+                    "states": counts}
+        tmp = os.path.join(self.shard_dir, MANIFEST + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, os.path.join(self.shard_dir, MANIFEST))
+
+    def _layout(self):
+        if callable(self.shard_by):
+            return getattr(self.shard_by, "__name__", "custom")
+        return f"hash{self.n_shards}" if self.shard_by == "hash" else self.shard_by
+
+    def _write_shards(self, tables):
+        os.makedirs(self.shard_dir, exist_ok=True)
+        for name, table in tables.items():
+            path = self._path(name)
+            write_table(table, path)
+            with self._meta:
+                self._files[name] = path
+                self._counts[name] = len(table)
+        self._write_manifest()
+
+    def dump(self, table, path):
+        """Ghi một snapshot: dirty_snapshot() -> chỉ các shard đó; bảng đầy đủ -> ghi lại mọi
+        shard (và xoá shard không còn state) nếu path là q_table_path, ngược lại export một file."""
+        if isinstance(table, _DirtyShards):
+            try:
+                self._write_shards(table)
+            except Exception:
+                # chưa ghi được: lần checkpoint sau ghi lại
+                with self._meta:
+                    self._dirty.update(table)
+                raise
+            return
+        if path not in (None, self.q_table_path):
+            write_table(table, path)
+            return
+        tables = {}
+        for key, row in table.items():
+            tables.setdefault(self._shard_of(key), {})[key] = row
+        self._write_shards(tables)
+        for name, p in self._discover().items():
+            if name not in tables:
+                with self._meta:
+                    self._files.pop(name, None)
+                    self._counts.pop(name, None)
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+
+    def save(self, path=None):
+        """Không có path: chỉ ghi các shard bị đổi. Có path khác q_table_path: export nguyên khối."""
+        if path not in (None, self.q_table_path):
+            write_table(self.snapshot(), path)
+            print(f"SARSA table exported to {path}")
+            return
+        tables = self.dirty_snapshot()
+        if tables:
+            self.dump(tables, None)
+            print(f"SARSA shards saved to {self.shard_dir} ({len(tables)} dirty)")
+
+    def _discover(self, ext=None):
+        ext = ext or self.shard_ext
+        files = {}
+        for p in glob.glob(os.path.join(glob.escape(self.shard_dir), "*" + ext)):
+            if os.path.basename(p) != MANIFEST:
+                files[os.path.basename(p)[:-len(ext)]] = p
+        return files
+
+    def _split(self, sources):
+        """Nạp các bảng nguyên khối / shard theo layout cũ và chia theo layout hiện tại (dirty)."""
+        for src in sources:
+            for key, row in load_table(src).items():
+                if not isinstance(row, dict):
+                    continue
+                name = self._shard_of(key)
+                shard = self._get(name)
+                for a, v in row.items():
+                    try:
+                        shard.set_q(key, canonical_action(a), float(v))
+                    except (TypeError, ValueError):
+                        pass
+                self._dirty.add(name)
+
+    def load(self, path=None):
+        """path None: mở thư mục shard (lazy), migrate hoặc chia lại nếu cần.
+        Có path (kể cả q_table_path): chia bảng nguyên khối đó vào các shard (ví dụ khi
+        hot-reload); shard trên đĩa được ghi lại ở lần save / dump kế tiếp."""
+        self._shards = {}
+        self._dirty = set()
+        self._counts = {}
+        if path is not None:
+            self._files = {}
+            self._split([path])
+            return
+        files = self._discover()
+        manifest = {}
+        try:
+            with open(os.path.join(self.shard_dir, MANIFEST)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            pass
+        layout = manifest.get("shard_by")
+        ext = manifest.get("shard_ext")
+        if files and layout in (None, self._layout()) and ext in (None, self.shard_ext):
+            self._files = files
+            self._counts = {name: n for name, n in manifest.get("states", {}).items() if name in files}
+            return
+        if ext not in (None, self.shard_ext):
+            # đổi shard_ext: shard cũ (giữ online learning) nằm ở đuôi ghi trong manifest
+            files = self._discover(ext)
+        elif not files:
+            # không có manifest: shard có thể mang đuôi còn lại
+            for other in SHARD_EXTS:
+                if other != self.shard_ext and self._discover(other):
+                    ext, files = other, self._discover(other)
+                    break
+        self._files = {}
+        if files:
+            print(f"Resharding {len(files)} shards ({layout or '?'}{ext or self.shard_ext} -> "
+                  f"{self._layout()}{self.shard_ext})")
+            self._split(sorted(files.values()))
+            self.save()
+            for name, p in files.items():
+                if self._files.get(name) != p:
+                    os.remove(p)
+        elif os.path.exists(self.q_table_path):
+            self._split([self.q_table_path])
+            self.save()
+            print(f"Split {self.q_table_path} into {len(self._files)} shards in {self.shard_dir}")
+
+    def set_epsilon(self, eps):
+        self.epsilon = eps
+
+    def set_alpha(self, alpha):
+        self.alpha = alpha
+        for shard in list(self._shards.values()):
+            shard.set_alpha(alpha)
+
+    def set_gamma(self, gamma):
+        self.gamma = gamma
+        for shard in list(self._shards.values()):
+            shard.set_gamma(gamma)
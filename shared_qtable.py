@@ -0,0 +1,265 @@
+"""Multi-worker serving: N reader workers + one single-writer learner process.
+
+    learner process   owns OnlineLearningAgent (journal, compaction). Nhận feedback từ các
+                      worker qua một Unix socket (multiprocessing.connection), áp dụng bằng
+                      BackgroundLearner và định kỳ publish snapshot .sqt mới vào thư mục chung.
+    reader workers    uvicorn workers với SARSA_MODE=reader. /predict đọc snapshot mới nhất
+                      qua mmap (read-only, dùng chung page cache giữa các process);
+                      /feedback được chuyển tiếp sang learner.
+
+Publish: ghi ``qtable.<version>.sqt`` (tmp + rename) rồi mới thay file ``CURRENT`` chứa
+version. Reader thấy CURRENT đổi thì mở bản mới và thay bằng một phép gán tham chiếu;
+request đang chạy vẫn giữ bản cũ (file đã unlink vẫn sống tới khi hết mmap). Hot path
+không có lock.
+
+Chạy learner:
+    python shared_qtable.py learner --dir /dev/shm/sarsa --socket /dev/shm/sarsa/learner.sock
+"""
+import argparse
+import os
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+try:
+    from .sarsa_agent import OnlineLearningAgent, explore_slots
+    from .state_encoder import StateEncoder
+    from .background_learner import BackgroundLearner
+    from .qtable_snapshot import MappedQTable, write_snapshot
+except ImportError:
+    from sarsa_agent import OnlineLearningAgent, explore_slots
+    from state_encoder import StateEncoder
+    from background_learner import BackgroundLearner
+    from qtable_snapshot import MappedQTable, write_snapshot
+
+__all__ = ["SnapshotPublisher", "SharedQTableReader", "SharedReaderAgent", "run_learner"]
+
+DEFAULT_DIR = "/dev/shm/sarsa"
+CURRENT = "CURRENT"
+
+
+def _authkey():
+    return os.environ.get("SARSA_LEARNER_AUTHKEY", "sarsa").encode("utf-8")
+
+
+class SnapshotPublisher:
+    """Publish các phiên bản snapshot bất biến vào `directory`."""
+
+    def __init__(self, directory=DEFAULT_DIR, keep=2):
+        self.directory = directory
+        self.keep = max(1, keep)
+        os.makedirs(directory, exist_ok=True)
+        self.version = self._read_version()
+
+    def _read_version(self):
+        try:
+            with open(os.path.join(self.directory, CURRENT)) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return 0
+
+    def publish(self, table):
+        """Ghi table ({key: {action: value}}) thành phiên bản mới; trả về version."""
+        version = self.version + 1
+        write_snapshot(table, os.path.join(self.directory, f"qtable.{version}.sqt"))
+        tmp = os.path.join(self.directory, CURRENT + ".tmp")
+        with open(tmp, "w") as f:
+            f.write(str(version))
+        os.replace(tmp, os.path.join(self.directory, CURRENT))
+        self.version = version
+        # reader còn mmap bản cũ vẫn đọc được sau khi unlink
+        for old in range(version - self.keep, 0, -1):
+            path = os.path.join(self.directory, f"qtable.{old}.sqt")
+            if not os.path.exists(path):
+                break
+            os.remove(path)
+        return version
+
+
+class SharedQTableReader:
+    """Read-only view of the newest published snapshot."""
+
+    def __init__(self, directory=DEFAULT_DIR, check_interval=0.5):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.version = 0
+        self.table = None
+        self._stamp = None
+        self._next_check = 0.0
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now < self._next_check:
+            return self.table
+        self._next_check = now + self.check_interval
+        current = os.path.join(self.directory, CURRENT)
+        try:
+            st = os.stat(current)
+        except OSError:
+            return self.table
+        stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if stamp == self._stamp:
+            return self.table
+        try:
+            with open(current) as f:
+                version = int(f.read().strip())
+            if version != self.version:
+                table = MappedQTable(os.path.join(self.directory, f"qtable.{version}.sqt"))
+                # one reference assignment: in-flight requests keep the old table
+                self.table, self.version = table, version
+            self._stamp = stamp
+        except (OSError, ValueError):
+            # publish đang dở hoặc bản cũ đã bị xoá: thử lại ở lần kiểm tra sau
+            pass
+        return self.table
+
+
+class SharedReaderAgent:
+    """Drop-in thay OnlineLearningAgent trong worker: predict từ shared snapshot,
+    learn chuyển tiếp sang learner process."""
+
+    def __init__(self, directory=DEFAULT_DIR, address=None, epsilon=0.1, check_interval=0.5,
+                 state_encoder=None):
+        self.reader = SharedQTableReader(directory, check_interval=check_interval)
+        # phải encode giống learner (OnlineLearningAgent mặc định dùng StateEncoder())
+        self.state_to_key = state_encoder or StateEncoder()
+        self.address = address or os.path.join(directory, "learner.sock")
+        self.epsilon = epsilon
+        self.journal = None
+        self._conn = None
+        self._send_lock = threading.Lock()
+
+    def predict(self, state, possible_actions, k=1):
+        ranked, explored = self.predict_ranked(state, possible_actions, k)
+        actions = [a for a, _ in ranked]
+        return {"action": actions[0] if actions else None, "actions": actions,
+                "q_values": {str(a): v for a, v in ranked}, "explored": explored,
+                "version": self.reader.version}
+
+    def predict_ranked(self, state, possible_actions, k=1):
+        table = self.reader.refresh()
+        key = self.state_to_key(state)
+        k = max(1, min(int(k), len(possible_actions)))
+        i = table.index(key) if table is not None else -1
+        if i >= 0:
+            vals = table.lookup(i, possible_actions)
+        else:
+            vals = np.zeros(len(possible_actions))
+        # hoán vị ngẫu nhiên để phá hoà, rồi argpartition lấy k phần tử
+        perm = np.random.permutation(len(possible_actions))
+        pv = vals[perm]
+        idx = np.argpartition(-pv, k - 1)[:k] if k < len(pv) else np.arange(len(pv))
+        idx = idx[np.argsort(-pv[idx], kind="stable")]
+        ranked = [(possible_actions[int(perm[j])], float(pv[j])) for j in idx]
+        q_of = dict(zip(possible_actions, vals.tolist())).get
+        explored = explore_slots(ranked, possible_actions, self.epsilon, lambda a: q_of(a, 0.0))
+        return ranked, explored
+
+    def predict_batch(self, requests, ranked=False):
+        fn = self.predict_ranked if ranked else self.predict
+        return [fn(state, actions, k) for state, actions, k in requests]
+
+    def _send(self, msg):
+        with self._send_lock:
+            for attempt in (0, 1):
+                try:
+                    if self._conn is None:
+                        self._conn = Client(self.address, authkey=_authkey())
+                    self._conn.send(msg)
+                    return
+                except (OSError, EOFError):
+                    # learner restarted: reconnect once, then give up
+                    self._conn = None
+                    if attempt:
+                        raise
+
+    def learn(self, state, action_id, reward, next_state, done):
+        self._send([(state, action_id, reward, next_state, done)])
+        return {"status": "forwarded"}
+
+    def learn_batch(self, transitions, persist=True):
+        transitions = list(transitions)
+        self._send(transitions)
+        return [{"status": "forwarded"} for _ in transitions]
+
+    def close(self):
+        with self._send_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _serve_connection(conn, learner):
+    with conn:
+        while True:
+            try:
+                batch = conn.recv()
+            except (EOFError, OSError):
+                return
+            learner.submit_many(batch)
+
+
+def run_learner(model_path="sarsa_table.json", journal_path="sarsa_table.journal", directory=DEFAULT_DIR,
+                address=None, publish_interval=1.0, storage="dict"):
+    """Single writer: nhận feedback từ mọi worker, học, và publish snapshot định kỳ."""
+    if storage == "linear":
+        # reader mmap bảng .sqt; trọng số linear không publish theo dạng đó được
+        raise ValueError("multi-worker mode needs a tabular storage (dict, dense or tiered)")
+    address = address or os.path.join(directory, "learner.sock")
+    agent = OnlineLearningAgent(model_path=model_path, journal_path=journal_path, storage=storage)
+    learner = BackgroundLearner(agent, overflow="block", block_timeout=1.0).start()
+    publisher = SnapshotPublisher(directory)
+    with agent._lock:
+        publisher.publish(agent.sarsa.snapshot())
+    print(f"Learner published v{publisher.version} to {directory}, listening on {address}")
+
+    if os.path.exists(address):
+        os.remove(address)
+    listener = Listener(address, authkey=_authkey())
+
+    def accept_loop():
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError):
+                continue
+            threading.Thread(target=_serve_connection, args=(conn, learner), daemon=True).start()
+
+    threading.Thread(target=accept_loop, name="learner-accept", daemon=True).start()
+    published = learner.applied
+    try:
+        while True:
+            time.sleep(publish_interval)
+            if learner.applied == published:
+                continue
+            published = learner.applied
+            with agent._lock:
+                table = agent.sarsa.snapshot()
+            publisher.publish(table)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        learner.stop(flush=True)
+        agent.close()
+        listener.close()
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Single-writer SARSA learner for multi-worker serving")
+    p.add_argument('mode', choices=['learner'])
+    p.add_argument('--model-path', default='sarsa_table.json')
+    p.add_argument('--journal-path', default='sarsa_table.journal')
+    p.add_argument('--dir', default=os.environ.get("SARSA_SHM_DIR", DEFAULT_DIR))
+    p.add_argument('--socket', default=None, help='Unix socket (mặc định <dir>/learner.sock)')
+    p.add_argument('--publish-interval', type=float, default=1.0)
+    p.add_argument('--storage', default=os.environ.get("SARSA_STORAGE", "dict"))
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run_learner(model_path=args.model_path, journal_path=args.journal_path, directory=args.dir,
+                address=args.socket, publish_interval=args.publish_interval, storage=args.storage)
@@ -0,0 +1,173 @@
+"""Canonical state encoding for the recommendation agent.
+
+API ``State`` (avail / history / context.meal_time) được chuẩn hoá thành cùng dạng key với
+bảng đi kèm repo::
+
+    avail=('Gạo', 'Mì', 'Tỏi')|meal_time=Ăn sáng|history=(8, 9)
+
+- avail: tập nguyên liệu, bỏ trùng và sort
+- meal_time: lấy từ context["meal_time"] (hoặc state["meal_time"])
+- history: `history_window` món gần nhất, id quy về int nếu được
+
+key_format="legacy" cho đúng chuỗi trên (đã sys.intern); key_format="hash" cho 16 ký tự
+hex (blake2b 64-bit của chuỗi legacy) — gọn hơn nhưng vẫn là str nên mọi kiểu lưu trữ
+(JSON, .sqt, journal) dùng được. Kết quả được nhớ trong LRU có giới hạn.
+
+Migrate bảng cũ (key json.dumps từ server trước đây, hoặc đổi định dạng key):
+    python state_encoder.py sarsa_table.json sarsa_table.migrated.json [--format hash]
+"""
+import argparse
+import ast
+import hashlib
+import json
+import os
+import re
+import sys
+from functools import lru_cache
+
+__all__ = ["StateEncoder", "migrate_table", "parse_legacy_key"]
+
+KEY_FORMATS = ("legacy", "hash")
+_LEGACY_RE = re.compile(r"avail=(.*)\|meal_time=(.*)\|history=(.*)$", re.S)
+
+
+def _canon_item(x):
+    if isinstance(x, int) and not isinstance(x, bool):
+        return x
+    try:
+        return int(x)
+    except (TypeError, ValueError):
+        return str(x)
+
+
+def parse_legacy_key(key):
+    """Tách key legacy thành (avail, meal_time, history); None nếu key không đúng dạng."""
+    m = _LEGACY_RE.match(key)
+    if not m:
+        return None
+    try:
+        avail = ast.literal_eval(m.group(1))
+        history = ast.literal_eval(m.group(3))
+    except (ValueError, SyntaxError):
+        return None
+    meal_time = m.group(2)
+    return tuple(avail), None if meal_time == "None" else meal_time, tuple(history)
+
+
+class StateEncoder:
+    def __init__(self, key_format="legacy", history_window=3, cache_size=65536):
+        """
+        key_format: "legacy" hoặc "hash"
+        history_window: số món gần nhất giữ lại trong history (None = toàn bộ);
+            bảng đi kèm repo được huấn luyện với 3
+        cache_size: số state đã encode được nhớ (LRU)
+        """
+        if key_format not in KEY_FORMATS:
+            raise ValueError(f"unknown key_format: {key_format!r}")
+        self.key_format = key_format
+        self.history_window = history_window
+        self._cached = lru_cache(maxsize=cache_size)(self._build)
+
+    def __call__(self, state):
+        return self.encode(state)
+
+    def encode(self, state):
+        if isinstance(state, str):
+            return state
+        if not isinstance(state, dict):
+            # states không phải dict (ví dụ observation int của gym) giữ cách encode cũ
+            try:
+                return json.dumps(state, sort_keys=True)
+            except (TypeError, ValueError):
+                return str(state)
+        avail = state.get("avail") or ()
+        ctx = state.get("context") or {}
+        meal_time = ctx.get("meal_time", state.get("meal_time"))
+        history = state.get("history") or ()
+        if self.history_window is not None:
+            history = history[-self.history_window:] if self.history_window else ()
+        try:
+            return self._cached(tuple(avail), meal_time, tuple(history))
+        except TypeError:
+            # phần tử không hash được (dict trong history...) -> bỏ qua cache
+            return self._build(tuple(str(a) for a in avail), meal_time,
+                               tuple(_canon_item(h) for h in history))
+
+    def _build(self, avail, meal_time, history):
+        avail = tuple(sorted({str(a) for a in avail}))
+        history = tuple(_canon_item(h) for h in history)
+        key = f"avail={avail!r}|meal_time={meal_time}|history={history!r}"
+        if self.key_format == "hash":
+            return hashlib.blake2b(key.encode("utf-8"), digest_size=8).hexdigest()
+        return sys.intern(key)
+
+    def cache_info(self):
+        return self._cached.cache_info()
+
+    def rekey(self, key):
+        """Chuyển một key cũ (json.dumps của state, hoặc chuỗi legacy) sang key hiện tại.
+
+        Trả về None nếu key không nhận ra được (ví dụ key của FrozenLake).
+        """
+        if _LEGACY_RE.match(key):
+            parts = parse_legacy_key(key)
+            if parts is None:
+                return None
+            avail, meal_time, history = parts
+            return self.encode({"avail": list(avail), "history": list(history),
+                                "context": {"meal_time": meal_time}})
+        try:
+            state = json.loads(key)
+        except ValueError:
+            return None
+        if isinstance(state, dict) and "avail" in state:
+            return self.encode(state)
+        return None
+
+
+def migrate_table(table, encoder):
+    """Đổi key của table ({key: {action: value}}) sang key chuẩn của `encoder`.
+
+    Key không nhận ra được giữ nguyên. Nếu nhiều key cũ gộp vào một key mới, action trùng
+    lấy giá trị của key cũ đã đúng định dạng (nếu có), còn lại lấy key gặp sau.
+    Trả về (bảng mới, số key đã đổi).
+    """
+    out = {}
+    exact = set()
+    changed = 0
+    for key, row in table.items():
+        new_key = encoder.rekey(key) or key
+        if new_key != key:
+            changed += 1
+        entry = out.setdefault(new_key, {})
+        if new_key == key:
+            entry.update(row)
+            exact.add(new_key)
+        elif new_key in exact:
+            for a, v in row.items():
+                entry.setdefault(a, v)
+        else:
+            entry.update(row)
+    return out, changed
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Migrate Q-table state keys to the canonical encoding")
+    p.add_argument('src')
+    p.add_argument('dst')
+    p.add_argument('--format', default='legacy', choices=KEY_FORMATS)
+    p.add_argument('--history-window', type=int, default=3)
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    with open(args.src, "r") as f:
+        src = json.load(f)
+    encoder = StateEncoder(key_format=args.format, history_window=args.history_window)
+    migrated, changed = migrate_table(src, encoder)
+    tmp = f"{args.dst}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(migrated, f, indent=2)
+    os.replace(tmp, args.dst)
+    print(f"Migrated {changed} keys; {len(src)} -> {len(migrated)} states written to {args.dst}")
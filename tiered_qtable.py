@@ -0,0 +1,235 @@
+"""Bounded-memory Q-table: LRU hot tier in RAM, cold states spilled to sqlite.
+
+``TieredQTable`` thay được cho ``SARSAAgent.q``: ``table[key]`` trả về dict {action: value}
+của state (nạp từ tầng lạnh hoặc tạo mới), ``table.get(key)`` chỉ đọc, không tạo state.
+Khi số state trong RAM vượt ``max_resident_states``, state ít dùng gần đây nhất bị đẩy
+xuống sqlite (theo lô, một transaction mỗi lần xả) và được nạp lại khi truy cập.
+
+Tầng lạnh là cache dẫn xuất từ snapshot + journal, nên file sqlite được tạo lại mỗi lần
+khởi động; nguồn dữ liệu bền vững vẫn là q_table_path (+ journal). Save / compaction duyệt
+bảng theo dòng (items()) và ghi thẳng ra file, nên RAM vẫn bị chặn bởi ngân sách kể cả
+lúc checkpoint.
+"""
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+try:
+    from .sarsa_agent import SARSAAgent
+    from .qtable_snapshot import MappedQTable, is_snapshot
+except ImportError:
+    from sarsa_agent import SARSAAgent
+    from qtable_snapshot import MappedQTable, is_snapshot
+
+__all__ = ["TieredQTable", "TieredSARSAAgent"]
+
+
+def _encode_row(row):
+    return json.dumps([[a, v] for a, v in row.items()])
+
+
+def _decode_row(blob):
+    return {a: v for a, v in json.loads(blob)}
+
+
+class TieredQTable:
+    def __init__(self, spill_path, max_resident_states=100000, default_factory=dict, spill_batch=256):
+        """
+        spill_path: file sqlite cho tầng lạnh (bị xoá và tạo lại)
+        max_resident_states: số state tối đa giữ trong RAM
+        spill_batch: số state bị evict được gom lại trước khi ghi xuống sqlite
+        """
+        self.max_resident_states = max(1, int(max_resident_states))
+        self.spill_batch = max(1, int(spill_batch))
+        self.default_factory = default_factory
+        self.spill_path = spill_path
+        self._hot = OrderedDict()
+        self._pending = {}   # đã evict, chưa ghi xuống sqlite
+        self._lock = threading.RLock()
+        for suffix in ("", "-wal", "-shm", "-journal"):
+            try:
+                os.remove(spill_path + suffix)
+            except OSError:
+                pass
+        dirname = os.path.dirname(spill_path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._db = sqlite3.connect(spill_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute("CREATE TABLE q (key TEXT PRIMARY KEY, row TEXT NOT NULL)")
+        self._cold = 0
+        self.hits = 0
+        self.faults = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # --- tiers ---
+    def _fault(self, key):
+        """Lấy state từ tầng lạnh (và gỡ khỏi đó); None nếu không có."""
+        row = self._pending.pop(key, None)
+        if row is not None:
+            return row
+        cur = self._db.execute("SELECT row FROM q WHERE key = ?", (key,)).fetchone()
+        if cur is None:
+            return None
+        self._db.execute("DELETE FROM q WHERE key = ?", (key,))
+        self._cold -= 1
+        return _decode_row(cur[0])
+
+    def _admit(self, key, row):
+        self._hot[key] = row
+        while len(self._hot) > self.max_resident_states:
+            old_key, old_row = self._hot.popitem(last=False)
+            self._pending[old_key] = old_row
+            self.evictions += 1
+        if len(self._pending) >= self.spill_batch:
+            self._spill()
+
+    def _spill(self):
+        if not self._pending:
+            return
+        rows = [(k, _encode_row(r)) for k, r in self._pending.items()]
+        self._db.execute("BEGIN")
+        self._db.executemany("INSERT OR REPLACE INTO q (key, row) VALUES (?, ?)", rows)
+        self._db.execute("COMMIT")
+        self._cold += len(rows)
+        self._pending.clear()
+
+    def _lookup(self, key, create):
+        with self._lock:
+            row = self._hot.get(key)
+            if row is not None:
+                self._hot.move_to_end(key)
+                self.hits += 1
+                return row
+            row = self._fault(key)
+            if row is not None:
+                self.faults += 1
+            else:
+                self.misses += 1
+                if not create:
+                    return None
+                row = self.default_factory()
+            self._admit(key, row)
+            return row
+
+    # --- mapping API (đủ cho SARSAAgent) ---
+    def __getitem__(self, key):
+        return self._lookup(key, create=True)
+
+    def get(self, key, default=None):
+        row = self._lookup(key, create=False)
+        return default if row is None else row
+
+    def __setitem__(self, key, row):
+        with self._lock:
+            if key in self._hot:
+                self._hot[key] = row
+                self._hot.move_to_end(key)
+                return
+            # bản cũ ở tầng lạnh (nếu có) bị thay thế
+            self._fault(key)
+            self._admit(key, row)
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._hot or key in self._pending:
+                return True
+            return self._db.execute("SELECT 1 FROM q WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self):
+        return len(self._hot) + len(self._pending) + self._cold
+
+    def items(self):
+        """Mọi state (nóng trước, rồi lạnh) tại thời điểm gọi — không nạp state lạnh vào RAM.
+
+        Tầng nóng được copy (giới hạn bởi max_resident_states); tầng lạnh được đọc dần qua
+        một connection riêng trong một read transaction (WAL), nên evict / fault xảy ra trong
+        lúc duyệt không làm sót hay lặp state. Dùng được từ thread khác, không cần giữ lock.
+        """
+        with self._lock:
+            self._spill()
+            hot = [(k, dict(r)) for k, r in self._hot.items()]
+            reader = sqlite3.connect(self.spill_path, check_same_thread=False, isolation_level=None)
+            reader.execute("BEGIN")
+            # bước đầu của SELECT chốt snapshot đọc trước khi nhả lock
+            cursor = reader.execute("SELECT key, row FROM q")
+        return self._stream(hot, reader, cursor)
+
+    @staticmethod
+    def _stream(hot, reader, cursor):
+        try:
+            yield from hot
+            del hot
+            while True:
+                chunk = cursor.fetchmany(1024)
+                if not chunk:
+                    break
+                for key, blob in chunk:
+                    yield key, _decode_row(blob)
+        finally:
+            reader.close()
+
+    def stats(self):
+        lookups = self.hits + self.faults + self.misses
+        return {
+            "states": len(self),
+            "resident_states": len(self._hot),
+            "max_resident_states": self.max_resident_states,
+            "cold_states": self._cold + len(self._pending),
+            "hits": self.hits,
+            "faults": self.faults,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self, remove=False):
+        """remove=True: xoá luôn file sqlite (bảng đã bị thay, ví dụ sau hot-reload)."""
+        with self._lock:
+            self._db.close()
+        if remove:
+            for suffix in ("", "-wal", "-shm", "-journal"):
+                try:
+                    os.remove(self.spill_path + suffix)
+                except OSError:
+                    pass
+
+
+class TieredSARSAAgent(SARSAAgent):
+    """SARSAAgent với TieredQTable: RAM giới hạn bởi max_resident_states."""
+
+    def __init__(self, actions, max_resident_states=100000, spill_path=None, **kwargs):
+        self.max_resident_states = max_resident_states
+        # chỉ mục argmax cũng bị giới hạn theo ngân sách RAM
+        self.index_limit = max_resident_states
+        q_table_path = kwargs.get("q_table_path", "sarsa_table.json")
+        self.spill_path = spill_path or f"{q_table_path}.spill.sqlite"
+        super().__init__(actions, **kwargs)
+
+    def _empty_table(self):
+        old = getattr(self, "q", None)
+        if isinstance(old, TieredQTable):
+            old.close()
+        return TieredQTable(self.spill_path, max_resident_states=self.max_resident_states,
+                            default_factory=lambda: {a: 0.0 for a in self.actions})
+
+    def snapshot(self):
+        """Các cặp (key, row) đọc dần (xem TieredQTable.items) thay vì copy cả bảng vào RAM;
+        write_table / dump nhận thẳng iterable này. Chỉ duyệt được một lần."""
+        return self.q.items()
+
+    def load(self, path=None):
+        path = path or self.q_table_path
+        self._best = {}
+        if is_snapshot(path):
+            # đổ snapshot vào bảng tầng: state vượt ngân sách RAM đi thẳng xuống sqlite
+            snap = MappedQTable(path)
+            self.q = self._empty_table()
+            for key, row in snap.items():
+                self.q[key] = row
+            return
+        super().load(path)
@@ -0,0 +1,318 @@
+"""Capture /predict and /feedback traffic, and replay it offline or against a live server.
+
+Capture (server, bật bằng SARSA_CAPTURE_DIR): request thread chỉ đặt (thời điểm, loại, model
+pydantic) vào một buffer trong RAM; thread ghi nền mới gọi .dict(), encode JSON và ghi ra file.
+Buffer đầy thì bản ghi bị bỏ (và được đếm) chứ không chặn request.
+
+Định dạng file ``capture-<thời gian>-<n>.cap.gz``: luồng gzip (mỗi lần ghi là một gzip member,
+nên file bị cắt ngang vẫn đọc được tới member cuối hoàn chỉnh), bên trong là các bản ghi
+``u32 độ dài (little-endian) + JSON {"ts", "kind", "payload"}``. File được xoay vòng theo kích
+thước, giữ tối đa ``max_files`` file mới nhất.
+
+Replay:
+    python traffic_capture.py offline captures/ --model-path rebuilt.json      # learn ở tốc độ tối đa
+    python traffic_capture.py live captures/ --url http://localhost:8000 --rate 500 --workers 8
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+__all__ = ["TrafficRecorder", "read_capture", "capture_files", "replay_offline", "replay_live"]
+
+CAPTURE_EXT = ".cap.gz"
+_LEN = struct.Struct("<I")
+# loại bản ghi -> endpoint khi replay live
+ENDPOINTS = {
+    "predict": "/predict",
+    "feedback": "/feedback",
+    "predict_batch": "/predict/batch",
+    "feedback_batch": "/feedback/batch",
+}
+
+
+def _as_dict(payload):
+    return payload.dict() if hasattr(payload, "dict") else payload
+
+
+class TrafficRecorder:
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, max_files=20, max_buffer=100000,
+                 flush_interval=1.0, compresslevel=1):
+        """
+        directory: nơi ghi các file capture
+        max_bytes: kích thước (đã nén) để xoay sang file mới
+        max_files: số file giữ lại (file cũ nhất bị xoá)
+        max_buffer: số bản ghi tối đa chờ ghi; vượt quá thì bỏ
+        flush_interval: chu kỳ (giây) thread nền ghi buffer ra đĩa
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max(1, max_files)
+        self.max_buffer = max_buffer
+        self.flush_interval = flush_interval
+        self.compresslevel = compresslevel
+        os.makedirs(directory, exist_ok=True)
+        self._buf = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._file = None
+        self._raw = None
+        self._seq = 0
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+        self._thread.start()
+
+    def record(self, kind, payload):
+        """Ghi nhận một request; payload là model pydantic hoặc dict. Không bao giờ chặn."""
+        item = (time.time(), kind, payload)
+        with self._lock:
+            if len(self._buf) >= self.max_buffer:
+                self.dropped += 1
+                return False
+            self._buf.append(item)
+            self.recorded += 1
+        return True
+
+    def stats(self):
+        return {"recorded": self.recorded, "written": self.written, "dropped": self.dropped,
+                "pending": len(self._buf), "file": self._raw.name if self._raw else None}
+
+    # --- writer thread ---
+    def _open(self):
+        self._seq += 1
+        name = f"capture-{time.strftime('%Y%m%d-%H%M%S')}-{self._seq:04d}{CAPTURE_EXT}"
+        self._raw = open(os.path.join(self.directory, name), "ab")
+        self._file = gzip.GzipFile(fileobj=self._raw, mode="ab", compresslevel=self.compresslevel)
+        files = capture_files(self.directory)
+        for old in files[:-self.max_files]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._raw.close()
+            self._file = self._raw = None
+
+    def _write(self, items):
+        if self._file is None:
+            self._open()
+        frames = []
+        for ts, kind, payload in items:
+            try:
+                body = json.dumps({"ts": ts, "kind": kind, "payload": _as_dict(payload)},
+                                  ensure_ascii=False, default=str).encode("utf-8")
+            except (TypeError, ValueError):
+                continue
+            frames.append(_LEN.pack(len(body)))
+            frames.append(body)
+        # mỗi lần ghi kết thúc một gzip member: dữ liệu đã flush đọc được kể cả khi process chết
+        self._file.write(b"".join(frames))
+        self._file.close()
+        self._raw.flush()
+        self.written += len(frames) // 2
+        if self._raw.tell() >= self.max_bytes:
+            self._raw.close()
+            self._file = self._raw = None
+        else:
+            self._file = gzip.GzipFile(fileobj=self._raw, mode="ab", compresslevel=self.compresslevel)
+
+    def _drain(self):
+        with self._lock:
+            items, self._buf = self._buf, []
+        if items:
+            try:
+                self._write(items)
+            except OSError as e:
+                self.dropped += len(items)
+                print(f"Traffic capture write failed: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._drain()
+        self._drain()
+
+    def flush(self):
+        self._wake.set()
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._close_file()
+
+
+def capture_files(path):
+    """Các file capture (theo thứ tự thời gian) trong thư mục `path`, hoặc chính file `path`."""
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, f"*{CAPTURE_EXT}")))
+    return [path]
+
+
+def read_capture(path, kinds=None):
+    """Đọc tuần tự các bản ghi {"ts", "kind", "payload"}; không nạp cả file vào RAM.
+
+    kinds: chỉ lấy các loại này (ví dụ {"feedback", "feedback_batch"}).
+    """
+    for name in capture_files(path):
+        with gzip.open(name, "rb") as f:
+            while True:
+                try:
+                    head = f.read(_LEN.size)
+                    if len(head) < _LEN.size:
+                        break
+                    body = f.read(_LEN.unpack(head)[0])
+                except (EOFError, OSError):
+                    # member cuối bị cắt ngang (process dừng giữa lúc ghi)
+                    break
+                try:
+                    rec = json.loads(body)
+                except ValueError:
+                    break
+                if kinds is None or rec.get("kind") in kinds:
+                    yield rec
+
+
+def _transitions(rec):
+    payload = rec["payload"]
+    items = payload["transitions"] if rec["kind"] == "feedback_batch" else [payload]
+    for t in items:
+        yield t["state"], t["action"], t["reward"], t["next_state"], t["done"]
+
+
+def replay_offline(path, agent, batch_size=1024, include_predict=False):
+    """Cho agent (OnlineLearningAgent) học lại toàn bộ feedback trong capture, theo thứ tự.
+
+    include_predict: chạy cả các /predict đã ghi (để đo, hoặc để agent biết thêm action).
+    Trả về số transition đã học.
+    """
+    kinds = {"feedback", "feedback_batch"}
+    if include_predict:
+        kinds |= {"predict", "predict_batch"}
+    batch = []
+    learned = 0
+    start = time.perf_counter()
+    for rec in read_capture(path, kinds):
+        if rec["kind"] in ("predict", "predict_batch"):
+            p = rec["payload"]
+            for r in (p["requests"] if rec["kind"] == "predict_batch" else [p]):
+                agent.predict(r["state"], r["possible_actions"], k=r.get("k", 1))
+            continue
+        batch.extend(_transitions(rec))
+        if len(batch) >= batch_size:
+            agent.learn_batch(batch)
+            learned += len(batch)
+            batch = []
+    if batch:
+        agent.learn_batch(batch)
+        learned += len(batch)
+    elapsed = time.perf_counter() - start
+    print(f"Replayed {learned} transitions in {elapsed:.2f}s ({learned / max(elapsed, 1e-9):,.0f}/s)")
+    return learned
+
+
+def replay_live(path, url, rate=None, speedup=None, workers=8, timeout=10.0, kinds=None):
+    """Gửi lại capture tới server đang chạy.
+
+    rate: số request/giây cố định; speedup: giữ nhịp gốc của capture, nhanh hơn `speedup` lần;
+    không đặt cả hai thì gửi nhanh nhất có thể. Trả về thống kê latency (ms).
+    """
+    import requests
+
+    session = requests.Session()
+    url = url.rstrip("/")
+    latencies = []
+    errors = [0]
+
+    def send(endpoint, payload):
+        t0 = time.perf_counter()
+        try:
+            resp = session.post(url + endpoint, json=payload, timeout=timeout)
+            ok = resp.status_code < 400
+        except requests.RequestException:
+            ok = False
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+        if not ok:
+            errors[0] += 1
+
+    sent = 0
+    start = time.perf_counter()
+    first_ts = None
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for rec in read_capture(path, kinds):
+            endpoint = ENDPOINTS.get(rec.get("kind"))
+            if endpoint is None:
+                continue
+            if rate:
+                due = start + sent / rate
+            elif speedup:
+                first_ts = rec["ts"] if first_ts is None else first_ts
+                due = start + (rec["ts"] - first_ts) / speedup
+            else:
+                due = None
+            if due is not None:
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(send, endpoint, rec["payload"])
+            sent += 1
+    elapsed = time.perf_counter() - start
+    lat = np.asarray(latencies) if latencies else np.zeros(1)
+    stats = {"sent": sent, "errors": errors[0], "seconds": round(elapsed, 3),
+             "rps": round(sent / max(elapsed, 1e-9), 1),
+             "p50_ms": round(float(np.percentile(lat, 50)), 3),
+             "p95_ms": round(float(np.percentile(lat, 95)), 3),
+             "p99_ms": round(float(np.percentile(lat, 99)), 3)}
+    print(json.dumps(stats))
+    return stats
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Replay captured /predict and /feedback traffic")
+    sub = p.add_subparsers(dest='mode', required=True)
+    off = sub.add_parser('offline', help='học lại feedback bằng OnlineLearningAgent (không qua HTTP)')
+    off.add_argument('capture', help='thư mục capture hoặc một file .cap.gz')
+    off.add_argument('--model-path', default='sarsa_table.replay.json')
+    off.add_argument('--storage', default='dict')
+    off.add_argument('--batch-size', type=int, default=1024)
+    off.add_argument('--include-predict', action='store_true')
+    live = sub.add_parser('live', help='gửi lại traffic tới server đang chạy (load test)')
+    live.add_argument('capture')
+    live.add_argument('--url', default='http://localhost:8000')
+    live.add_argument('--rate', type=float, default=None, help='request/giây cố định')
+    live.add_argument('--speedup', type=float, default=None, help='giữ nhịp gốc, nhanh hơn N lần')
+    live.add_argument('--workers', type=int, default=8)
+    live.add_argument('--only', choices=sorted(ENDPOINTS), nargs='+', default=None, help='chỉ gửi các loại này')
+    return p.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.mode == 'offline':
+        try:
+            from .sarsa_agent import OnlineLearningAgent
+        except ImportError:
+            from sarsa_agent import OnlineLearningAgent
+        agent = OnlineLearningAgent(model_path=args.model_path, storage=args.storage,
+                                    journal_path=f"{args.model_path}.journal")
+        replay_offline(args.capture, agent, batch_size=args.batch_size, include_predict=args.include_predict)
+        agent.compact(wait=True)
+        agent.close()
+        print(f"Rebuilt table saved to {args.model_path}")
+    else:
+        replay_live(args.capture, args.url, rate=args.rate, speedup=args.speedup, workers=args.workers,
+                    kinds=set(args.only) if args.only else None)
@@ -1,9 +1,27 @@
-"""CLI to run long SARSA training with resume/save options."""
+"""CLI to run long SARSA training with resume/save options.
+
+Sweep mode chạy nhiều cấu hình (alpha, gamma, epsilon, epsilon-decay) x seed song song
+trên process pool; mỗi trial có bảng riêng trong --sweep-dir, reward từng episode được gom
+vào results.npz + results.csv và cấu hình tốt nhất ghi ra best.json:
+
+    python train.py --sweep grid --alpha 0.1 0.3 0.5 --gamma 0.9 0.99 --seeds 0 1 2
+    python train.py --sweep random --trials 40 --alpha 0.05 0.8 --epsilon-decay 0.99 0.9999
+"""
 import argparse
+import contextlib
+import csv
+import io
+import itertools
+import json
 import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import gym
-from sarsa_agent import SARSAAgent
-from sarsa_trainer import train_sarsa
+import numpy as np
+from sarsa_agent import make_agent
+from sarsa_trainer import SyncVectorEnv, train_sarsa, train_sarsa_vectorized
 
 
 def parse_args():
@@ -11,30 +29,166 @@ def parse_args():
     p.add_argument('--env', default='FrozenLake-v1', help='Gym environment id')
     p.add_argument('--episodes', type=int, default=10000)
     p.add_argument('--max-steps', type=int, default=200)
-    p.add_argument('--alpha', type=float, default=0.5)
-    p.add_argument('--gamma', type=float, default=0.99)
-    p.add_argument('--epsilon', type=float, default=0.2)
-    p.add_argument('--epsilon-decay', type=float, default=0.9995)
+    # mỗi hyperparameter nhận nhiều giá trị cho sweep; chạy đơn chỉ được một giá trị
+    p.add_argument('--alpha', type=float, nargs='+', default=[0.5])
+    p.add_argument('--gamma', type=float, nargs='+', default=[0.99])
+    p.add_argument('--epsilon', type=float, nargs='+', default=[0.2])
+    p.add_argument('--epsilon-decay', type=float, nargs='+', default=[0.9995])
     p.add_argument('--min-epsilon', type=float, default=0.01)
-    p.add_argument('--save-path', default='sarsa_table.json')
+    p.add_argument('--storage', default='dict', choices=['dict', 'dense', 'tiered', 'linear'],
+                   help='kiểu Q-table; linear = xấp xỉ tuyến tính trên feature hash')
+    p.add_argument('--n-features', type=int, default=2 ** 20, help='số bucket hash cho --storage linear')
+    p.add_argument('--save-path', default=None,
+                   help='mặc định sarsa_table.json (sarsa_linear.npz với --storage linear)')
     p.add_argument('--save-every', type=int, default=500)
+    p.add_argument('--n-envs', type=int, default=1,
+                   help='>1: chạy N env song song bằng train_sarsa_vectorized (cần observation space rời rạc)')
     p.add_argument('--render', action='store_true')
     p.add_argument('--no-decay', dest='decay', action='store_false')
+    p.add_argument('--seed', type=int, default=None, help='seed cho lần chạy đơn')
+    # --- sweep ---
+    p.add_argument('--sweep', choices=['grid', 'random'], default=None,
+                   help='grid: mọi tổ hợp giá trị; random: --trials mẫu (2 giá trị = khoảng [min, max])')
+    p.add_argument('--trials', type=int, default=20, help='số cấu hình cho --sweep random')
+    p.add_argument('--seeds', type=int, nargs='+', default=[0], help='mỗi cấu hình chạy với từng seed')
+    p.add_argument('--workers', type=int, default=os.cpu_count(), help='số process (mặc định: số core)')
+    p.add_argument('--sweep-dir', default=None, help='thư mục kết quả (mặc định sweeps/<thời gian>)')
     p.set_defaults(decay=True)
-    return p.parse_args()
+    args = p.parse_args()
+    if args.sweep is None:
+        for name in ('alpha', 'gamma', 'epsilon', 'epsilon_decay'):
+            if len(getattr(args, name)) > 1:
+                p.error(f"nhiều giá trị cho --{name.replace('_', '-')} chỉ dùng được với --sweep")
+    return args
 
 
-def main():
-    args = parse_args()
-    print(f"Training on env={args.env} episodes={args.episodes} max_steps={args.max_steps}")
+HYPERPARAMS = ('alpha', 'gamma', 'epsilon', 'epsilon_decay')
+
+
+def _seed_env(env, seed):
+    try:
+        env.reset(seed=seed)  # gymnasium / gym >= 0.22
+    except TypeError:
+        env.seed(seed)
+
+
+def _seed_everything(env, seed):
+    if seed is None:
+        return
+    random.seed(seed)
+    np.random.seed(seed)
+    _seed_env(env, seed)
+
+
+def train_once(args, alpha, gamma, epsilon, epsilon_decay, save_path, seed=None):
+    """Một lần huấn luyện với cấu hình cho trước; trả về reward từng episode."""
     env = gym.make(args.env)
+    _seed_everything(env, seed)
     actions = list(range(env.action_space.n))
+    options = {'n_features': args.n_features} if args.storage == 'linear' else {}
+
+    agent = make_agent(args.storage, actions=actions, alpha=alpha, gamma=gamma, epsilon=epsilon,
+                       q_table_path=save_path, **options)
+
+    if args.n_envs > 1:
+        extra = [gym.make(args.env) for _ in range(args.n_envs - 1)]
+        if seed is not None:
+            # env thứ i nhận seed + i: mỗi env một chuỗi ngẫu nhiên riêng, lặp lại được
+            for i, e in enumerate(extra, 1):
+                _seed_env(e, seed + i)
+        envs = SyncVectorEnv([env] + extra)
+        return train_sarsa_vectorized(envs, agent, episodes=args.episodes, max_steps=args.max_steps,
+                                      decay_epsilon=args.decay, min_epsilon=args.min_epsilon,
+                                      epsilon_decay=epsilon_decay, save_every=args.save_every, seed=seed)
+    return train_sarsa(env, agent, episodes=args.episodes, max_steps=args.max_steps,
+                       decay_epsilon=args.decay, min_epsilon=args.min_epsilon, epsilon_decay=epsilon_decay,
+                       save_every=args.save_every, render=args.render)
 
-    agent = SARSAAgent(actions, alpha=args.alpha, gamma=args.gamma, epsilon=args.epsilon, q_table_path=args.save_path)
 
-    rewards = train_sarsa(env, agent, episodes=args.episodes, max_steps=args.max_steps,
-                          decay_epsilon=args.decay, min_epsilon=args.min_epsilon, epsilon_decay=args.epsilon_decay,
-                          save_every=args.save_every, render=args.render)
+def sweep_configs(args):
+    """Danh sách cấu hình {alpha, gamma, epsilon, epsilon_decay} theo --sweep."""
+    values = [getattr(args, name) for name in HYPERPARAMS]
+    if args.sweep == 'grid':
+        return [dict(zip(HYPERPARAMS, combo)) for combo in itertools.product(*values)]
+    rng = random.Random(args.seeds[0])
+
+    def sample(vals):
+        if len(vals) == 2:
+            return rng.uniform(min(vals), max(vals))
+        return rng.choice(vals)
+
+    return [{name: sample(vals) for name, vals in zip(HYPERPARAMS, values)} for _ in range(args.trials)]
+
+
+def _run_trial(args, trial):
+    # log tiến độ của từng trial bị nuốt; process cha in tóm tắt khi trial xong
+    with contextlib.redirect_stdout(io.StringIO()):
+        rewards = train_once(args, trial['alpha'], trial['gamma'], trial['epsilon'], trial['epsilon_decay'],
+                             trial['save_path'], seed=trial['seed'])
+    return trial, np.asarray(rewards, dtype=np.float32)
+
+
+def run_sweep(args):
+    out_dir = args.sweep_dir or os.path.join('sweeps', time.strftime('%Y%m%d-%H%M%S'))
+    os.makedirs(out_dir, exist_ok=True)
+    ext = '.npz' if args.storage == 'linear' else '.json'
+    trials = []
+    for config in sweep_configs(args):
+        for seed in args.seeds:
+            i = len(trials)
+            trials.append(dict(config, seed=seed, trial=i,
+                               save_path=os.path.join(out_dir, f"trial_{i:04d}{ext}")))
+    workers = max(1, min(args.workers or 1, len(trials)))
+    print(f"Sweep ({args.sweep}): {len(trials)} trials on {workers} processes -> {out_dir}")
+
+    rewards = np.zeros((len(trials), args.episodes), dtype=np.float32)
+    tail = max(1, args.episodes // 10)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_run_trial, args, t) for t in trials]
+        for done, fut in enumerate(as_completed(futures), 1):
+            trial, r = fut.result()
+            rewards[trial['trial'], :len(r)] = r
+            print(f"[Sweep] {done}/{len(trials)} trial {trial['trial']} "
+                  f"alpha={trial['alpha']:.4g} gamma={trial['gamma']:.4g} eps={trial['epsilon']:.4g} "
+                  f"decay={trial['epsilon_decay']:.6g} seed={trial['seed']} | final {r[-tail:].mean():.3f}")
+    print(f"Sweep finished in {time.perf_counter() - start:.1f}s")
+
+    final = rewards[:, -tail:].mean(axis=1)
+    np.savez_compressed(os.path.join(out_dir, 'results.npz'), rewards=rewards, final_reward=final,
+                        seed=np.array([t['seed'] for t in trials]),
+                        **{name: np.array([t[name] for t in trials]) for name in HYPERPARAMS})
+    with open(os.path.join(out_dir, 'results.csv'), 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(['trial', *HYPERPARAMS, 'seed', 'mean_reward', 'final_reward', 'save_path'])
+        for t, row, fin in zip(trials, rewards, final):
+            w.writerow([t['trial'], *(t[name] for name in HYPERPARAMS), t['seed'],
+                        f"{row.mean():.6f}", f"{fin:.6f}", t['save_path']])
+
+    # cấu hình tốt nhất: reward trung bình 10% episode cuối, lấy trung bình qua các seed
+    by_config = {}
+    for t, fin in zip(trials, final):
+        by_config.setdefault(tuple(t[name] for name in HYPERPARAMS), []).append((float(fin), t))
+    key, runs = max(by_config.items(), key=lambda kv: np.mean([fin for fin, _ in kv[1]]))
+    best_run = max(runs, key=lambda r: r[0])[1]
+    best = dict(zip(HYPERPARAMS, key), final_reward=float(np.mean([fin for fin, _ in runs])),
+                seeds=[t['seed'] for _, t in runs], best_table=best_run['save_path'])
+    with open(os.path.join(out_dir, 'best.json'), 'w') as f:
+        json.dump(best, f, indent=2)
+    print("Best config:", json.dumps(best))
+    return best
+
+
+def main():
+    args = parse_args()
+    if args.sweep:
+        run_sweep(args)
+        return
+    print(f"Training on env={args.env} episodes={args.episodes} max_steps={args.max_steps}")
+    if args.save_path is None:
+        args.save_path = 'sarsa_linear.npz' if args.storage == 'linear' else 'sarsa_table.json'
+    train_once(args, args.alpha[0], args.gamma[0], args.epsilon[0], args.epsilon_decay[0], args.save_path,
+               seed=args.seed)
     print("Training finished. Saved Q-table to", args.save_path)
 
 
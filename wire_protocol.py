@@ -0,0 +1,162 @@
+"""MessagePack wire format for /predict and /feedback (endpoints /msgpack/...).
+
+Cùng dữ liệu với các endpoint JSON, nhưng:
+- body là MessagePack (Content-Type: application/msgpack), decode bằng C extension;
+- validate bằng kiểm tra kiểu trực tiếp trên dict đã decode thay vì dựng model pydantic
+  lồng nhau rồi gọi .dict();
+- response được pack thẳng từ [(action, q)] của agent: q_values giữ key int, không
+  str(k); các response cố định (feedback ok / queued) được encode sẵn một lần.
+
+msgpack là dependency tuỳ chọn: không cài thì AVAILABLE = False và server trả 415 cho các
+endpoint này, các endpoint JSON không bị ảnh hưởng.
+
+Ví dụ client:
+    body = msgpack.packb({"state": {...}, "k": 3, "possible_actions": [1, 2, 3]})
+    r = requests.post(url + "/msgpack/predict", data=body,
+                      headers={"Content-Type": "application/msgpack"})
+    msgpack.unpackb(r.content, strict_map_key=False)
+"""
+import threading
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+__all__ = ["AVAILABLE", "CONTENT_TYPE", "WireError", "decode_predict", "decode_feedback",
+           "decode_predict_batch", "decode_feedback_batch", "encode", "encode_prediction",
+           "encode_predictions", "preencoded"]
+
+AVAILABLE = msgpack is not None
+CONTENT_TYPE = "application/msgpack"
+
+
+class WireError(ValueError):
+    """Body không decode được hoặc sai schema (server trả 422)."""
+
+
+def _unpack(body):
+    if not body:
+        raise WireError("empty body")
+    try:
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    except (ValueError, TypeError, msgpack.UnpackException) as e:
+        raise WireError(f"invalid msgpack body ({type(e).__name__}: {e})") from e
+
+
+def _map(obj, where):
+    if type(obj) is not dict:
+        raise WireError(f"{where}: expected a map")
+    return obj
+
+
+def _int(obj, where):
+    if type(obj) is not int:
+        raise WireError(f"{where}: expected an integer")
+    return obj
+
+
+def _ints(obj, where):
+    if type(obj) is not list:
+        raise WireError(f"{where}: expected an array of integers")
+    for x in obj:
+        if type(x) is not int:
+            raise WireError(f"{where}: expected an array of integers")
+    return obj
+
+
+def _state(obj, where):
+    """Cùng ràng buộc với server.State; chỉ giữ avail / history / context như State.dict()."""
+    _map(obj, where)
+    avail = obj.get("avail")
+    if type(avail) is not list:
+        raise WireError(f"{where}.avail: expected an array of strings")
+    for a in avail:
+        if type(a) is not str:
+            raise WireError(f"{where}.avail: expected an array of strings")
+    history = obj.get("history")
+    if type(history) is not list:
+        raise WireError(f"{where}.history: expected an array")
+    context = obj.get("context")
+    if context is not None and type(context) is not dict:
+        raise WireError(f"{where}.context: expected a map or nil")
+    return {"avail": avail, "history": history, "context": context}
+
+
+def _predict_request(obj, where):
+    _map(obj, where)
+    return (_state(obj.get("state"), f"{where}.state"),
+            _ints(obj.get("possible_actions"), f"{where}.possible_actions"),
+            _int(obj.get("k"), f"{where}.k"))
+
+
+def _transition(obj, where):
+    _map(obj, where)
+    reward = obj.get("reward")
+    if type(reward) not in (int, float):
+        raise WireError(f"{where}.reward: expected a number")
+    done = obj.get("done")
+    if type(done) is not bool:
+        raise WireError(f"{where}.done: expected a boolean")
+    return (_state(obj.get("state"), f"{where}.state"), _int(obj.get("action"), f"{where}.action"),
+            float(reward), _state(obj.get("next_state"), f"{where}.next_state"), done)
+
+
+def decode_predict(body):
+    """-> (state, possible_actions, k)"""
+    return _predict_request(_unpack(body), "request")
+
+
+def decode_feedback(body):
+    """-> (state, action, reward, next_state, done)"""
+    return _transition(_unpack(body), "request")
+
+
+def decode_predict_batch(body):
+    requests = _map(_unpack(body), "request").get("requests")
+    if type(requests) is not list:
+        raise WireError("request.requests: expected an array")
+    return [_predict_request(r, f"requests[{i}]") for i, r in enumerate(requests)]
+
+
+def decode_feedback_batch(body):
+    transitions = _map(_unpack(body), "request").get("transitions")
+    if type(transitions) is not list:
+        raise WireError("request.transitions: expected an array")
+    return [_transition(t, f"transitions[{i}]") for i, t in enumerate(transitions)]
+
+
+# Packer không thread-safe: mỗi thread giữ một cái (tái dùng buffer nội bộ)
+_local = threading.local()
+
+
+def _packer():
+    packer = getattr(_local, "packer", None)
+    if packer is None:
+        packer = _local.packer = msgpack.Packer(use_bin_type=True)
+    return packer
+
+
+def encode(obj):
+    return _packer().pack(obj)
+
+
+def _prediction(ranked, explored):
+    actions = [a for a, _ in ranked]
+    return {"action": actions[0] if actions else None, "actions": actions,
+            "q_values": dict(ranked), "explored": explored}
+
+
+def encode_prediction(ranked, explored):
+    """Response của /msgpack/predict từ ([(action, q)], explored) của agent.predict_ranked."""
+    return encode(_prediction(ranked, explored))
+
+
+def encode_predictions(results):
+    """results: [(ranked, explored), ...] -> {"results": [...]}"""
+    return encode({"results": [_prediction(r, e) for r, e in results]})
+
+
+def preencoded(obj):
+    """Encode một lần lúc khởi động (response cố định); None nếu không có msgpack."""
+    return msgpack.packb(obj, use_bin_type=True) if AVAILABLE else None